@@ -0,0 +1,164 @@
+import time
+
+from progress import total_done
+
+
+# 服务器限流时返回的状态码
+THROTTLE_STATUS = (429, 503)
+# 自适应模式的初始连接数
+ADAPTIVE_START = 2
+# 每个测量窗口的长度（秒）, 以及增加连接后吞吐量至少要提升的比例
+ADAPTIVE_INTERVAL = 2.0
+MIN_GAIN = 0.1
+# 连续这么久（秒）没有限流和重试后上限放宽一个连接, 一阵短暂的限流不会压低整个下载的连接数
+CEILING_RECOVERY = 30.0
+# 限流时最多等待的时间（秒）, 以及每个分段最多因限流重发几次请求（不计入重试次数）
+MAX_RETRY_AFTER = 10
+MAX_THROTTLE_WAITS = 10
+
+
+def retry_after(value):
+    """
+    解析 Retry-After 响应头（秒数形式）, 缺失或无法解析时等待 1 秒, 最多 MAX_RETRY_AFTER 秒。
+    """
+    try:
+        return min(max(float(value), 0), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class ConnectionController:
+    """
+    根据测得的总吞吐量自动调整连接数。
+
+    从 ADAPTIVE_START 个连接开始, 每个测量窗口结束时:
+
+    - 出现 429/503 或分段重试时减少约四分之一的连接, 并把上限降到这个值;
+    - 上一次增加连接后吞吐量提升不足 MIN_GAIN 时退回增加前的连接数, 同样降低上限;
+    - 否则在上限内继续增加连接: 起步阶段每次翻倍, 第一次回退后每次加一。
+
+    上限降低后连续 recovery 秒没有限流和重试时放宽一个连接（不超过 maximum）, 之后照常试探,
+    仍然限流或没有提升时再次降低。
+
+    连接数变化通过 scheduler.limit 通知 worker, 增加时调用 spawn 启动新的 worker,
+    减少时多出的 worker 下载完手上的分段后自行退出。
+    """
+    def __init__(self, scheduler, spawn, maximum, initial=ADAPTIVE_START, interval=ADAPTIVE_INTERVAL,
+                 recovery=CEILING_RECOVERY):
+        """
+        Args:
+            scheduler (Scheduler): 分段调度器。
+            spawn (Callable[[], None]): 启动一个新 worker, 调用前已经通过 scheduler.add_worker 计数。
+            maximum (int): 用户设置的连接数上限。
+            initial (int, optional): 初始连接数。默认为 ADAPTIVE_START。
+            interval (float, optional): 测量窗口长度（秒）。默认为 ADAPTIVE_INTERVAL。
+            recovery (float, optional): 上限降低后放宽一个连接所需的无限流时间（秒）。默认为 CEILING_RECOVERY。
+
+        """
+        self.scheduler = scheduler
+        self.spawn = spawn
+        self.maximum = max(1, maximum)
+        self.ceiling = self.maximum
+        self.target = min(max(1, initial), self.maximum)
+        self.interval = interval
+        self.recovery = recovery
+        self.slow_start = True
+        self.last_action = None
+        self.previous_target = self.target
+        self.base_throughput = 0.0
+        self.throughput = 0.0
+        self.decisions = []
+        # 每个连接数下累计的 [秒数, 字节数, 请求数, 限流次数, 重试次数], 下载结束后由 profiles 按连接数分别记录
+        self.samples = {}
+        self.last_time = time.monotonic()
+        # 上限最近一次降低或放宽的时间
+        self.ceiling_time = self.last_time
+        self.last_total = total_done(scheduler.segments())
+        self.last_errors = self.count_errors()
+        self.apply()
+
+    def count_errors(self):
+        """
+        Returns:
+            Tuple[int, int, int]: 所有分段累计的限流次数、重试次数和请求数。
+        """
+        throttled = retries = requests = 0
+        for slot in self.scheduler.segments():
+            throttled += slot.throttled
+            retries += slot.retries
+            requests += slot.requests
+        return throttled, retries, requests
+
+    def apply(self):
+        self.scheduler.limit.value = self.target
+        while self.scheduler.workers.value < self.target and self.scheduler.has_work():
+            self.scheduler.add_worker()
+            self.spawn()
+
+    def decide(self, target, reason):
+        message = f"连接数 {self.target} -> {target}: {reason}"
+        self.target = target
+        self.decisions.append((time.time(), message))
+        self.apply()
+        return message
+
+    def update(self):
+        """
+        由进度刷新循环定期调用, 不足一个测量窗口时直接返回。
+
+        Returns:
+            str | None: 本次调整的说明, 没有调整时返回None。
+
+        """
+        now = time.monotonic()
+        if now - self.last_time < self.interval:
+            return None
+        total = total_done(self.scheduler.segments())
+        self.throughput = (total - self.last_total) / (now - self.last_time)
+        errors = self.count_errors()
+        throttled, retries, requests = (new - old for new, old in zip(errors, self.last_errors))
+        if self.scheduler.has_work():
+            # 收尾阶段的吞吐量不代表这个连接数的速度, 不计入
+            sample = self.samples.setdefault(self.target, [0.0, 0, 0, 0, 0])
+            for i, value in enumerate((now - self.last_time, max(0, total - self.last_total), requests, throttled, retries)):
+                sample[i] += value
+        self.last_time, self.last_total = now, total
+        self.last_errors = errors
+        speed = f"{self.throughput / 1024 ** 2:.2f}MB/s"
+        if throttled or retries:
+            self.slow_start = False
+            self.last_action = 'down'
+            target = max(1, self.target - max(1, self.target // 4))
+            self.ceiling = target
+            self.ceiling_time = now
+            if throttled:
+                reason = f"服务器限流 {throttled} 次 (429/503)"
+            else:
+                reason = f"分段重试 {retries} 次"
+            return self.decide(target, reason)
+        if not self.scheduler.has_work():
+            # 只剩收尾的分段, 吞吐量下降不代表连接过多
+            return None
+        if self.last_action == 'up' and self.throughput < self.base_throughput * (1 + MIN_GAIN):
+            self.slow_start = False
+            self.last_action = 'down'
+            self.ceiling = self.previous_target
+            self.ceiling_time = now
+            return self.decide(self.previous_target, f"增加连接后吞吐量未提升 ({speed})")
+        if self.ceiling < self.maximum and now - self.ceiling_time >= self.recovery:
+            self.ceiling += 1
+            self.ceiling_time = now
+        limit = min(self.maximum, self.ceiling)
+        if self.target < limit:
+            self.last_action = 'up'
+            self.previous_target = self.target
+            self.base_throughput = self.throughput
+            target = min(limit, self.target * 2 if self.slow_start else self.target + 1)
+            return self.decide(target, f"吞吐量 {speed}")
+        self.last_action = None
+        # 连接数没有变化时补齐因异常退出的 worker
+        self.apply()
+        return None
+
+    def status(self):
+        return f"{self.scheduler.workers.value}/{self.target} 连接 (上限 {min(self.maximum, self.ceiling)})"
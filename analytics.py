@@ -0,0 +1,104 @@
+import optparse
+import datetime
+import unicodedata
+
+from data import Database
+from task_queue import DEFAULT_MAX_CONNECTIONS
+from throughput import format_speed
+from profiles import HostProfile
+
+
+def format_bytes(size):
+    for power, unit in ((3, 'GB'), (2, 'MB'), (1, 'KB')):
+        if size >= 1024 ** power:
+            return f'{size / 1024 ** power:.2f}{unit}'
+    return f'{size}B'
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def display_width(text):
+    # 中文等宽字符在终端中占两列
+    return sum(2 if unicodedata.east_asian_width(char) in 'WF' else 1 for char in text)
+
+
+def pad(text, width, left=True):
+    space = ' ' * (width - display_width(text))
+    return text + space if left else space + text
+
+
+def print_lines(lines):
+    widths = [max(display_width(line[i]) for line in lines) for i in range(len(lines[0]))]
+    for line in lines:
+        print('  '.join(pad(cell, widths[i], left=i == 0) for i, cell in enumerate(line)))
+    print()
+
+
+def print_table(title, rows):
+    """
+    打印 Database.host_stats / daily_stats 的结果。
+    """
+    lines = [(title, '次数', '成功', '下载量', '下载时间', '平均速度', '平均连接数', '重试')]
+    for key, count, ok, size, duration, throughput, connections, retries in rows:
+        lines.append((
+            str(key or '-'),
+            str(count),
+            str(ok),
+            format_bytes(size),
+            format_duration(duration),
+            format_speed(throughput) if throughput is not None else '-',
+            f'{connections:.1f}' if connections is not None else '-',
+            str(retries),
+        ))
+    print_lines(lines)
+
+
+def print_profiles(database):
+    """
+    打印各主机的性能记录, 以及下一次下载会使用的连接数和分段大小。
+    """
+    lines = [('主机', '次数', 'Range', '最佳连接数', '速度', '限流', '重试', '下次连接数', '分段大小')]
+    for row in database.get_host_profiles():
+        host, downloads, range_support, best, throughput, throttle_rate, error_rate, segment_size, updated = row
+        recommended = HostProfile.load(database, host).recommend(DEFAULT_MAX_CONNECTIONS)
+        lines.append((
+            host or '-',
+            str(downloads),
+            '-' if range_support is None else ('是' if range_support else '否'),
+            str(best) if best is not None else '-',
+            format_speed(throughput) if throughput is not None else '-',
+            f'{throttle_rate:.1%}' if throttle_rate is not None else '-',
+            f'{error_rate:.1%}' if error_rate is not None else '-',
+            str(recommended) if recommended is not None else '-',
+            format_bytes(segment_size) if segment_size is not None else '-',
+        ))
+    print_lines(lines)
+
+
+def opt():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-d', '--days', dest='days', default='0', help='Only include downloads of the last N days, 0 for all')
+    parser.add_option('--by', dest='by', default='host,day,profile',
+                      help='Reports to print, comma separated: host, day and/or profile (learned per-host profiles)')
+    options, args = parser.parse_args()
+    return options, args
+
+
+if __name__ == '__main__':
+    options, args = opt()
+    days = int(options.days)
+    since = None
+    if days > 0:
+        since = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    reports = options.by.split(',')
+    database = Database()
+    if 'host' in reports:
+        print_table('主机', database.host_stats(since))
+    if 'day' in reports:
+        print_table('日期', database.daily_stats(since))
+    if 'profile' in reports:
+        # 主机记录是平滑后的累计结果, 不受 --days 限制
+        print_profiles(database)
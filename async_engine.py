@@ -0,0 +1,392 @@
+import re
+import ssl
+import time
+import asyncio
+import threading
+import functools
+
+from urllib.parse import urlsplit, urljoin
+
+from storage import RangeWriter, DEFAULT_BUFFER_SIZE
+from progress import record_written, SEGMENT_RUNNING, SEGMENT_DONE
+from adaptive import THROTTLE_STATUS, MAX_THROTTLE_WAITS, retry_after
+from connection import DRAIN_LIMIT
+from mirrors import MirrorDisabled
+
+
+READ_SIZE = 64 * 1024
+READ_TIMEOUT = 30
+MAX_REDIRECTS = 5
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """
+    返回进程内共享的事件循环, 第一次调用时在后台守护线程中启动。
+
+    所有使用 asyncio 引擎的下载任务（包括多个文件同时下载）都运行在这一个事件循环上。
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name='async-engine', daemon=True)
+            thread.start()
+        return _loop
+
+
+class HTTPConnection:
+    """
+    基于 asyncio 非阻塞 socket 的最小 HTTP/1.1 客户端, 只实现分段下载需要的 GET + Range。
+
+    同一个连接在响应体读完后可以继续发送下一个请求（keep-alive）。
+    """
+    def __init__(self, url: str):
+        self.url = url
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.reader = None
+        self.writer = None
+        self.reusable = False
+        self.body_left = 0
+        self.handshakes = 0
+
+    def same_origin(self, url):
+        parts = urlsplit(url)
+        return (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)) == \
+            (self.scheme, self.host, self.port)
+
+    async def open(self):
+        context = ssl.create_default_context() if self.scheme == 'https' else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context), READ_TIMEOUT)
+        self.handshakes += 1
+
+    async def request(self, url, headers):
+        """
+        发送 GET 请求并读取响应头。
+
+        Returns:
+            Tuple[int, dict]: 状态码和小写键名的响应头。
+
+        """
+        reused = self.writer is not None and self.reusable
+        if not reused:
+            self.close()
+            await self.open()
+        try:
+            return await self.send(url, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if not reused:
+                raise
+        # 空闲的 keep-alive 连接可能已被服务器关闭, 换一个新连接再试一次
+        self.close()
+        await self.open()
+        return await self.send(url, headers)
+
+    async def send(self, url, headers):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = [f'GET {path} HTTP/1.1', f'Host: {parts.netloc}']
+        lines += [f'{key}: {value}' for key, value in headers.items()]
+        lines += ['Accept-Encoding: identity', 'Connection: keep-alive', '', '']
+        self.writer.write('\r\n'.join(lines).encode('latin-1'))
+        await self.writer.drain()
+        head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), READ_TIMEOUT)
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        version, status = status_line.split(' ', 2)[:2]
+        response_headers = {}
+        for line in header_lines:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                response_headers[key.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            self.reusable = False
+            raise ConnectionError('chunked 响应不支持分段下载')
+        length = response_headers.get('content-length')
+        if length is None and status == '206':
+            # 没有 Content-Length 时按 Content-Range 计算长度; 两者都没有就无法判断分段是否完整
+            match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', response_headers.get('content-range', ''))
+            if match is None:
+                self.reusable = False
+                raise ConnectionError('206 响应没有 Content-Length 和 Content-Range')
+            length = int(match.group(2)) - int(match.group(1)) + 1
+        self.body_left = int(length or 0)
+        self.reusable = (version != 'HTTP/1.0'
+                         and response_headers.get('connection', '').lower() != 'close')
+        return int(status), response_headers
+
+    async def read(self, size=READ_SIZE):
+        """
+        读取响应体的下一块数据, 响应体读完后返回 b''。
+        """
+        if self.body_left <= 0:
+            return b''
+        data = await asyncio.wait_for(self.reader.read(min(size, self.body_left)), READ_TIMEOUT)
+        if not data:
+            self.reusable = False
+            raise ConnectionError('连接被提前关闭')
+        self.body_left -= len(data)
+        return data
+
+    async def drain(self):
+        while self.body_left > 0:
+            await self.read()
+
+    async def release(self):
+        """
+        不再需要剩余的响应体时调用: 剩余不超过 DRAIN_LIMIT 时读完丢弃以保留连接, 否则断开。
+        """
+        if self.body_left > DRAIN_LIMIT:
+            self.close()
+        else:
+            await self.drain()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        self.reusable = False
+
+
+class BadStatus(ConnectionError):
+    """
+    服务器返回了非预期的状态码。响应体已经处理完, 连接仍可用于重试。
+    """
+
+
+class Throttled(BadStatus):
+    """
+    服务器返回 429/503, delay 为 Retry-After 给出的等待时间（秒）。
+    """
+    def __init__(self, delay):
+        super().__init__(f'服务器限流, {delay} 秒后重试')
+        self.delay = delay
+
+
+def check_writer(writer, fsync):
+    """
+    检查写入后端和 fsync 策略能否用于 asyncio 引擎。
+
+    所有连接共用事件循环线程, 写入时的阻塞会拖住全部连接。关闭 writer 时的 drain 和 fsync 由 close_writer
+    放到线程池中, 但 pwrite/mmap 的定期 fsync 发生在写入过程中, 只能由 coalesce 的写线程代为同步。
+
+    Raises:
+        ValueError: 组合不能用于 asyncio 引擎。
+
+    """
+    if fsync == 'interval' and writer != 'coalesce':
+        raise ValueError(f"asyncio 引擎定期 fsync 时需要使用 coalesce 写入后端, 不能使用 {writer}")
+
+
+async def close_writer(output):
+    """
+    在线程池中关闭 writer（coalesce 要等写线程写完, fsync 策略为 'close' 时还要同步）, 不阻塞事件循环。
+
+    关闭期间协程被取消（暂停）时仍等到关闭完成才退出, AsyncDownload.join 返回时数据已经写入文件。
+    """
+    future = asyncio.get_running_loop().run_in_executor(None, output.close)
+    cancelled = False
+    while not future.done():
+        try:
+            await asyncio.wait([future])
+        except asyncio.CancelledError:
+            cancelled = True
+    if cancelled:
+        raise asyncio.CancelledError
+    future.result()
+
+
+async def fetch_segment(connection, url, headers, slot, filepath, buffer_size, writer=RangeWriter, meter=None, limiter=None):
+    """
+    在已有连接上下载分段中还没有写入的部分, 必要时跟随重定向。meter 不为None 时每收到一块数据向镜像列表汇报进度,
+    limiter 不为None 时按限速器给出的时间等待（不阻塞事件循环）。
+
+    Returns:
+        HTTPConnection: 下载结束后可继续复用的连接（重定向到其它主机时会换成新连接）。
+
+    """
+    start = slot.start + slot.written
+    if not connection.same_origin(url):
+        # 换到了其它镜像
+        connection.close()
+        connection = HTTPConnection(url)
+    request_headers = dict(headers or {})
+    request_headers['Range'] = f'bytes={start}-{slot.end}'
+    for _ in range(MAX_REDIRECTS + 1):
+        opened = connection.handshakes
+        status, response_headers = await connection.request(url, request_headers)
+        slot.requests += 1
+        slot.connections += connection.handshakes - opened
+        if status not in (301, 302, 303, 307, 308):
+            break
+        await connection.drain()
+        location = response_headers.get('location')
+        if location is None:
+            # 与其它非预期的状态码一样重试, 用尽后放回等待队列
+            raise BadStatus(f'HTTP {status} without Location')
+        url = urljoin(url, location)
+        if not connection.same_origin(url):
+            connection.close()
+            connection = HTTPConnection(url)
+    if status != 206 and not (status == 200 and start == 0):
+        # 错误页通常很短, 读完后连接可以继续用于重试
+        await connection.release()
+        if status in THROTTLE_STATUS:
+            raise Throttled(retry_after(response_headers.get('retry-after')))
+        raise BadStatus(f'HTTP {status}')
+    output = writer(filepath, start, buffer_size, on_flush=functools.partial(record_written, slot))
+    try:
+        position = start
+        while True:
+            chunk = await connection.read()
+            if not chunk:
+                break
+            # 其它协程可能拆走本分段的后一半, 以槽位中最新的 end 为准
+            remaining = slot.end - position + 1
+            if remaining <= 0:
+                break
+            chunk = chunk[:remaining]
+            output.write(chunk)
+            position += len(chunk)
+            slot.done += len(chunk)
+            slot.updated = time.time()
+            if meter is not None:
+                meter.check()
+            if limiter is not None and limiter.limited:
+                # 限速器的锁由多个进程共用, 可能要等上一会儿, 在线程池中预约
+                delay = await asyncio.to_thread(limiter.reserve, len(chunk))
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if position > slot.end:
+                break
+    finally:
+        await close_writer(output)
+    if position <= slot.end:
+        # 响应体比请求的范围短: 已写入的部分保留在槽位中, 重试时从 written 继续
+        raise ConnectionError('连接在分段结束前被关闭')
+    # 分段被拆分后剩余的响应体不再需要, 剩余不多时读完丢弃, 把连接留给下一个分段
+    await connection.release()
+    return connection
+
+
+async def download_worker(mirrors, headers, scheduler, filepath, retry_count, buffer_size, writer=RangeWriter, limiter=None):
+    """
+    一个连接对应一个协程, 从调度器领取分段并在同一个 keep-alive 连接上依次下载。
+
+    每次请求的结果汇报给 MirrorSet, 当前镜像被停用后换到其它镜像。
+    """
+    mirror = mirrors.acquire()
+    connection = HTTPConnection(mirrors.urls[mirror])
+    try:
+        while True:
+            index = scheduler.next_segment()
+            if index is None:
+                return
+            slot = scheduler.progress[index]
+            slot.state = SEGMENT_RUNNING
+            attempt = throttled = 0
+            while attempt < retry_count:
+                # 从已写入磁盘的位置继续（重试时只补下载丢失的部分）, 之前收到但没有写入的字节不再计入进度
+                slot.done = slot.written
+                if slot.start + slot.written > slot.end:
+                    # 出错之前数据已经全部写入
+                    slot.state = SEGMENT_DONE
+                    break
+                meter = mirrors.meter(mirror, slot)
+                try:
+                    connection = await fetch_segment(connection, mirrors.urls[mirror], headers, slot, filepath,
+                                                     buffer_size, writer, meter, limiter)
+                    mirror = meter.report()
+                    slot.state = SEGMENT_DONE
+                    break
+                except MirrorDisabled:
+                    # 换到其它镜像重新请求, 不计入重试次数
+                    connection.close()
+                    mirror = meter.next
+                except Throttled as e:
+                    # 限流不消耗重试次数, 等待后重发, 次数供自适应连接数参考
+                    mirror = meter.report()
+                    slot.throttled += 1
+                    throttled += 1
+                    if throttled >= MAX_THROTTLE_WAITS:
+                        # 与进程引擎一致: 每次重试最多等待 MAX_THROTTLE_WAITS 次限流
+                        attempt += 1
+                        throttled = 0
+                    await asyncio.sleep(e.delay)
+                except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError) as e:
+                    mirror = meter.report(ok=False)
+                    if not isinstance(e, BadStatus):
+                        connection.close()
+                    attempt += 1
+                    if attempt < retry_count:
+                        slot.retries += 1
+            else:
+                # 放回等待队列交给下一个领取分段的协程, 再次用尽重试次数才标记为失败
+                scheduler.fail(index)
+    except BaseException:
+        # 包括暂停时取消协程的 CancelledError
+        scheduler.leave()
+        raise
+    finally:
+        mirrors.release(mirror)
+        connection.close()
+
+
+class AsyncDownload:
+    """
+    运行在共享事件循环上的下载任务, 提供与 multiprocessing.Process 相同的
+    is_alive/terminate/join 接口, 因此 GUI 和命令行可以像管理进程一样管理它。
+
+    每个连接是一个独立的协程, 自适应连接数可以通过 add_worker 随时增加连接。
+    """
+    def __init__(self, mirrors, headers, scheduler, filepath, retry_count, buffer_size=DEFAULT_BUFFER_SIZE, writer=RangeWriter,
+                 limiter=None):
+        self.args = (mirrors, headers, scheduler, filepath, retry_count, buffer_size, writer, limiter)
+        self.loop = get_loop()
+        # 只在事件循环线程中访问
+        self.tasks = []
+        # 每个协程一个, 协程连同清理（写缓冲区落盘、关闭连接）全部结束后才设置, 包括被取消的协程
+        self.finished = []
+
+    def add_worker(self):
+        done = threading.Event()
+        self.finished.append(done)
+        self.loop.call_soon_threadsafe(self.create_task, done)
+
+    def create_task(self, done):
+        task = self.loop.create_task(download_worker(*self.args))
+        task.add_done_callback(functools.partial(self.task_done, done))
+        self.tasks.append(task)
+
+    @staticmethod
+    def task_done(done, task):
+        if not task.cancelled():
+            # 与进程引擎一致: worker 的异常不向外抛出, 结果以进度数组为准
+            task.exception()
+        done.set()
+
+    def is_alive(self):
+        return not all(done.is_set() for done in self.finished)
+
+    def terminate(self):
+        # 在事件循环线程中排在 create_task 之后执行, 已经追加的协程都会被取消
+        self.loop.call_soon_threadsafe(self.cancel_tasks)
+
+    def cancel_tasks(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def kill(self):
+        self.terminate()
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for done in list(self.finished):
+            done.wait(None if deadline is None else max(0, deadline - time.monotonic()))
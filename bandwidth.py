@@ -0,0 +1,136 @@
+import re
+import time
+import contextlib
+import multiprocessing
+
+
+# 空闲之后允许立即通过的流量（秒）, 越小越平滑
+BURST_SECONDS = 0.05
+# 锁内只有几行计算, 超过这个时间（秒）还拿不到锁, 说明持有者在锁内被结束了（暂停时 terminate 进程）
+LOCK_TIMEOUT = 0.5
+
+_global_limiter = None
+
+
+class RateLimiter:
+    """
+    跨进程共享的令牌桶限速器。
+
+    以虚拟调度（GCRA）的方式实现: 共享内存中只保存速率和“下一份流量理论上可以通过的时间”,
+    worker 每收到一块数据调用 reserve 预约, 得到需要等待的时间后自行 sleep（asyncio 引擎用
+    asyncio.sleep）, 不会忙等。每次最多放行 BURST_SECONDS 的突发流量, 流量按块均匀分布。
+
+    限速器可以串联: reserve 同时向 parent 预约, 等待时间取两者的较大值。
+    每个下载任务使用一个以全局限速器为 parent 的任务限速器, 因此任务限速和全局限速同时生效。
+    速率保存在共享内存中, 下载过程中调用 set_rate 对所有 worker 立即生效。
+
+    暂停时 worker 进程被直接结束, 可能正好持有锁。锁在 LOCK_TIMEOUT 内拿不到时就当作已经持有继续计算,
+    用完照常释放, 锁因此恢复可用, 其他任务和界面不会卡住。
+    """
+    def __init__(self, rate: float=0, parent=None):
+        """
+        Args:
+            rate (float, optional): 速率（字节/秒）, 0 表示不限速。默认为0。
+            parent (RateLimiter, optional): 上一级限速器, 通常为 global_limiter()。默认为None。
+
+        """
+        self.rate = multiprocessing.RawValue('d', max(0, rate))
+        self.next_time = multiprocessing.RawValue('d', 0.0)
+        self.lock = multiprocessing.Lock()
+        self.parent = parent
+
+    @property
+    def limited(self):
+        """
+        bool: 自身或上一级是否在限速。都不限速时 reserve 不加锁, 立即返回0。
+        """
+        return self.rate.value > 0 or (self.parent is not None and self.parent.limited)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        持有锁执行, 锁的持有者已经被结束时接管它。
+        """
+        self.lock.acquire(timeout=LOCK_TIMEOUT)
+        try:
+            yield
+        finally:
+            try:
+                self.lock.release()
+            except ValueError:
+                # 超时接管时原持有者其实还活着（被长时间挂起）, 它已经释放过
+                pass
+
+    def set_rate(self, rate):
+        with self.locked():
+            self.rate.value = max(0, rate)
+            # 新速率从现在开始计算, 不继承按旧速率积累的等待时间
+            self.next_time.value = time.monotonic()
+
+    def reserve(self, size):
+        """
+        预约 size 字节的流量。
+
+        Returns:
+            float: 调用方需要等待的时间（秒）。
+
+        """
+        delay = self.parent.reserve(size) if self.parent is not None else 0.0
+        rate = self.rate.value
+        if rate <= 0:
+            return delay
+        with self.locked():
+            now = time.monotonic()
+            start = max(self.next_time.value, now)
+            self.next_time.value = start + size / rate
+            return max(delay, self.next_time.value - now - BURST_SECONDS)
+
+    def wait(self, size):
+        """
+        预约 size 字节的流量并阻塞到可以继续为止。
+        """
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def global_limiter():
+    """
+    返回进程内所有下载任务共享的全局限速器。
+
+    需要在启动 worker 之前调用: worker 通过任务限速器的 parent 拿到同一块共享内存。
+    """
+    global _global_limiter
+    if _global_limiter is None:
+        _global_limiter = RateLimiter()
+    return _global_limiter
+
+
+def task_limiter(rate=0):
+    """
+    创建一个下载任务的限速器, 同时受全局限速器限制。
+    """
+    return RateLimiter(rate, parent=global_limiter())
+
+
+def parse_rate(text):
+    """
+    解析 '512K'、'2M'、'1.5M' 这样的速率（字节/秒）, 不带单位时为字节, 0 表示不限速。
+
+    Raises:
+        ValueError: 格式不正确。
+
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?(?:/S)?\s*', text.upper())
+    if match is None:
+        raise ValueError(f'无法识别的速率: {text}')
+    return int(float(match.group(1)) * 1024 ** ' KMG'.index(match.group(2) or ' '))
+
+
+def format_rate(rate):
+    if rate <= 0:
+        return '不限速'
+    for power, unit in ((3, 'G'), (2, 'M'), (1, 'K')):
+        if rate >= 1024 ** power:
+            return f'{rate / 1024 ** power:.4g}{unit}B/s'
+    return f'{rate:.0f}B/s'
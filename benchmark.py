@@ -0,0 +1,456 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import optparse
+import platform
+import tempfile
+import itertools
+import contextlib
+import subprocess
+import multiprocessing
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from progress import connection_stats
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块, CPU 时间和内存峰值记为None
+    resource = None
+
+
+SEND_SIZE = 64 * 1024
+FRONTENDS = ['downloader', 'main']
+ENGINES = ['process', 'asyncio']
+
+
+def parse_size(text):
+    """
+    把 '512K'、'16M'、'1G' 或纯数字解析为字节数。
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*([KMG]?)B?\s*', text.upper())
+    if match is None:
+        raise ValueError(f'无法解析大小: {text}')
+    return int(match.group(1)) * 1024 ** ' KMG'.index(match.group(2) or ' ')
+
+
+def format_size(size):
+    for power, unit in ((3, 'G'), (2, 'M'), (1, 'K')):
+        if size >= 1024 ** power and size % 1024 ** power == 0:
+            return f'{size // 1024 ** power}{unit}'
+    return str(size)
+
+
+def prepare_file(root, size):
+    """
+    在 root 下生成指定大小的随机内容文件, 已存在时直接复用。
+
+    Returns:
+        Tuple[str, str]: 文件名和 sha256 十六进制值。
+
+    """
+    filename = f'{size}.bin'
+    filepath = os.path.join(root, filename)
+    if not os.path.exists(filepath) or os.path.getsize(filepath) != size:
+        with open(filepath, 'wb') as f:
+            left = size
+            while left:
+                data = os.urandom(min(1024 * 1024, left))
+                f.write(data)
+                left -= len(data)
+    return filename, file_sha256(filepath)
+
+
+def file_sha256(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    支持 Range 的静态文件服务, 可以按连接限速并模拟往返延迟。
+
+    server.rate 为每个连接的带宽（字节/秒, 0 表示不限速）, server.latency 为每个请求返回响应头前的等待时间（秒）。
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_file(self, body):
+        filepath = os.path.join(self.server.root, os.path.basename(self.path.split('?')[0]))
+        if not os.path.isfile(filepath):
+            self.send_error(404)
+            return
+        size = os.path.getsize(filepath)
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get('Range')
+        if range_header:
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', range_header.strip())
+            if match is None or int(match.group(1)) >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            status = 206
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', f'"{int(os.path.getmtime(filepath))}-{size}"')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not body:
+            return
+        begin = time.monotonic()
+        sent = 0
+        with open(filepath, 'rb') as f:
+            f.seek(start)
+            left = end - start + 1
+            while left:
+                data = f.read(min(SEND_SIZE, left))
+                try:
+                    self.wfile.write(data)
+                except ConnectionError:
+                    # 分段被拆分后客户端会提前断开连接
+                    self.close_connection = True
+                    return
+                left -= len(data)
+                sent += len(data)
+                if self.server.rate:
+                    # 按已发送字节数计算应当经过的时间, 不足时再发送下一块
+                    delay = sent / self.server.rate - (time.monotonic() - begin)
+                    if delay > 0:
+                        time.sleep(delay)
+
+    def do_HEAD(self):
+        self.send_file(body=False)
+
+    def do_GET(self):
+        self.send_file(body=True)
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root, rate=0, latency=0.0):
+        """
+        Args:
+            address (Tuple[str, int]): 监听地址, 端口为0时由系统分配。
+            root (str): 文件目录。
+            rate (int, optional): 每个连接的带宽（字节/秒）, 0 表示不限速。默认为0。
+            latency (float, optional): 每个请求的额外延迟（秒）。默认为0。
+
+        """
+        self.root = root
+        self.rate = rate
+        self.latency = latency
+        super().__init__(address, RangeRequestHandler)
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开是正常情况, 其它异常照常输出
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(root, rate, latency, port=0, ready=None):
+    server = BenchmarkServer(('127.0.0.1', port), root, rate, latency)
+    if ready is not None:
+        ready.send(server.server_address[1])
+        ready.close()
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def start_server(root, rate=0, latency=0.0):
+    """
+    在独立进程中启动测试服务器, 避免服务器占用的 CPU 计入被测下载器。
+
+    Yields:
+        int: 服务器端口。
+
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=serve, args=(root, rate, latency, 0, sender), daemon=True)
+    process.start()
+    port = receiver.recv()
+    try:
+        yield port
+    finally:
+        process.terminate()
+        process.join()
+
+
+def proc_io():
+    """
+    读取 /proc/self/io 中的读写类系统调用次数, 已回收的子进程也会计入。
+    """
+    try:
+        with open('/proc/self/io') as f:
+            values = dict(line.split(': ') for line in f.read().splitlines() if ': ' in line)
+        return int(values['syscr']) + int(values['syscw'])
+    except OSError:
+        return None
+
+
+def usage():
+    """
+    Returns:
+        Tuple[float | None, float | None]: 本进程及已回收子进程的 CPU 时间（秒）和单个进程的内存峰值（MB）。
+
+    """
+    if resource is None:
+        return None, None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    # Linux 下 ru_maxrss 单位为 KB, macOS 为字节
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return cpu, max(own.ru_maxrss, children.ru_maxrss) / scale
+
+
+def run_downloader(url, root, case):
+    from downloader import Downloader
+    d = Downloader(url, root=root, threads=case['threads'], buffer_size=case['buffer_size'],
+                   resume=False, engine=case['engine'], writer=case['writer'], fsync=case['fsync'],
+                   adaptive=case['adaptive'], limit=case['limit'])
+    d.run()
+    return d.filepath, d.scheduler.segments()
+
+
+def run_main(url, root, case):
+    import main
+    from bandwidth import task_limiter
+    filepath = os.path.join(root, 'main.bin')
+    processes, scheduler, info, journal, controller, mirrors = main.download(
+        url, {}, filepath, case['threads'], 3, buffer_size=case['buffer_size'], engine=case['engine'],
+        writer=case['writer'], fsync=case['fsync'], adaptive=case['adaptive'], limiter=task_limiter(case['limit']))
+    if controller is None:
+        # 最后一个 worker 退出时立即返回, 不受轮询间隔影响
+        main.wait_workers(processes)
+    else:
+        while any(process.is_alive() for process in processes):
+            controller.update()
+            time.sleep(0.1)
+    journal.remove()
+    return filepath, scheduler.segments()
+
+
+def run_case(case):
+    """
+    在当前进程中执行一次下载并测量资源占用, 由 run_matrix 在独立的子进程中调用,
+    保证每次测量的 CPU 时间、内存峰值和系统调用次数互不影响。
+    """
+    # 多个端口表示同一个文件的多个镜像
+    urls = [f"http://127.0.0.1:{port}/{case['filename']}" for port in case['ports']]
+    url = urls if len(urls) > 1 else urls[0]
+    runner = run_downloader if case['frontend'] == 'downloader' else run_main
+    syscalls_before = proc_io()
+    cpu_before, _ = usage()
+    begin = time.perf_counter()
+    # 下载器自身的进度输出不计入结果
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        filepath, progress = runner(url, case['root'], case)
+    seconds = time.perf_counter() - begin
+    cpu_after, peak_rss = usage()
+    syscalls_after = proc_io()
+    megabytes = case['file_size'] / 1024 ** 2
+    result = {
+        'seconds': round(seconds, 4),
+        'mb_per_s': round(megabytes / seconds, 2),
+        'cpu_seconds': round(cpu_after - cpu_before, 4) if cpu_before is not None else None,
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+        'syscalls': syscalls_after - syscalls_before if syscalls_before is not None else None,
+        'filepath': filepath,
+    }
+    # 握手次数应接近连接数, 远大于连接数说明 keep-alive 复用没有生效
+    result['connections'], result['requests'] = connection_stats(progress)
+    if result['syscalls'] is not None:
+        result['syscalls_per_mb'] = round(result['syscalls'] / megabytes, 1)
+    else:
+        result['syscalls_per_mb'] = None
+    return result
+
+
+def run_matrix(frontends, engines, threads, sizes, buffers, writers=('pwrite',), fsync='none', adaptive=False,
+               repeat=1, rate=0, latency=0.0, mirrors=1, limit=0, root=None):
+    """
+    在本地测试服务器上按参数矩阵逐个运行下载, 每个组合在新的子进程中执行。
+
+    Args:
+        frontends (List[str]): 'downloader'（命令行 Downloader）和/或 'main'（GUI 使用的 download()）。
+        engines (List[str]): 下载引擎。
+        threads (List[int]): 线程数。
+        sizes (List[int]): 文件大小（字节）。
+        buffers (List[int]): 每个线程的写入缓冲区大小（字节）。
+        writers (List[str], optional): 写入后端。默认为 ('pwrite',)。
+        fsync (str, optional): fsync 策略。默认为'none'。
+        adaptive (bool, optional): 是否使用自适应连接数, 此时 threads 为上限。默认为False。
+        repeat (int, optional): 每个组合重复的次数。默认为1。
+        rate (int, optional): 服务器每个连接的带宽（字节/秒）, 0 表示不限速。默认为0。
+        latency (float, optional): 服务器每个请求的额外延迟（秒）。默认为0。
+        mirrors (int, optional): 启动的服务器数量, 大于1时每次下载同时使用所有服务器作为镜像。默认为1。
+        limit (int, optional): 下载器的限速（字节/秒）, 0 表示不限速。默认为0。
+        root (str, optional): 存放测试文件的目录, 默认为临时目录。
+
+    Returns:
+        dict: 运行环境和每个组合的结果。
+
+    """
+    with contextlib.ExitStack() as stack:
+        if root is None:
+            root = stack.enter_context(tempfile.TemporaryDirectory(prefix='downloader-bench-'))
+        serve_root = os.path.join(root, 'serve')
+        os.makedirs(serve_root, exist_ok=True)
+        files = {size: prepare_file(serve_root, size) for size in sizes}
+        ports = [stack.enter_context(start_server(serve_root, rate, latency)) for _ in range(max(1, mirrors))]
+        results = []
+        for frontend, engine, writer, thread_count, size, buffer_size, index in itertools.product(
+                frontends, engines, writers, threads, sizes, buffers, range(repeat)):
+            filename, expected = files[size]
+            case = {
+                'frontend': frontend,
+                'engine': engine,
+                'writer': writer,
+                'fsync': fsync,
+                'adaptive': adaptive,
+                'limit': limit,
+                'threads': thread_count,
+                'file_size': size,
+                'buffer_size': buffer_size,
+                'repeat': index,
+            }
+            with tempfile.TemporaryDirectory(dir=root) as output:
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--case',
+                     json.dumps(dict(case, ports=ports, filename=filename, root=output))],
+                    cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+                if child.returncode != 0:
+                    case['error'] = child.stderr.strip().splitlines()[-1] if child.stderr.strip() else f'exit {child.returncode}'
+                else:
+                    measured = json.loads(child.stdout.strip().splitlines()[-1])
+                    case['ok'] = file_sha256(measured.pop('filepath')) == expected
+                    case.update(measured)
+            results.append(case)
+            print_result(case)
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'server': {'rate': rate, 'latency': latency, 'mirrors': mirrors},
+        'results': results,
+    }
+
+
+def case_key(case):
+    return (case['frontend'], case['engine'], case['writer'], case['threads'], case['file_size'], case['buffer_size'])
+
+
+def print_result(case):
+    text = (f"{case['frontend']:<10} {case['engine']:<7} {case['writer']:<8} t={case['threads']:<3} "
+            f"size={format_size(case['file_size']):<6} buf={format_size(case['buffer_size']):<6} ")
+    if 'error' in case:
+        print(text + f"失败: {case['error']}", flush=True)
+        return
+    text += (f"{case['mb_per_s']:>9.2f} MB/s  cpu={case['cpu_seconds']}s  rss={case['peak_rss_mb']}MB  "
+             f"syscalls/MB={case['syscalls_per_mb']}  conn={case['connections']}/{case['requests']}req")
+    if not case['ok']:
+        text += '  校验失败'
+    print(text, flush=True)
+
+
+def compare(report, baseline):
+    """
+    按参数组合对比两次运行, 同一组合重复多次时取平均速度。
+    """
+    def averages(results):
+        groups = {}
+        for case in results:
+            if 'error' not in case:
+                groups.setdefault(case_key(case), []).append(case['mb_per_s'])
+        return {key: sum(speeds) / len(speeds) for key, speeds in groups.items()}
+
+    current, previous = averages(report['results']), averages(baseline['results'])
+    print('\n与基准对比:')
+    for key, speed in current.items():
+        if key in previous:
+            frontend, engine, writer, threads, size, buffer_size = key
+            print(f"{frontend:<10} {engine:<7} {writer:<8} t={threads:<3} size={format_size(size):<6} buf={format_size(buffer_size):<6} "
+                  f"{previous[key]:>9.2f} -> {speed:>9.2f} MB/s ({speed / previous[key] - 1:+.1%})")
+
+
+def opt():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--frontends', dest='frontends', default='downloader,main', help='downloader and/or main, comma separated')
+    parser.add_option('--engines', dest='engines', default='process,asyncio', help='process and/or asyncio, comma separated')
+    parser.add_option('-t', '--threads', dest='threads', default='1,4,8', help='Thread counts, comma separated')
+    parser.add_option('--sizes', dest='sizes', default='16M,128M', help='File sizes, comma separated (K/M/G suffixes)')
+    parser.add_option('--buffers', dest='buffers', default='128K,1M', help='Buffer sizes, comma separated (K/M/G suffixes)')
+    parser.add_option('--writers', dest='writers', default='pwrite', help='Storage writers (pwrite, mmap, coalesce), comma separated')
+    parser.add_option('--fsync', dest='fsync', default='none', help='fsync policy: none, close or interval')
+    parser.add_option('--adaptive', dest='adaptive', action='store_true', default=False, help='Use adaptive connection counts, --threads are upper bounds')
+    parser.add_option('--repeat', dest='repeat', default='1', help='Runs per combination')
+    parser.add_option('--rate', dest='rate', default='0', help='Per-connection bandwidth in bytes/s (K/M/G suffixes), 0 for unlimited')
+    parser.add_option('--latency', dest='latency', default='0', help='Extra latency per request in milliseconds')
+    parser.add_option('--limit', dest='limit', default='0', help='Bandwidth limit of the downloader in bytes/s (K/M/G suffixes), 0 for unlimited')
+    parser.add_option('--mirrors', dest='mirrors', default='1', help='Number of test servers, each download uses all of them as mirrors')
+    parser.add_option('--root', dest='root', help='Directory for test files, a temporary directory by default')
+    parser.add_option('-o', '--output', dest='output', help='Write the results to this JSON file')
+    parser.add_option('--compare', dest='compare', help='Compare with a previous JSON result file')
+    parser.add_option('--serve', dest='serve', action='store_true', default=False, help='Only run the test server on --port')
+    parser.add_option('--port', dest='port', default='8000', help='Port for --serve')
+    parser.add_option('--case', dest='case', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    return options, args
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    options, args = opt()
+    if options.case:
+        print(json.dumps(run_case(json.loads(options.case))))
+        sys.exit()
+    rate = parse_size(options.rate)
+    latency = float(options.latency) / 1000
+    sizes = [parse_size(size) for size in options.sizes.split(',')]
+    if options.serve:
+        root = options.root or tempfile.mkdtemp(prefix='downloader-bench-')
+        for size in sizes:
+            prepare_file(root, size)
+        print(f"http://127.0.0.1:{options.port}/ -> {root}", flush=True)
+        serve(root, rate, latency, int(options.port))
+    report = run_matrix(
+        frontends=options.frontends.split(','),
+        engines=options.engines.split(','),
+        threads=[int(thread) for thread in options.threads.split(',')],
+        sizes=sizes,
+        buffers=[parse_size(size) for size in options.buffers.split(',')],
+        writers=options.writers.split(','),
+        fsync=options.fsync,
+        adaptive=options.adaptive,
+        repeat=int(options.repeat),
+        rate=rate,
+        latency=latency,
+        mirrors=int(options.mirrors),
+        limit=parse_size(options.limit),
+        root=options.root,
+        )
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
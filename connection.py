@@ -0,0 +1,66 @@
+import time
+import weakref
+
+from adaptive import THROTTLE_STATUS, MAX_THROTTLE_WAITS, retry_after
+
+
+# 响应体剩余不超过这个字节数时读完丢弃以保留连接, 更多时断开重连比读完更快
+DRAIN_LIMIT = 256 * 1024
+# 当前进程中已经统计过的 socket, 关闭并回收后自动移除
+_sockets = weakref.WeakSet()
+
+
+def count_connection(slot):
+    """
+    Returns:
+        Callable: 请求的 response 钩子, 响应使用新建立的连接（即新的 socket）时在 slot.connections 上加一。
+            钩子对重定向途中的每个响应都会调用, 重定向到其它主机的握手也计算在内。
+    """
+    def hook(response, **kwargs):
+        # 连接池在连接断开后会复用同一个连接对象重新握手, 因此按 socket 而不是连接对象判断
+        sock = getattr(response.raw.connection, 'sock', None)
+        if sock is not None and sock not in _sockets:
+            _sockets.add(sock)
+            slot.connections += 1
+        return response
+    return hook
+
+
+def release_connection(response):
+    """
+    不再需要剩余的响应体时调用: 剩余不超过 DRAIN_LIMIT 时读完丢弃, 把连接还给连接池供下一个请求复用;
+    否则（或长度未知时）直接断开。响应体已经读完时连接已自动归还, 不做任何事。
+    """
+    raw = response.raw
+    if raw.length_remaining is not None and raw.length_remaining <= DRAIN_LIMIT:
+        raw.drain_conn()
+        raw.release_conn()
+    else:
+        response.close()
+
+
+def get_segment(session, url, headers, slot):
+    """
+    在 worker 的会话上发送分段请求, 被限流（429/503）时按 Retry-After 等待后重发。
+
+    同一个会话按主机保持 keep-alive 连接池, 上一个分段（或失败前的请求）读完响应体后连接会还回池中,
+    所以同一个 worker 的后续分段和重试通常不需要重新握手。请求数和新建的连接数累计在槽位中。
+
+    限流次数记录在槽位中供 ConnectionController 参考, 但不消耗分段的重试次数;
+    连续被限流 MAX_THROTTLE_WAITS 次后返回最后一个响应, 由调用方的 raise_for_status 报错。
+
+    Returns:
+        requests.Response: 以 stream=True 发送的响应。
+
+    """
+    for _ in range(MAX_THROTTLE_WAITS):
+        response = session.get(url, headers=headers, stream=True, hooks={'response': count_connection(slot)})
+        slot.requests += 1
+        if response.status_code >= 400:
+            # 错误页通常很短, 读完后连接可以继续用于重试
+            release_connection(response)
+        if response.status_code not in THROTTLE_STATUS:
+            break
+        slot.throttled += 1
+        time.sleep(retry_after(response.headers.get('Retry-After')))
+    return response
@@ -1,6 +1,87 @@
 import os
+import re
+import atexit
 import sqlite3
 from configparser import ConfigParser
+from urllib.parse import urlsplit
+
+
+# 每个进程每个数据库文件一个长期保持的连接, 见 connect
+_connections = {}
+
+# 历史记录表的结构版本, 保存在 PRAGMA user_version 中
+HISTORY_SCHEMA_VERSION = 2
+# 版本 1 增加的数值列, 用于统计分析
+NUMERIC_COLUMNS = [
+    ('host', 'TEXT'),           # 下载地址的主机, 见 host_of
+    ('bytes', 'INTEGER'),       # 下载的字节数
+    ('duration', 'REAL'),       # 实际下载的时间（秒）, 不含暂停和排队
+    ('throughput', 'REAL'),     # 平均速度（字节/秒）
+    ('connections', 'INTEGER'), # 使用的连接数
+    ('retries', 'INTEGER'),     # 分段重试的总次数
+]
+HISTORY_COLUMNS = ('filename', 'url', 'status', 'start_time', 'end_time', 'size') + tuple(name for name, _ in NUMERIC_COLUMNS)
+
+
+def connect(path):
+    """
+    返回当前进程中 path 对应的共享连接, 第一次调用时创建。
+
+    连接使用 WAL 日志（读写互不阻塞, 提交只追加日志）和 synchronous=NORMAL（WAL 下断电最多丢失最近的提交,
+    不会损坏数据库）。sqlite3 在连接上缓存已编译的语句, 同一条 SQL 反复执行时不再重新解析。
+    以进程号区分连接: fork 出的子进程不能使用父进程的连接。
+    """
+    key = (os.getpid(), path)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _connections[key] = conn
+    return conn
+
+
+def parse_size(text):
+    """
+    把旧版本保存的 '512.00 MB' 这样的显示文本换算成字节数, 无法识别时返回None。
+    """
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?B)\s*', text or '')
+    if match is None:
+        return None
+    return int(float(match.group(1)) * 1024 ** ['B', 'KB', 'MB', 'GB'].index(match.group(2)))
+
+
+def host_of(url):
+    """
+    Returns:
+        str: 按主机统计和保存主机记录时使用的键, 为主机名, 地址中写明端口时带上端口（同一台机器上不同端口通常是不同的服务）。
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    try:
+        port = parts.port
+    except ValueError:
+        # 输入到一半的地址, 端口还不完整
+        port = None
+    return f'{host}:{port}' if port else host
+
+
+def history_row(filename, url, status, start_time, end_time, size, bytes=None, duration=None, connections=None, retries=None):
+    """
+    按 HISTORY_COLUMNS 的顺序生成一条历史记录, 主机名和平均速度由地址、字节数和时间推算。
+    """
+    throughput = bytes / duration if bytes is not None and duration else None
+    return (filename, url, status, start_time, end_time, size,
+            host_of(url), bytes, duration, throughput, connections, retries)
+
+
+@atexit.register
+def close_connections():
+    # 关闭最后一个连接时 SQLite 会把 WAL 合并回数据库文件
+    for (pid, _), conn in list(_connections.items()):
+        if pid == os.getpid():
+            conn.close()
+    _connections.clear()
 
 
 class Database:
@@ -17,23 +98,29 @@ class Database:
             self.base_path = os.getenv('HOME')
         self.database_filename = 'downloader.db'
         self.table_name = 'download_history'
+        self.profile_table = 'host_profiles'
+        self.connection_stats_table = 'host_connection_stats'
         self.config_filename = 'config.ini'
         self.config = ConfigParser()
         self.init_database()
         self.init_data_info()
         self.init_download_history_table()
+        self.init_host_profile_tables()
 
     def init_database(self):
         if not os.path.exists(self.ROOT):
             os.makedirs(self.ROOT)
 
-        db_file = os.path.join(self.ROOT, self.database_filename)
-        sqlite3.connect(db_file)
+    @property
+    def database_path(self):
+        return os.path.join(self.ROOT, self.database_filename)
+
+    @property
+    def conn(self):
+        return connect(self.database_path)
 
     def check_table_exist(self, tablename):
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?", (tablename, ))
+        cursor = self.conn.execute(f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?", (tablename, ))
         return True if cursor.fetchone()[0] == 1 else False
 
     def init_data_info(self):
@@ -44,6 +131,11 @@ class Database:
         self.config.set(new_section, 'threads', '5')
         self.config.set(new_section, 'download_dir', os.path.join(self.base_path, 'Downloads'))
         self.config.set(new_section, 'retry', '3')
+        self.config.set(new_section, 'engine', 'process')
+        self.config.set(new_section, 'max_active', '3')
+        self.config.set(new_section, 'max_connections', '16')
+        self.config.set(new_section, 'adaptive', '0')
+        self.config.set(new_section, 'limit', '0')
         self.config.set(new_section, 'User-Agent',
                         'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36 Edg/129.0.0.0')
 
@@ -58,24 +150,122 @@ class Database:
             retry=3,
             user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36 Edg/129.0.0.0'
         )
+        self.set_option('engine', 'process')
+        self.set_option('max_active', 3)
+        self.set_option('max_connections', 16)
+        self.set_option('adaptive', 0)
+        self.set_option('limit', 0)
     
     def init_download_history_table(self):
-        if self.check_table_exist(self.table_name):
-            return
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
-                            id INTEGER PRIMARY KEY UNIQUE,
-                            filename TEXT NOT NULL,
-                            url TEXT NOT NULL,
-                            status TEXT NOT NULL,
-                            start_time DATETIME NOT NULL,
-                            end_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                            size TEXT NOT NULL
+        if not self.check_table_exist(self.table_name):
+            with self.conn as conn:
+                conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
+                                id INTEGER PRIMARY KEY UNIQUE,
+                                filename TEXT NOT NULL,
+                                url TEXT NOT NULL,
+                                status TEXT NOT NULL,
+                                start_time DATETIME NOT NULL,
+                                end_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                size TEXT NOT NULL
+                            )""")
+        self.init_search_index()
+        self.migrate_history_table()
+
+    def init_host_profile_tables(self):
+        """
+        创建主机性能记录表, 由 profiles 模块读写。
+
+        host_profiles 每个主机一行, 是汇总后的结论; host_connection_stats 按主机和连接数分别保存
+        平滑后的吞吐量和出错率, 最佳连接数由它比较得出。
+        """
+        with self.conn as conn:
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.profile_table} (
+                            host TEXT PRIMARY KEY,
+                            downloads INTEGER NOT NULL,
+                            range_support INTEGER,
+                            best_connections INTEGER,
+                            throughput REAL,
+                            throttle_rate REAL,
+                            error_rate REAL,
+                            segment_size INTEGER,
+                            updated DATETIME NOT NULL
                         )""")
-        conn.commit()
-        conn.close()
-        return
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.connection_stats_table} (
+                            host TEXT NOT NULL,
+                            connections INTEGER NOT NULL,
+                            downloads INTEGER NOT NULL,
+                            throughput REAL,
+                            throttle_rate REAL NOT NULL,
+                            error_rate REAL NOT NULL,
+                            PRIMARY KEY (host, connections)
+                        ) WITHOUT ROWID""")
+
+    def migrate_history_table(self):
+        """
+        把历史记录表逐个版本升级到 HISTORY_SCHEMA_VERSION。
+
+        版本 1 补充数值列和索引: 旧记录的字节数从显示文本推算（精度为两位小数）, 耗时按开始和结束时间计算
+        （包含暂停的时间）, 连接数和重试次数未知, 保持为 NULL。
+        版本 2 的主机列改用 host_of, 与主机记录的键一致（版本 1 只记录主机名, 不带端口）。
+        """
+        conn = self.conn
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= HISTORY_SCHEMA_VERSION:
+            return
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({self.table_name})")}
+        with conn:
+            if version < 1:
+                for name, column_type in NUMERIC_COLUMNS:
+                    if name not in columns:
+                        conn.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {name} {column_type}")
+                rows = conn.execute(f"SELECT id, size FROM {self.table_name}").fetchall()
+                conn.executemany(
+                    f"UPDATE {self.table_name} SET bytes=? WHERE id=?", ((parse_size(size), id) for id, size in rows))
+                conn.execute(f"""UPDATE {self.table_name}
+                                 SET duration = (julianday(end_time) - julianday(start_time)) * 86400
+                                 WHERE duration IS NULL""")
+                conn.execute(f"""UPDATE {self.table_name} SET throughput = bytes / duration
+                                 WHERE throughput IS NULL AND duration > 0""")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table_name}_host ON {self.table_name} (host, end_time)")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table_name}_end_time ON {self.table_name} (end_time)")
+            if version < 2:
+                rows = conn.execute(f"SELECT id, url FROM {self.table_name}").fetchall()
+                conn.executemany(
+                    f"UPDATE {self.table_name} SET host=? WHERE id=?", ((host_of(url), id) for id, url in rows))
+            conn.execute(f"PRAGMA user_version = {HISTORY_SCHEMA_VERSION}")
+
+    def init_search_index(self):
+        """
+        为文件名和 URL 建立 FTS5 全文索引。
+
+        索引是以历史记录表为外部内容的 FTS5 表, 只保存倒排索引, 由触发器与历史记录表同步;
+        旧版本的数据库第一次打开时根据已有记录重建索引。SQLite 没有编译 FTS5 时 search_history 改用 LIKE。
+        """
+        self.fts_table = f"{self.table_name}_fts"
+        self.fts = self.check_table_exist(self.fts_table)
+        if self.fts:
+            return
+        try:
+            with self.conn as conn:
+                conn.execute(f"""CREATE VIRTUAL TABLE {self.fts_table} USING fts5(
+                                filename, url, content='{self.table_name}', content_rowid='id')""")
+                conn.execute(f"""CREATE TRIGGER {self.fts_table}_insert AFTER INSERT ON {self.table_name} BEGIN
+                                INSERT INTO {self.fts_table} (rowid, filename, url) VALUES (new.id, new.filename, new.url);
+                            END""")
+                conn.execute(f"""CREATE TRIGGER {self.fts_table}_delete AFTER DELETE ON {self.table_name} BEGIN
+                                INSERT INTO {self.fts_table} ({self.fts_table}, rowid, filename, url)
+                                VALUES ('delete', old.id, old.filename, old.url);
+                            END""")
+                conn.execute(f"""CREATE TRIGGER {self.fts_table}_update AFTER UPDATE OF filename, url ON {self.table_name} BEGIN
+                                INSERT INTO {self.fts_table} ({self.fts_table}, rowid, filename, url)
+                                VALUES ('delete', old.id, old.filename, old.url);
+                                INSERT INTO {self.fts_table} (rowid, filename, url) VALUES (new.id, new.filename, new.url);
+                            END""")
+                conn.execute(f"INSERT INTO {self.fts_table} ({self.fts_table}) VALUES ('rebuild')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            # 没有 FTS5 模块, 事务已回滚
+            self.fts = False
 
     def return_config(self):
         """
@@ -84,7 +274,7 @@ class Database:
         
         self.config.read(os.path.join(self.ROOT, self.config_filename), encoding='utf-8')
         section = 'Default'
-        options = self.config.options(section)
+        options = ['threads', 'download_dir', 'retry', 'User-Agent']
         result = []
         for option in options:
             value = self.config.get(section, option)
@@ -94,6 +284,22 @@ class Database:
                 result.append(value)
         return result
 
+    def get_option(self, option, fallback=None):
+        """
+        读取 return_config 之外的可选配置项, 旧版本生成的 config.ini 中没有这些项时返回 fallback。
+        """
+        self.config.read(os.path.join(self.ROOT, self.config_filename), encoding='utf-8')
+        value = self.config.get('Default', option, fallback=fallback)
+        if isinstance(value, str) and value.isdigit():
+            return int(value)
+        return value
+
+    def set_option(self, option, value):
+        self.config.read(os.path.join(self.ROOT, self.config_filename), encoding='utf-8')
+        self.config.set('Default', option, str(value))
+        with open(os.path.join(self.ROOT, self.config_filename), 'w', encoding='utf-8') as f:
+            self.config.write(f)
+
     def update_config(self, threads, download_dir, retry, user_agent):
         self.config.read(os.path.join(self.ROOT, self.config_filename), encoding='utf-8')
         section = 'Default'
@@ -104,74 +310,170 @@ class Database:
         with open(os.path.join(self.ROOT, self.config_filename), 'w', encoding='utf-8') as f:
             self.config.write(f)
     
-    def add_download_record(self, filename, url, status, start_time, end_time, size):
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        table_id = self.get_max_id() + 1
-        cursor.execute(f"INSERT INTO {self.table_name} (id, filename, url, status, start_time, end_time, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                       (table_id, filename, url, status, start_time, end_time, size))
-        conn.commit()
-        conn.close()
-    
-    def get_history(self, offset, limit):
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        cursor.execute(
-            f"SELECT * FROM {self.table_name} ORDER BY id DESC LIMIT ?, ?",
-            (offset, limit),
-        )
-        results = cursor.fetchall()
-        conn.close()
-        return results
-    
-    def get_max_id(self):
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT MAX(id) FROM {self.table_name}")
-        max_id = cursor.fetchone()[0]
-        if max_id is None:
-            max_id = 0
-        conn.close()
-        return int(max_id)
-
-    def get_records_history(self):
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT COUNT(*) FROM {self.table_name}")
-        total_records = cursor.fetchone()[0]
-        if total_records is None:
-            total_records = 0
-        conn.close()
-        return int(total_records)
-    
-    def get_pages(self):
-        total_records = self.get_records_history()
-        if total_records == 0:
-            return 0
-        records_per_page = 20
-        pages = (total_records + records_per_page - 1) // records_per_page
-        return pages
-    
-    def get_page_history(self, page):
+    def add_download_record(self, filename, url, status, start_time, end_time, size, bytes=None, duration=None,
+                            connections=None, retries=None):
         """
-        从末尾开始获取历史记录，每页20条
+        添加一条历史记录, id 由 SQLite 分配（INTEGER PRIMARY KEY 即 rowid）。
+
+        Args:
+            size (str): 显示用的文件大小。
+            bytes (int, optional): 下载的字节数。默认为None。
+            duration (float, optional): 实际下载的时间（秒）。默认为None。
+            connections (int, optional): 使用的连接数。默认为None。
+            retries (int, optional): 分段重试的总次数。默认为None。
+
+        Returns:
+            int: 新记录的 id。
+
+        """
+        with self.conn as conn:
+            cursor = conn.execute(self.insert_sql, history_row(
+                filename, url, status, start_time, end_time, size, bytes, duration, connections, retries))
+        return cursor.lastrowid
+
+    def add_download_records(self, records):
+        """
+        在一个事务中批量添加历史记录。
+
+        Args:
+            records (Iterable[tuple]): 每条记录为 add_download_record 的参数, 可以省略后面的数值参数。
+
         """
-        pages = self.get_pages()
-        assert page <= pages, f"Page {page} is out of range (1-{pages})"
-        offset = (page - 1) * 20
-        history = self.get_history(offset, 20)
-        return history
+        with self.conn as conn:
+            conn.executemany(self.insert_sql, (history_row(*record) for record in records))
+
+    @property
+    def insert_sql(self):
+        return (f"INSERT INTO {self.table_name} ({', '.join(HISTORY_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})")
     
+    def get_history_before(self, before_id=None, limit=20):
+        """
+        按 id 从新到旧取一页历史记录（键集分页）。
+
+        直接在主键上定位到 before_id, 不需要像 OFFSET 那样扫描并丢弃前面的行, 翻到多深都一样快。
+
+        Args:
+            before_id (int, optional): 上一页最后一条记录的 id, None 表示第一页。默认为None。
+            limit (int, optional): 每页的记录数。默认为20。
+
+        Returns:
+            List[tuple]: 历史记录。
+
+        """
+        if before_id is None:
+            cursor = self.conn.execute(f"SELECT * FROM {self.table_name} ORDER BY id DESC LIMIT ?", (limit, ))
+        else:
+            cursor = self.conn.execute(
+                f"SELECT * FROM {self.table_name} WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit))
+        return cursor.fetchall()
+
+    def search_history(self, text, limit=100):
+        """
+        按文件名和 URL 搜索历史记录。
+
+        输入按空白拆分成多个词, 每个词按前缀匹配文件名或 URL 中的词, 所有词都要匹配。
+
+        Args:
+            text (str): 搜索内容。
+            limit (int, optional): 最多返回的记录数。默认为100。
+
+        Returns:
+            List[tuple]: 从新到旧排列的历史记录。
+
+        """
+        words = text.split()
+        if not words:
+            return []
+        if self.fts:
+            # 每个词作为带前缀匹配的短语, 避免用户输入被解析成 FTS5 的运算符
+            query = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+            cursor = self.conn.execute(
+                f"""SELECT * FROM {self.table_name} WHERE id IN (
+                        SELECT rowid FROM {self.fts_table} WHERE {self.fts_table} MATCH ? ORDER BY rowid DESC LIMIT ?
+                    ) ORDER BY id DESC""", (query, limit))
+        else:
+            conditions = ' AND '.join(["(filename LIKE ? ESCAPE '\\' OR url LIKE ? ESCAPE '\\')"] * len(words))
+            patterns = []
+            for word in words:
+                pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                patterns += [pattern, pattern]
+            cursor = self.conn.execute(
+                f"SELECT * FROM {self.table_name} WHERE {conditions} ORDER BY id DESC LIMIT ?", (*patterns, limit))
+        return cursor.fetchall()
+
     def delete_history(self, id):
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        cursor.execute(f"DELETE FROM {self.table_name} WHERE id=?", (id,))
-        conn.commit()
-        conn.close()
+        self.delete_histories([id])
+
+    def delete_histories(self, ids):
+        """
+        在一个事务中删除多条历史记录。
+        """
+        with self.conn as conn:
+            conn.executemany(f"DELETE FROM {self.table_name} WHERE id=?", ((id,) for id in ids))
     
     def clear_history(self):
-        conn = sqlite3.connect(os.path.join(self.ROOT, self.database_filename))
-        cursor = conn.cursor()
-        cursor.execute(f"DELETE FROM {self.table_name}")
-        conn.commit()
-        conn.close()
+        with self.conn as conn:
+            conn.execute(f"DELETE FROM {self.table_name}")
+
+    def host_stats(self, since=None):
+        """
+        按主机汇总历史记录。
+
+        Args:
+            since (str, optional): 只统计结束时间不早于该时间（'YYYY-MM-DD HH:MM:SS'）的记录。默认为None, 统计全部。
+
+        Returns:
+            List[tuple]: (主机, 次数, 成功次数, 字节数, 下载时间, 平均速度, 平均连接数, 重试次数),
+                按字节数从多到少排列。平均速度为总字节数除以总时间。
+
+        """
+        return self.aggregate('host', since)
+
+    def daily_stats(self, since=None):
+        """
+        按天汇总历史记录, 字段与 host_stats 相同, 第一列为日期, 按日期从新到旧排列。
+        """
+        return self.aggregate('date(end_time)', since)
+
+    def aggregate(self, key, since=None):
+        order = 'SUM(bytes) DESC' if key == 'host' else '1 DESC'
+        cursor = self.conn.execute(
+            f"""SELECT {key}, COUNT(*), SUM(status = 'ok'), COALESCE(SUM(bytes), 0), COALESCE(SUM(duration), 0),
+                       SUM(bytes) / NULLIF(SUM(CASE WHEN bytes IS NOT NULL THEN duration END), 0),
+                       AVG(connections), COALESCE(SUM(retries), 0)
+                FROM {self.table_name}
+                WHERE end_time >= ?
+                GROUP BY 1 ORDER BY {order}""",
+            (since or '', ))
+        return cursor.fetchall()
+
+    def get_host_profile(self, host):
+        """
+        Returns:
+            Tuple[tuple | None, List[tuple]]: host_profiles 中的一行（没有记录时为None）,
+                以及该主机在 host_connection_stats 中按连接数排列的各行 (connections, downloads, throughput, throttle_rate, error_rate)。
+        """
+        conn = self.conn
+        profile = conn.execute(f"SELECT * FROM {self.profile_table} WHERE host = ?", (host, )).fetchone()
+        stats = conn.execute(
+            f"""SELECT connections, downloads, throughput, throttle_rate, error_rate
+                FROM {self.connection_stats_table} WHERE host = ? ORDER BY connections""", (host, )).fetchall()
+        return profile, stats
+
+    def save_host_profile(self, profile, stats):
+        """
+        在一个事务中保存一个主机的汇总和各连接数的统计, 字段顺序与 get_host_profile 返回的相同。
+        """
+        with self.conn as conn:
+            conn.execute(f"INSERT OR REPLACE INTO {self.profile_table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", profile)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.connection_stats_table} VALUES (?, ?, ?, ?, ?, ?)",
+                ((profile[0], ) + tuple(row) for row in stats))
+
+    def get_host_profiles(self):
+        """
+        Returns:
+            List[tuple]: 所有主机的汇总, 按下载次数从多到少排列。
+        """
+        return self.conn.execute(f"SELECT * FROM {self.profile_table} ORDER BY downloads DESC, host").fetchall()
@@ -1,96 +1,118 @@
 import os
 import re
-import copy
+import sys
 import requests
 import multiprocessing
-import hashlib
-from retry import retry
+import multiprocessing.connection
+import time
+import signal
+import threading
 import optparse
 
-from ctypes import c_ulonglong
+from storage import allocate_file, writer_factory, DEFAULT_BUFFER_SIZE, WRITERS, FSYNC_POLICIES
+from progress import all_done, total_done, stalled_segments, connection_stats
+from journal import Journal
+from scheduler import Scheduler, DEFAULT_MIN_SEGMENT, DEFAULT_MAX_SEGMENT
+from async_engine import AsyncDownload, check_writer
+from process_engine import download_worker
+from mirrors import MirrorSet, probe_mirrors
+from verify import start_verifier
+from adaptive import ConnectionController, ADAPTIVE_START
+from bandwidth import task_limiter, parse_rate, format_rate
+from stream import stream_scheduler, stream_worker, fallback_reason
+from throughput import ThroughputTracker, format_speed, format_eta, format_spread
+from profiles import HostProfile, record_download
+from task_queue import DEFAULT_MAX_CONNECTIONS
+from data import Database, host_of
 
 class Downloader:
     retry_times = 3
-    def __init__(self, url: str, headers: dict=None, root: str='./', threads: int=5):
+    def __init__(self, url: str, headers: dict=None, root: str='./', threads: int=5, buffer_size: int=DEFAULT_BUFFER_SIZE, resume: bool=True,
+                 min_segment: int=DEFAULT_MIN_SEGMENT, max_segment: int=DEFAULT_MAX_SEGMENT, engine: str='process',
+                 writer: str='pwrite', fsync: str='none', adaptive: bool=False, limit: float=0, initial: int=ADAPTIVE_START):
         """
         初始化函数，用于创建一个新的下载器对象。
         
         Args:
-            url (str): 需要下载的文件的URL地址。
+            url (str | List[str]): 需要下载的文件的URL地址, 也可以是同一个文件的多个镜像地址。
             headers (dict, optional): 自定义请求头。默认为None。
             root (str, optional): 本地保存文件的根目录。默认为当前目录。
             threads (int, optional): 使用的线程数。默认为5。
+            buffer_size (int, optional): 每个线程在内存中最多积压的字节数。默认为1MB。
+            resume (bool, optional): 存在有效的断点续传日志时是否继续下载。默认为True。
+            min_segment (int, optional): 分段最小长度, 也是拆分正在下载的分段时的最小粒度。默认为1MB。
+            max_segment (int, optional): 分段最大长度。默认为64MB。
+            engine (str, optional): 下载引擎, 'process' 每个线程一个进程, 'asyncio' 所有连接运行在同一个事件循环上。默认为'process'。
+            writer (str, optional): 写入后端, 'pwrite' 按偏移直接写, 'mmap' 写入文件映射, 'coalesce' 由写线程合并成大块写入。默认为'pwrite'。
+            fsync (str, optional): fsync 策略, 'none'、'close'（每个分段写完后）或 'interval'（定期）。默认为'none'。
+            adaptive (bool, optional): 是否根据吞吐量自动调整连接数, 此时 threads 为连接数上限。默认为False。
+            limit (float, optional): 限速（字节/秒）, 0 表示不限速, 下载过程中可以通过 limiter.set_rate 修改。默认为0。
+            initial (int, optional): 自适应模式的初始连接数。默认为 ADAPTIVE_START。
         
         """
-        self.url = url
-        self.headers = headers
-        self.filename = re.findall(r"/([^/?]*)(?:\?.*)?$", url)[0]
+        urls = [url] if isinstance(url, str) else list(url)
+        self.url = urls[0]
+        self.headers = headers if headers is not None else {}
+        self.filename = re.findall(r"/([^/?]*)(?:\?.*)?$", self.url)[0]
         self.root = root
         self.threads = threads
+        self.buffer_size = buffer_size
+        self.min_segment = min_segment
+        self.max_segment = max_segment
+        if engine == 'asyncio':
+            check_writer(writer, fsync)
+        self.engine = engine
+        self.writer_name = writer
+        self.fsync = fsync
+        self.writer = writer_factory(writer, fsync)
+        self.adaptive = adaptive
+        self.initial = initial
+        # 所有 worker 共享的限速器, 需要在启动 worker 之前创建
+        self.limiter = task_limiter(limit)
+        self.verifier = None
         self.filepath = os.path.join(root, self.filename)
         self.session = requests.Session()
+        # 整个下载过程只探测一次远程文件, 之后所有环节共用这份信息
+        # 多个镜像时只保留与第一个可用地址大小和校验值一致的镜像
+        self.info = probe_mirrors(urls, self.session, self.headers)
+        self.journal = Journal(self.filepath, self.url, self.info.file_size, self.info.etag, self.info.last_modified)
+        # 远程文件的 ETag/Last-Modified 变化时 load 会丢弃旧日志, 从头下载;
+        # 不能分段下载时（不支持 Range 或没有文件大小）无法从日志继续, 改为单连接从头下载
+        self.completed = self.journal.load() if resume and self.info.segmented else []
 
-        if os.path.exists(self.filepath):
-            os.remove(self.filepath)
-        with open(self.filepath, 'wb') as f:
-            pass
+        if not self.completed:
+            self.journal.remove()
+            if os.path.exists(self.filepath):
+                os.remove(self.filepath)
+        if self.info.file_size is None and writer == 'mmap':
+            # 大小未知时无法预先分配文件, mmap 需要完整映射整个文件, 改用 pwrite
+            self.writer_name = 'pwrite'
+            self.writer = writer_factory(self.writer_name, fsync)
+        # 先检查剩余空间并预留整个文件, 空间不足时在下载开始前就报错
+        allocate_file(self.filepath, self.info.file_size or 0)
     
     def check_file(self):
         """
         检查本地文件是否与远程文件一致。
+
+        校验值在下载过程中由后台线程增量计算, 这里只补算最后落盘的数据, 不会重新读取整个文件。
         
         Returns:
-            bool: 如果本地文件与远程文件不一致，返回True；否则返回False。
+            bool | None: 一致返回True, 不一致返回False; 服务器未提供校验值或文件未下载完整时返回None。
         
         """
-        head = self.session.head(self.url, headers=self.headers)
-        head.raise_for_status()
-        try:
-            md5 = head.headers['Content-MD5']
-        except KeyError:
+        if self.verifier is None:
             return None
-        with open(self.filepath, mode='rb') as f:
-            content = f.read()
-            local_md5 = hashlib.md5(content).hexdigest()
-            if local_md5 != md5:
-                return False
-        return True
+        return self.verifier.finish()
 
-    @property
-    def partition(self):
-        """
-        将文件按照线程数进行分区，并返回每个分区的起始和结束位置。
-        
-        Returns:
-            List[Tuple[int, int]]: 包含多个元组的列表，每个元组表示一个分区的起始和结束位置。
-        
-        """
-        file_size = self.get_file_size()
-        part_size = file_size // self.threads
-        parts = []
-        for i in range(self.threads):
-            start = i * part_size
-            if i == self.threads - 1:
-                end = file_size - 1
-            else:
-                end = (i + 1) * part_size - 1
-            parts.append((start, end))
-        return parts
-    
     def get_file_size(self):
         """
-        获取文件大小。
+        获取文件大小, 直接使用初始化时探测到的信息, 不再发送请求。
         
         Returns:
             int: 返回文件大小，单位为字节。
-        
-        Raises:
-            HTTPError: 如果请求失败，则会抛出HTTPError异常。
         """
-        head = self.session.head(self.url, headers=self.headers)
-        head.raise_for_status()
-        file_size = head.headers['Content-Length']
-        return int(file_size)
+        return self.info.file_size
     
     @classmethod
     def setup_retry_times(cls, times):
@@ -103,98 +125,248 @@ class Downloader:
         """
         cls.retry_times = times
 
-    @retry(tries=retry_times)
-    def download_parts(self, lock: object, start: int, end: int, total: int):
+    def worker(self, scheduler):
         """
-        下载文件的一部分内容，并写入到本地文件中。
+        多进程引擎的 worker 进程入口, 见 process_engine.download_worker。
         
         Args:
-            start (int): 下载内容的起始位置（字节）。
-            end (int): 下载内容的结束位置（字节）。
+            scheduler (Scheduler): 多进程共享的分段调度器。
         
         """
-        headers = copy.deepcopy(self.headers)
-        headers['Range'] = f'bytes={start}-{end}'
-        response = self.session.get(
-            self.url, headers=headers, stream=True)
-        response.raise_for_status()
-        chunks = []
-        for chunk in response.iter_content(chunk_size=128):
-            chunks.append(chunk)
-            lock.acquire()
-            total.value += len(chunk)
-            lock.release()
-
-        lock.acquire()
-        f = open(self.filepath, 'r+b')
-        f.seek(start)
-        for chunk in chunks:
-            f.write(chunk)
-        f.close()
-        lock.release()
-
-    def print_progress(self, total):
-        file_size = self.get_file_size()
+        # Ctrl+C 由主进程统一处理（保存日志后结束子进程）
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        download_worker(self.mirrors, scheduler, self.filepath, self.retry_times, self.headers, self.buffer_size,
+                        self.writer, self.limiter)
+
+    def stream_worker(self, scheduler):
+        """
+        单连接下载整个文件的子进程入口。
+        """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stream_worker(self.info.final_url, self.headers, scheduler, self.filepath, self.retry_times,
+                      self.buffer_size, self.writer, self.limiter, self.info.range_support)
+
+    def read_limit(self):
+        """
+        在后台线程中读取标准输入, 每输入一行新的限速（如 512K、2M, 0 表示不限速）立即对所有 worker 生效。
+
+        直接读取文件描述符而不是 sys.stdin: 子进程启动时会关闭 sys.stdin, 如果本线程正阻塞在
+        sys.stdin 上并持有它的锁, fork 出的子进程会卡死。
+        """
+        pending = b''
         while True:
-            print(f"\rDownloading: {total.value / 1024 ** 2:.2f}MB /{file_size / 1024 ** 2:.2f}MB", end='\t\t\t', flush=True)
+            data = os.read(sys.stdin.fileno(), 1024)
+            if not data:
+                return
+            pending += data
+            *lines, pending = pending.split(b'\n')
+            line = lines[-1].decode(errors='ignore') if lines else ''
+            if not line.strip():
+                continue
+            try:
+                self.limiter.set_rate(parse_rate(line))
+            except ValueError as e:
+                print(f"\n{e}", flush=True)
+                continue
+            print(f"\n限速已修改为 {format_rate(self.limiter.rate.value)}", flush=True)
+
+    @staticmethod
+    def wait_workers(processes, timeout):
+        """
+        等待到有 worker 退出（asyncio 引擎为全部协程结束）, 最多 timeout 秒。
+
+        最后一个 worker 退出后立即返回, 下载时间不包含轮询间隔的等待。
+        """
+        alive = [p for p in processes if p.is_alive()]
+        handles = [p for p in alive if isinstance(p, AsyncDownload)]
+        if handles:
+            handles[0].join(timeout)
+        elif alive:
+            multiprocessing.connection.wait([p.sentinel for p in alive], timeout)
+
+    def print_progress(self, scheduler, file_size):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        tracker = ThroughputTracker(scheduler)
+        while True:
+            tracker.update()
+            progress = scheduler.segments()
+            stalled = stalled_segments(progress)
+            stalled_info = f" stalled: {','.join(str(i + 1) for i in stalled)}" if stalled else ''
+            connections = f" [{scheduler.workers.value}/{scheduler.limit.value} conn]" if self.adaptive else ''
+            # 大小未知时只显示已接收的字节数
+            total = f" /{file_size / 1024 ** 2:.2f}MB" if file_size is not None else ''
+            # 平滑速度、瞬时速度、剩余时间、最近 10 秒的速度曲线和各分段速度的 最小/中位数/最大
+            speed = (f" {format_speed(tracker.smoothed)} (now {format_speed(tracker.speed)})"
+                     f" ETA {format_eta(tracker.eta(file_size))} {tracker.sparkline()}")
+            spread = format_spread(tracker.spread())
+            segments = f" seg {spread}" if spread else ''
+            print(f"\rDownloading: {total_done(progress) / 1024 ** 2:.2f}MB{total}{speed}{segments}{connections}{stalled_info}",
+                  end='\t\t\t', flush=True)
+            time.sleep(0.1)
     
     def run(self):
         """
         下载指定分片区间的文件并合并。
 
         Returns:
-            bool: True, 检测函数运行是否结束...tips：为了后续处理做的准备
+            bool: True 表示下载过程结束; 按 Ctrl+C 暂停时返回 False, 再次运行相同命令即可继续下载。
         
         """
-        file_size = self.get_file_size()
+        file_size = self.info.file_size
         print('-'*30, "Download Info", '-'*30, flush=True)
         print(f'File Name : {self.filename}', flush=True)
-        print(f"File Size : {file_size / 1024 ** 2:.2f}MB", flush=True)
-        print(f"Threads   : {self.threads}", flush=True)
+        print(f"File Size : {f'{file_size / 1024 ** 2:.2f}MB' if file_size is not None else '未知'}", flush=True)
+        if self.info.segmented:
+            print(f"Threads   : {self.threads}{' (自适应上限)' if self.adaptive else ''}", flush=True)
+            print(f"Engine    : {self.engine}", flush=True)
+        else:
+            print(f"Threads   : 1 (单连接下载: {fallback_reason(self.info)})", flush=True)
+        print(f"Writer    : {self.writer_name} (fsync: {self.fsync})", flush=True)
+        if len(self.info.mirrors) > 1:
+            print(f"Mirrors   : {len(self.info.mirrors)}", flush=True)
+        for mirror, reason in self.info.rejected_mirrors:
+            print(f"已忽略镜像 {mirror}: {reason}", flush=True)
+        print(f"Limit     : {format_rate(self.limiter.rate.value)}", flush=True)
+        if sys.stdin is not None and sys.stdin.isatty():
+            print("下载过程中输入新的限速并回车即可修改, 如 512K、2M, 0 表示不限速", flush=True)
+            threading.Thread(target=self.read_limit, daemon=True).start()
+        if self.completed:
+            print(f"Resume    : {self.journal.completed_size / 1024 ** 2:.2f}MB 已完成", flush=True)
         print('-'*30, "Downloading", '-'*30, flush=True)
-        lock = multiprocessing.Lock()
-        # total = multiprocessing.Value('i', 0) # 使用 'i' 来存储总大小, 支持到大约 2GB 的文件大小, 超出会溢出形成负数
-        # 改用 c_ulonglong(unsigned long long) 类型来存储总大小, 支持到大约 17PB 的文件大小
-        total = multiprocessing.Value(c_ulonglong, 0)
-        parts = self.partition
-        processes = []
-        for start, end in parts:
-            p = multiprocessing.Process(
-                target=self.download_parts, args=(lock, start, end, total))
-            p.daemon = True
-            p.start()
-            processes.append(p)
+        if self.info.segmented:
+            # 分段放在共享队列中, 每个进程下载完一个再领取下一个, 队列为空时拆分最慢的分段
+            scheduler = Scheduler(self.journal.missing(), self.threads, self.completed, self.min_segment, self.max_segment)
+        else:
+            scheduler = stream_scheduler(file_size)
+        # 之前已完成的部分不计入本次下载的字节数
+        resumed = self.journal.completed_size if self.completed else 0
+        # 保留调度器: 共享内存随之释放, 下载结束后仍可读取各分段的统计信息
+        self.scheduler = scheduler
+        # 各镜像的统计信息放在共享内存中, 需要在启动 worker 之前创建
+        self.mirrors = MirrorSet(self.info.mirrors)
+        self.journal.save(scheduler.segments())
+        if not self.info.segmented:
+            # 不分段时只有一个连接, 不区分引擎
+            processes = [multiprocessing.Process(target=self.stream_worker, args=(scheduler,), daemon=True)]
+            spawn = processes[0].start
+        elif self.engine == 'asyncio':
+            # 返回的句柄与 Process 接口一致, 下面的等待/暂停逻辑无需区分引擎
+            handle = AsyncDownload(self.mirrors, self.headers, scheduler, self.filepath,
+                                   self.retry_times, self.buffer_size, self.writer, self.limiter)
+            processes = [handle]
+            spawn = handle.add_worker
+        else:
+            processes = []
+            def spawn():
+                p = multiprocessing.Process(
+                    target=self.worker, args=(scheduler,))
+                p.daemon = True
+                p.start()
+                processes.append(p)
+        controller = None
+        started = time.monotonic()
+        if self.adaptive and self.info.segmented:
+            controller = ConnectionController(scheduler, spawn, self.threads, self.initial)
+        elif not self.info.segmented:
+            scheduler.add_worker()
+            spawn()
+        else:
+            for _ in range(self.threads):
+                scheduler.add_worker()
+                spawn()
         
-        pr = multiprocessing.Process(target=self.print_progress, args=(total,))
+        pr = multiprocessing.Process(target=self.print_progress, args=(scheduler, file_size))
         pr.start()
+        # 跟随已连续完成的前缀增量计算校验值
+        self.verifier = start_verifier(self.filepath, self.info, scheduler)
 
-        for p in processes:
-            p.join()
+        try:
+            while any(p.is_alive() for p in processes):
+                self.wait_workers(processes, 1)
+                self.journal.save(scheduler.segments())
+                decision = controller.update() if controller is not None else None
+                if decision:
+                    print(f"\n[自适应] {decision}", flush=True)
+        except KeyboardInterrupt:
+            for p in processes:
+                p.terminate()
+            for p in processes:
+                p.join()
+            pr.kill()
+            if self.verifier is not None:
+                self.verifier.stop()
+            self.journal.save(scheduler.segments())
+            print(flush=True)
+            print('-'*30, "Paused", '-'*30, flush=True)
+            print("下载已暂停, 重新运行相同命令即可继续下载", flush=True)
+            return False
         
         pr.kill()
+        # 本次使用的连接数（自适应模式下另有各连接数分别的统计）、下载时间和字节数, 用于更新主机记录
+        if controller is not None:
+            self.connections = controller.target
+            self.samples = controller.samples
+        else:
+            self.connections = self.threads if self.info.segmented else 1
+            self.samples = None
+        self.duration = time.monotonic() - started
+        progress = scheduler.segments()
+        self.downloaded = total_done(progress) - resumed
+        if all_done(progress):
+            self.journal.remove()
+        else:
+            self.journal.save(progress)
         print(flush=True)
         print('-'*30, "Downloaded", '-'*30, flush=True)
-        if self.check_file() is None:
-            print("远程服务器未提供MD5校验值, 无法判断文件完整性", flush=True)
-        elif self.check_file():
-            print(f"{self.filename} 下载成功， MD5 匹配", flush=True)
+        matched = self.check_file()
+        if self.verifier is None:
+            print("远程服务器未提供校验值, 无法判断文件完整性", flush=True)
+        elif matched is None:
+            print("文件未下载完整, 无法校验", flush=True)
+        elif matched:
+            print(f"{self.filename} 下载成功， {self.verifier.algorithm.upper()} 匹配", flush=True)
         else:
-            print(f"{self.filename} 下载完成，但MD5不匹配，请尝试重新下载", flush=True)
+            print(f"{self.filename} 下载完成，但{self.verifier.algorithm.upper()}不匹配，请尝试重新下载", flush=True)
+        connections, requests_sent = connection_stats(progress)
+        print(f"连接复用：{requests_sent} 个请求, 新建 {connections} 个连接", flush=True)
+        if len(self.mirrors.urls) > 1:
+            for line in self.mirrors.summary():
+                print(f"镜像：{line}", flush=True)
         print('-'*30, "File Size", '-'*30, flush=True)
         print("本地文件大小：", os.path.getsize(self.filepath), flush=True)
-        print("远程文件大小：", file_size, flush=True)
-        print("文件大小相匹配，下载完成" if file_size == os.path.getsize(
-            self.filepath) else "文件大小不匹配, 请重新下载", flush=True)
+        print("远程文件大小：", file_size if file_size is not None else '未知', flush=True)
+        if file_size is None:
+            # 大小未知时以响应是否完整结束为准, 完成后文件已截断到实际大小
+            complete = all_done(progress)
+            print("下载完成" if complete else "下载失败, 请重新运行相同命令从头下载", flush=True)
+        else:
+            # 文件预先分配了完整大小, 只有所有分段都完成才算下载完成
+            complete = file_size == os.path.getsize(self.filepath) and all_done(progress)
+            print("文件大小相匹配，下载完成" if complete else "部分分段下载失败, 请重新运行相同命令继续下载", flush=True)
+        # 与图形界面的历史记录一致: 下载完整且校验值没有不匹配时为 'ok', 否则为 'error'
+        self.status = 'ok' if complete and matched is not False else 'error'
 
         return True
 
 def opt():
     parser = optparse.OptionParser()
     parser.add_option('-u', '--url', dest='url', help='Download URL')
+    parser.add_option('--mirror', dest='mirrors', action='append', default=[], help='Another URL of the same file, may be repeated')
     parser.add_option('--header', dest='header', help='Custom header')
     parser.add_option('-r', '--root', dest='root', help='Root path of the downloaded file')
     parser.add_option('-t', '--threads', dest='threads', help='Number of threads to use')
     parser.add_option('--retry', dest='retry', help='Retry times')
+    parser.add_option('--buffer', dest='buffer', help='Max bytes buffered in memory per thread')
+    parser.add_option('--min-segment', dest='min_segment', help='Minimum segment size in bytes')
+    parser.add_option('--max-segment', dest='max_segment', help='Maximum segment size in bytes')
+    parser.add_option('--engine', dest='engine', default='process', choices=['process', 'asyncio'], help='Download engine: process or asyncio')
+    parser.add_option('--writer', dest='writer', default='pwrite', choices=list(WRITERS), help='Storage writer: pwrite, mmap or coalesce')
+    parser.add_option('--fsync', dest='fsync', default='none', choices=list(FSYNC_POLICIES), help='fsync policy: none, close or interval')
+    parser.add_option('--limit', dest='limit', default='0', help='Bandwidth limit in bytes/s (K/M/G suffixes), 0 for unlimited')
+    parser.add_option('--adaptive', dest='adaptive', action='store_true', default=False, help='Adjust the number of connections to throughput, up to --threads')
+    parser.add_option('--no-resume', dest='resume', action='store_false', default=True, help='Ignore the resume journal and start over')
+    parser.add_option('--no-profile', dest='profile', action='store_false', default=True,
+                      help='Do not pick threads and segment size from, or record results to, the per-host profile')
     options, args = parser.parse_args()
     return options, args
 
@@ -206,7 +378,7 @@ if __name__ == '__main__':
     }
     options, args = opt()
     if options.url:
-        url = options.url
+        url = [options.url] + options.mirrors if options.mirrors else options.url
     else:
         raise ValueError('未指定 URL', flush=True)
     if options.header:
@@ -215,12 +387,39 @@ if __name__ == '__main__':
         root = options.root
     else:
         root = './'
+    # 命令行没有指定的连接数和分段大小按以往从同一主机下载的记录选择
+    profile = HostProfile.load(Database(), host_of(options.url)) if options.profile else None
+    if profile is not None and profile.downloads:
+        print(f"Profile   : {profile.describe()}", flush=True)
+    recommended = profile.recommend(DEFAULT_MAX_CONNECTIONS) if profile is not None else None
     if options.threads:
         threads = int(options.threads)
+    elif recommended and not options.adaptive:
+        threads = recommended
     else:
         threads = 5
     if options.retry:
         Downloader.setup_retry_times(int(options.retry))
+    if options.buffer:
+        buffer_size = int(options.buffer)
+    else:
+        buffer_size = DEFAULT_BUFFER_SIZE
+    if options.min_segment:
+        min_segment = int(options.min_segment)
+    else:
+        min_segment = DEFAULT_MIN_SEGMENT
+    if options.max_segment:
+        max_segment = int(options.max_segment)
+    elif profile is not None and profile.segment_size():
+        max_segment = profile.segment_size()
+    else:
+        max_segment = DEFAULT_MAX_SEGMENT
     
-    d = Downloader(url, headers=headers, root=root, threads=threads)
-    d.run()
\ No newline at end of file
+    d = Downloader(url, headers=headers, root=root, threads=threads, buffer_size=buffer_size, resume=options.resume,
+                   min_segment=min_segment, max_segment=max_segment, engine=options.engine,
+                   writer=options.writer, fsync=options.fsync, adaptive=options.adaptive, limit=parse_rate(options.limit),
+                   initial=min(threads, recommended or ADAPTIVE_START))
+    # 按 Ctrl+C 暂停或下载失败时不记录; 使用多个镜像时各主机的速度混在一起, 也不记录
+    if d.run() and d.status == 'ok' and profile is not None and len(d.mirrors.urls) == 1:
+        record_download(Database(), options.url, d.connections, d.scheduler.segments(), d.downloaded, d.duration,
+                        d.info.range_support, d.samples)
\ No newline at end of file
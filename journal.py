@@ -0,0 +1,187 @@
+import os
+import json
+import threading
+
+
+JOURNAL_SUFFIX = '.journal'
+
+
+def merge_ranges(ranges):
+    """
+    合并重叠或相邻的闭区间。
+
+    Args:
+        ranges (Iterable[Tuple[int, int]]): 闭区间 (start, end) 列表。
+
+    Returns:
+        List[Tuple[int, int]]: 按起点排序、互不相邻的闭区间列表。
+
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if end < start:
+            continue
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(completed, file_size):
+    """
+    计算 [0, file_size) 中尚未完成的闭区间。
+    """
+    missing = []
+    position = 0
+    for start, end in merge_ranges(completed):
+        if start > position:
+            missing.append((position, start - 1))
+        position = max(position, end + 1)
+    if position < file_size:
+        missing.append((position, file_size - 1))
+    return missing
+
+
+class Journal:
+    """
+    记录在下载文件旁边的断点续传日志。
+
+    日志保存已写入磁盘的字节区间以及开始下载时远程文件的 ETag/Last-Modified,
+    远程文件发生变化时日志自动失效。
+    """
+    def __init__(self, filepath: str, url: str, file_size: int, etag: str=None, last_modified: str=None):
+        """
+        Args:
+            filepath (str): 下载的目标文件路径, 日志保存在 filepath + '.journal'。
+            url (str): 下载地址。
+            file_size (int): 远程文件大小（字节）。
+            etag (str, optional): 远程文件的 ETag。默认为None。
+            last_modified (str, optional): 远程文件的 Last-Modified。默认为None。
+
+        """
+        self.filepath = filepath
+        self.path = filepath + JOURNAL_SUFFIX
+        self.url = url
+        self.file_size = file_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.completed = []
+        # 同一时间只进行一次保存, 后台保存结束前 save/remove 会等待它
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        读取日志中已完成的区间。
+
+        日志不存在、损坏、目标文件缺失或远程校验值发生变化时, 删除日志并返回空列表。
+
+        Returns:
+            List[Tuple[int, int]]: 已完成的闭区间列表。
+
+        """
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            valid = (
+                os.path.exists(self.filepath)
+                and record['file_size'] == self.file_size
+                and record['etag'] == self.etag
+                and record['last_modified'] == self.last_modified
+            )
+            completed = [tuple(item) for item in record['completed']]
+        except (OSError, ValueError, KeyError, TypeError):
+            valid = False
+        if not valid:
+            self.remove()
+            return []
+        self.completed = merge_ranges(completed)
+        return self.completed
+
+    def save(self, progress=None):
+        """
+        把共享进度数组中已写入磁盘的区间合并进日志, 并原子地写入日志文件。
+
+        写日志前先 fsync 目标文件, 保证日志记录的区间在断电后依然有效。
+
+        Args:
+            progress (Iterable[SegmentSlot], optional): 已使用的进度槽位, 见 Scheduler.segments。默认为None。
+
+        """
+        with self.lock:
+            if progress is not None:
+                self.merge(progress)
+            self.write(list(self.completed))
+
+    def save_in_background(self, progress):
+        """
+        与 save 相同, 但 fsync 目标文件和写日志在后台线程中进行, 供界面定时保存使用:
+        下载大文件时 fsync 要把大量脏页写回磁盘, 可能耗时很久, 不能阻塞 GUI 线程。
+
+        已写入的区间在调用时合并, 之后写入的数据由下一次保存记录; 上一次后台保存还没有结束时直接返回。
+
+        Returns:
+            bool: 是否开始了一次保存。
+
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            self.merge(progress)
+            completed = list(self.completed)
+        except BaseException:
+            self.lock.release()
+            raise
+        threading.Thread(target=self.write_in_background, args=(completed, ), daemon=True).start()
+        return True
+
+    def write_in_background(self, completed):
+        try:
+            self.write(completed)
+        except OSError:
+            # 下一次保存会重新写入
+            pass
+        finally:
+            self.lock.release()
+
+    def merge(self, progress):
+        ranges = list(self.completed)
+        for slot in progress:
+            if slot.written > 0:
+                ranges.append((slot.start, min(slot.start + slot.written, slot.end + 1) - 1))
+        self.completed = merge_ranges(ranges)
+
+    def write(self, completed):
+        if os.path.exists(self.filepath):
+            fd = os.open(self.filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+        record = {
+            'url': self.url,
+            'file_size': self.file_size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'completed': completed,
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    @property
+    def completed_size(self):
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def missing(self):
+        return missing_ranges(self.completed, self.file_size)
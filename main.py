@@ -1,7 +1,8 @@
 from PyQt6.QtWidgets import (
     QApplication, 
     QWidget,
-    QLabel, 
+    QLabel,
+    QInputDialog, 
     QVBoxLayout, 
     QScrollArea,
     QHBoxLayout,
@@ -13,300 +14,476 @@ from PyQt6.QtWidgets import (
     QLineEdit,
     QFileDialog,
     QTextEdit,
-    QProgressBar
+    QProgressBar,
+    QComboBox,
+    QCheckBox,
+    QTableView,
+    QHeaderView,
+    QStyledItemDelegate,
+    QStyle,
+    QAbstractItemView
     )
 from PyQt6.QtGui import (
     QIcon, 
     QPalette, 
-    QColor
+    QColor,
+    QPainter,
+    QPen,
+    QFont
     )
 from PyQt6.QtCore import (
     Qt,
     pyqtSignal,
     QTimer,
     QPropertyAnimation,
-    pyqtSlot,
-    QSize
+    QSize,
+    QAbstractListModel,
+    QModelIndex
     )
 
 import os
 import re
 import sys
 import datetime
-import copy
+import time
+import threading
 import requests
 import multiprocessing
-
-from ctypes import c_ulonglong as unsigned_long_long
-
-from data import Database
+import multiprocessing.connection
+
+from data import Database, host_of
+from storage import allocate_file, writer_factory, InsufficientSpaceError, DEFAULT_BUFFER_SIZE
+from progress import all_done, total_done, stalled_segments, connection_stats
+from journal import Journal, JOURNAL_SUFFIX
+from scheduler import Scheduler, DEFAULT_MIN_SEGMENT, DEFAULT_MAX_SEGMENT
+from async_engine import AsyncDownload, check_writer
+from process_engine import download_worker
+from verify import start_verifier
+from adaptive import ConnectionController, ADAPTIVE_START
+from mirrors import MirrorSet, probe_mirrors
+from bandwidth import global_limiter, task_limiter, format_rate
+from stream import stream_scheduler, stream_worker, fallback_reason
+from throughput import ThroughputTracker, format_speed, format_eta, format_spread
+from profiles import HostProfile, record_download
+from task_queue import DownloadQueue, DEFAULT_MAX_ACTIVE, DEFAULT_MAX_CONNECTIONS
 import warnings
 
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
 
+WRITER_NAMES = {
+    'pwrite': 'pwrite (本地磁盘)',
+    'mmap': 'mmap (本地 SSD)',
+    'coalesce': '合并写入 (NFS 等网络存储)',
+}
+FSYNC_NAMES = {
+    'none': '由系统决定',
+    'close': '每个分段完成后',
+    'interval': '每秒',
+}
+ENGINES = {
+    'process': '多进程',
+    'asyncio': 'asyncio 单线程',
+}
+# 所有正在下载的任务共用一个刷新定时器（毫秒）
+REFRESH_INTERVAL = 250
+# 历史记录每次加载的条数, 搜索结果的最大条数, 以及输入停止多久后开始搜索（毫秒）
+HISTORY_PAGE_SIZE = 20
+SEARCH_LIMIT = 1000
+SEARCH_DELAY = 200
+# 历史记录每行的高度, 以及任务列表最多占用的高度（像素）, 超出时在任务列表内滚动
+HISTORY_ROW_HEIGHT = 150
+TASK_AREA_HEIGHT = 330
+
+
+def max_connections(engine):
+    # 多进程引擎每个连接占用一个进程, asyncio 引擎的连接只是事件循环上的协程
+    return 64 if engine == 'asyncio' else multiprocessing.cpu_count()
+
+
+def limit_spinbox(parent, value):
+    # 限速以 KB/s 为单位, 0 显示为“不限速”
+    spinbox = QSpinBox(parent)
+    spinbox.setStyleSheet("font-size: 25px;")
+    spinbox.setFixedWidth(200)
+    spinbox.setRange(0, 10 ** 7)
+    spinbox.setSingleStep(128)
+    spinbox.setSuffix(" KB/s")
+    spinbox.setSpecialValueText("不限速")
+    spinbox.setValue(value)
+    return spinbox
+
+
 def resource_path(relative_path):
     base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
     return os.path.join(base_path, relative_path)
 
-def get_file_size(url, session, headers) -> int:
-    head = session.head(url, headers=headers)
-    head.raise_for_status()
-    file_size = head.headers['Content-Length']
-    return int(file_size)
-
-def init_file(filepath):
-    with open(filepath, 'wb') as fp:
-        pass
+def init_file(filepath, file_size=0):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    allocate_file(filepath, file_size)
 
 def get_file_name(url):
     filename = re.findall(r"/([^/?]*)(?:\?.*)?$", url)[0]
     return filename
 
 
-def partition(file_size, threads):
-    part_size = file_size // threads
-    for i in range(threads):
-        start = i * part_size
-        if i == threads - 1:
-            end = file_size - 1
-        else:
-            end = (i + 1) * part_size - 1
-        yield start, end
+def wait_workers(processes):
+    """
+    阻塞到 download 返回的 worker 全部退出, 包括自适应连接数在下载过程中追加的 worker。
 
-def download_parts(url, session, lock, start, end, total, filepath, retry_count, headers):
-    for _ in range(retry_count):
-        try:
-            headers = copy.deepcopy(headers)
-            headers['Range'] = f'bytes={start}-{end}'
-            response = session.get(
-                url, headers=headers, stream=True)
-            response.raise_for_status()
-            chunks = []
-            for chunk in response.iter_content(chunk_size=128):
-                chunks.append(chunk)
-                lock.acquire()
-                total.value += len(chunk)
-                lock.release()
-
-            lock.acquire()
-            f = open(filepath, 'r+b')
-            f.seek(start)
-            for chunk in chunks:
-                f.write(chunk)
-            f.close()
-            lock.release()
-            break
-        except Exception as e:
-            continue
-
-def download(url, headers, filepath, threads, retry_count):
-    init_file(filepath)
-    session = requests.Session()
-    lock = multiprocessing.Lock()
-    total = multiprocessing.Value(unsigned_long_long, 0)
-    file_size = get_file_size(url, session, headers)
-    processes = []
-    for start, end in partition(file_size, threads):
-        p = multiprocessing.Process(target=download_parts, args=(
-            url, session, lock, start, end, total, filepath, retry_count, headers))
-        processes.append(p)
-        p.start()
-    
-    return processes, total, file_size
+    多进程 worker 只等待它的 sentinel, 不回收进程, 避免与 GUI 线程中暂停时的 join 竞争。
+    """
+    while True:
+        handles = list(processes)
+        for handle in handles:
+            if isinstance(handle, AsyncDownload):
+                handle.join()
+            else:
+                multiprocessing.connection.wait([handle.sentinel])
+        # 等待期间没有追加新的 worker（asyncio 引擎追加在句柄内部）才算结束
+        if len(processes) == len(handles) and not any(handle.is_alive() for handle in handles
+                                                       if isinstance(handle, AsyncDownload)):
+            return
 
-class DownloadHistory(QWidget):
-    clicked = pyqtSignal()
-    def __init__(self, data, parent=None):
+def download(url, headers, filepath, threads, retry_count, buffer_size=DEFAULT_BUFFER_SIZE, resume=False,
+             min_segment=DEFAULT_MIN_SEGMENT, max_segment=DEFAULT_MAX_SEGMENT, engine='process', info=None,
+             writer='pwrite', fsync='none', adaptive=False, limiter=None, initial=ADAPTIVE_START):
+    """
+    开始下载一个文件。
+
+    url 可以是同一个文件的多个镜像地址组成的列表, 探测后只使用与第一个可用地址一致的镜像,
+    各 worker 分别从不同的镜像下载分段。
+
+    adaptive 为 True 时 threads 是连接数上限, 实际连接数从 initial 开始由 ConnectionController 根据吞吐量调整,
+    调用方需要定期调用它的 update()。
+
+    limiter 为任务自己的限速器（见 bandwidth.task_limiter）, 同时受全局限速器限制,
+    调用方保留它即可在下载过程中修改任务的限速; 为None 时只受全局限速。
+
+    服务器不支持 Range 请求或没有返回文件大小时（info.segmented 为 False）, 不论 engine 和 threads
+    都改为一个进程单连接顺序下载, 此时 info.file_size 可能为None, 不会断点续传, 也没有自适应控制器。
+
+    Returns:
+        Tuple[list, Scheduler, RemoteInfo, Journal, ConnectionController | None, MirrorSet]:
+            worker 进程（或 asyncio 任务句柄）、调度器、远程文件信息、断点续传日志、自适应控制器和镜像列表。
+
+    """
+    if engine == 'asyncio':
+        check_writer(writer, fsync)
+    if limiter is None:
+        limiter = task_limiter()
+    # 整个下载过程只探测一次远程文件, 之后所有环节共用这份信息
+    if info is None:
+        info = probe_mirrors([url] if isinstance(url, str) else url, requests.Session(), headers)
+    if not info.segmented:
+        return download_stream(info, headers, filepath, retry_count, buffer_size, writer, fsync, limiter)
+    # 写入后端和 fsync 策略按下载任务选择: 本地 SSD 用 pwrite/mmap, NFS 等慢速存储用 coalesce
+    writer = writer_factory(writer, fsync)
+    file_size = info.file_size
+    # 分段请求直接发往各镜像重定向后的最终地址
+    mirrors = MirrorSet(info.mirrors)
+    journal = Journal(filepath, info.url, file_size, info.etag, info.last_modified)
+    # 远程文件的 ETag/Last-Modified 变化时 load 会丢弃旧日志, 从头下载
+    completed = journal.load() if resume else []
+    if not completed:
+        journal.remove()
+        init_file(filepath, file_size)
+    else:
+        allocate_file(filepath, file_size)
+    scheduler = Scheduler(journal.missing(), threads, completed, min_segment, max_segment)
+    journal.save(scheduler.segments())
+    # 调用方需要在下载期间持有 scheduler: 它的共享内存在父进程中被回收后会分配给下一个任务,
+    # 而子进程仍在使用同一块内存
+    if engine == 'asyncio':
+        # 所有分段都运行在进程内共享的事件循环上, 返回的句柄与 Process 接口一致
+        handle = AsyncDownload(mirrors, headers, scheduler, filepath, retry_count, buffer_size, writer, limiter)
+        processes = [handle]
+        spawn = handle.add_worker
+    else:
+        processes = []
+        def spawn():
+            p = multiprocessing.Process(target=download_worker, args=(
+                mirrors, scheduler, filepath, retry_count, headers, buffer_size, writer, limiter))
+            processes.append(p)
+            p.start()
+    if adaptive:
+        return processes, scheduler, info, journal, ConnectionController(scheduler, spawn, threads, initial), mirrors
+    for _ in range(threads):
+        scheduler.add_worker()
+        spawn()
+    return processes, scheduler, info, journal, None, mirrors
+
+def download_stream(info, headers, filepath, retry_count, buffer_size=DEFAULT_BUFFER_SIZE, writer='pwrite', fsync='none',
+                    limiter=None):
+    """
+    在一个进程中单连接顺序下载整个文件, 返回值与 download 相同。
+    """
+    # 大小未知时无法预先分配文件, mmap 需要完整映射整个文件, 改用 pwrite
+    if info.file_size is None and writer == 'mmap':
+        writer = 'pwrite'
+    writer = writer_factory(writer, fsync)
+    journal = Journal(filepath, info.url, info.file_size, info.etag, info.last_modified)
+    # 不能分段时也无法从日志记录的区间继续, 总是从头下载
+    journal.remove()
+    init_file(filepath, info.file_size or 0)
+    scheduler = stream_scheduler(info.file_size)
+    scheduler.add_worker()
+    process = multiprocessing.Process(target=stream_worker, args=(
+        info.final_url, headers, scheduler, filepath, retry_count, buffer_size, writer, limiter, info.range_support))
+    process.start()
+    return [process], scheduler, info, journal, None, MirrorSet([info.final_url])
+
+def history_entry(row):
+    """
+    把数据库中的一行历史记录转换成显示用的字典。
+    """
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'url': row[2],
+        'status': row[3],
+        'start_time': row[4],
+        'end_time': row[5],
+        'size': row[6]
+    }
+
+
+class HistoryModel(QAbstractListModel):
+    """
+    历史记录的列表模型, 配合 Window.history_view 和 HistoryDelegate 显示。
+
+    只在内存中保存已加载的数据库行, 不为每条记录创建控件, 视图只绘制可见的行。
+    滚动到底部时视图通过 canFetchMore/fetchMore 按 id 从新到旧再加载一页（键集分页）;
+    有搜索内容时显示搜索结果, 不再分页加载。
+    """
+    EntryRole = Qt.ItemDataRole.UserRole
+    # 只保留显示用到的前几列, 见 history_entry
+    HISTORY_FIELDS = 7
+
+    def __init__(self, database, parent=None):
         super().__init__(parent)
-        self.data = data
-        self.id = self.data['id']
-        self.border_color = 'red' if self.data['status'].upper() == 'ERROR' else 'green'
-        self.background_color = 'rgb(255,69,0)' if self.data['status'].upper() == 'ERROR' else 'rgb(124,252,0)'
-        self.initUI()
-
-    def initUI(self):
-        self.setFixedHeight(150)
-
-        main_layout = QVBoxLayout(self)
-
-        frame = QFrame()
-        frame.setFrameShape(QFrame.Shape.Box)
-
-        layout = QVBoxLayout(frame)
-        top_layout = QHBoxLayout()
-        
-        info = self.data['status'].upper()
-        status_label = QLabel(f"状态: {info}", self)
-        status_label.setAlignment(
-            Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-        top_layout.addWidget(status_label)
+        self.database = database
+        self.rows = []
+        self.search_text = ''
+        self.exhausted = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return row[1]
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return row[2]
+        if role == self.EntryRole:
+            return history_entry(row)
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.search_text and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        # 游标为已加载的最后一条（最旧的）记录的 id, 不受新插入和删除的记录影响
+        cursor = self.rows[-1][0] if self.rows else None
+        data = self.database.get_history_before(cursor, HISTORY_PAGE_SIZE)
+        if len(data) < HISTORY_PAGE_SIZE:
+            self.exhausted = True
+        if data:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(data) - 1)
+            self.rows.extend(row[:self.HISTORY_FIELDS] for row in data)
+            self.endInsertRows()
+
+    def search(self, text):
+        """
+        显示与 text 匹配的历史记录, text 为空时从第一页重新分页加载。
+        """
+        self.beginResetModel()
+        self.search_text = text
+        self.rows = [row[:self.HISTORY_FIELDS] for row in self.database.search_history(text, SEARCH_LIMIT)] if text else []
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def prepend(self, row):
+        """
+        在最前面插入一条新记录, 有搜索内容时由 Window.refresh_history 重新搜索。
+        """
+        if self.search_text:
+            return
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self.rows.insert(0, row)
+        self.endInsertRows()
+
+    def remove(self, history_id):
+        for index, row in enumerate(self.rows):
+            if row[0] == history_id:
+                self.beginRemoveRows(QModelIndex(), index, index)
+                del self.rows[index]
+                self.endRemoveRows()
+                return
 
-        time_label = QLabel(f"时间: {self.data['start_time']}  -  {self.data['end_time']}", self)
-        time_label.setAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignTop)
-        top_layout.addWidget(time_label)
 
-        layout.addLayout(top_layout)
+class HistoryDelegate(QStyledItemDelegate):
+    """
+    绘制一条历史记录: 按状态着色的圆角框, 上方为状态和时间, 中间为文件名和大小。
 
-        filename = self.data['filename']
+    所有行共用一个委托直接绘制, 行数再多也不会创建额外的控件。
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont('Arial')
+        self.font.setPixelSize(20)
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), HISTORY_ROW_HEIGHT)
+
+    def paint(self, painter, option, index):
+        entry = index.data(HistoryModel.EntryRole)
+        error = entry['status'].upper() == 'ERROR'
+        background = QColor(255, 69, 0) if error else QColor(124, 252, 0)
+        if option.state & QStyle.StateFlag.State_MouseOver:
+            background = background.lighter(110)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        rect = option.rect.adjusted(12, 12, -12, -12)
+        painter.setPen(QPen(QColor('red' if error else 'green'), 5))
+        painter.setBrush(background)
+        painter.drawRoundedRect(rect, 15, 15)
+
+        filename = entry['filename']
         if len(filename) > 20:
             filename = filename[:20] + "..."
+        text_rect = rect.adjusted(15, 10, -15, -10)
+        painter.setFont(self.font)
+        painter.setPen(QColor('black'))
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, f"状态: {entry['status'].upper()}")
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignTop,
+                         f"时间: {entry['start_time']}  -  {entry['end_time']}")
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignCenter, f"文件名: {filename}    |    文件大小: {entry['size']}")
+        painter.restore()
 
-        download_label = QLabel(
-            f"文件名: {filename} \t|\t 文件大小: {self.data['size']}", self)
-        download_label.setAlignment(Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignHCenter)
-        layout.addWidget(download_label)
-
-        main_layout.addWidget(frame)
-
-        self.setLayout(main_layout)
-
-        style = f"""
-                QFrame {{
-                    background-color: {self.background_color};
-                    border: 5px solid {self.border_color};
-                    border-radius: 15px;
-                }}
-                QLabel {{
-                            font-family: Arial;
-                            color: black;
-                            font-size: 20px;
-                            background-color: transparent;
-                            border: none;
-                        }}
-                """
-
-        self.setStyleSheet(style)
 
-        self.clicked.connect(self.on_clicked)
-    
-    def mousePressEvent(self, event):
-        self.clicked.emit()
-        super().mousePressEvent(event)
-    
-    def on_clicked(self):
-        self.download_info = self.DownloadInfo(self.data, self)
-        self.download_info.exec()
-    
+class HistoryInfo(QDialog):
+    def __init__(self, data, parent=None):
+        super().__init__(parent)
+        self.data = data
+        self.background_color = 'rgb(255,69,0)' if self.data['status'].upper() == 'ERROR' else 'rgb(124,252,0)'
+        self.setWindowTitle("下载信息")
+        self.setFixedSize(800, 600)
+        self.initUI()
     
-    class DownloadInfo(QDialog):
-        def __init__(self, data, parent=None):
-            super().__init__(parent)
-            self.data = data
-            self.background_color = 'rgb(255,69,0)' if self.data['status'].upper() == 'ERROR' else 'rgb(124,252,0)'
-            self.setWindowTitle("下载信息")
-            self.setFixedSize(800, 600)
-            self.initUI()
-        
-        def initUI(self):
-            layout = QVBoxLayout(self)
+    def initUI(self):
+        layout = QVBoxLayout(self)
 
-            title_label = QLabel(f"下载信息: {self.data['filename']}", self)
-            title_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            layout.addWidget(title_label)
+        title_label = QLabel(f"下载信息: {self.data['filename']}", self)
+        title_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(title_label)
 
-            id_label = QLabel(f"内部记录ID: {self.data['id']}", self)
-            id_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-            layout.addWidget(id_label)
+        id_label = QLabel(f"内部记录ID: {self.data['id']}", self)
+        id_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        layout.addWidget(id_label)
 
-            status_label = QLabel(f"状态: {self.data['status']}", self)
-            status_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-            layout.addWidget(status_label)
+        status_label = QLabel(f"状态: {self.data['status']}", self)
+        status_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        layout.addWidget(status_label)
 
-            filename_label = QLabel(f"文件名: {self.data['filename']}", self)
-            filename_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-            layout.addWidget(filename_label)
+        filename_label = QLabel(f"文件名: {self.data['filename']}", self)
+        filename_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        layout.addWidget(filename_label)
 
-            url_label = QLabel(f"URL: {self.data['url']}", self)
-            url_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-            url_label.setWordWrap(True)
-            layout.addWidget(url_label)
+        url_label = QLabel(f"URL: {self.data['url']}", self)
+        url_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        url_label.setWordWrap(True)
+        layout.addWidget(url_label)
 
-            stime_label = QLabel(f"开始下载时间: {self.data['start_time']}", self)
-            stime_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-            layout.addWidget(stime_label)
+        stime_label = QLabel(f"开始下载时间: {self.data['start_time']}", self)
+        stime_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        layout.addWidget(stime_label)
 
-            etime_label = QLabel(f"结束下载时间: {self.data['end_time']}", self)
-            etime_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-            layout.addWidget(etime_label)
+        etime_label = QLabel(f"结束下载时间: {self.data['end_time']}", self)
+        etime_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        layout.addWidget(etime_label)
 
-            size_label = QLabel(f"文件大小: {self.data['size']}", self)
-            size_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-            layout.addWidget(size_label)
+        size_label = QLabel(f"文件大小: {self.data['size']}", self)
+        size_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        layout.addWidget(size_label)
 
-            inner_layout = QHBoxLayout()
+        inner_layout = QHBoxLayout()
 
-            self.removeHistoryAction = QPushButton("删除记录", self)
-            self.removeHistoryAction.setObjectName("button")
-            self.removeHistoryAction.clicked.connect(self.remove_history)
-            inner_layout.addWidget(self.removeHistoryAction)
+        self.removeHistoryAction = QPushButton("删除记录", self)
+        self.removeHistoryAction.setObjectName("button")
+        self.removeHistoryAction.clicked.connect(self.remove_history)
+        inner_layout.addWidget(self.removeHistoryAction)
 
-            self.closeAction = QPushButton("关闭", self)
-            self.closeAction.setObjectName("button")
-            self.closeAction.clicked.connect(self.close)
-            inner_layout.addWidget(self.closeAction)
+        self.closeAction = QPushButton("关闭", self)
+        self.closeAction.setObjectName("button")
+        self.closeAction.clicked.connect(self.close)
+        inner_layout.addWidget(self.closeAction)
 
-            self.retryAction = QPushButton("重新下载" if self.data['status'].upper() == 'OK' else '重试', self)
-            self.retryAction.setObjectName("button")
-            self.retryAction.clicked.connect(self.retry)
-            inner_layout.addWidget(self.retryAction)
+        self.retryAction = QPushButton("重新下载" if self.data['status'].upper() == 'OK' else '重试', self)
+        self.retryAction.setObjectName("button")
+        self.retryAction.clicked.connect(self.retry)
+        inner_layout.addWidget(self.retryAction)
 
-            layout.addLayout(inner_layout)
+        layout.addLayout(inner_layout)
 
-            layout.addStretch(1)
+        layout.addStretch(1)
 
-            style = f"""
-                    QDialog {{
-                        background-color: {self.background_color};
-                    }}
-                    QPushButton#button {{
-                        background-color: rgb(0,200,255);
-                        color: black;
-                        padding: 10px 20px;
-                        margin: 0 10px;
-                        border-radius: 5px;
-                        font-weight: bold;
-                        text-align: center;
-                        font-size: 30px;
-                    }}
-                    QPushButton#button:hover {{
-                        background-color: rgb(0,190,250);
-                        opacity: 0.9;
-                    }}
-                    QPushButton#button:pressed {{
-                        background-color: rgb(0,170,230);
-                        opacity: 0.8;
-                    }}
-                """
+        style = f"""
+                QDialog {{
+                    background-color: {self.background_color};
+                }}
+                QPushButton#button {{
+                    background-color: rgb(0,200,255);
+                    color: black;
+                    padding: 10px 20px;
+                    margin: 0 10px;
+                    border-radius: 5px;
+                    font-weight: bold;
+                    text-align: center;
+                    font-size: 30px;
+                }}
+                QPushButton#button:hover {{
+                    background-color: rgb(0,190,250);
+                    opacity: 0.9;
+                }}
+                QPushButton#button:pressed {{
+                    background-color: rgb(0,170,230);
+                    opacity: 0.8;
+                }}
+            """
 
-            self.setStyleSheet(style)
+        self.setStyleSheet(style)
 
-            self.setLayout(layout)
-        
-        def remove_history(self):
-            d = Database()
-            d.delete_history(self.data['id'])
-            parent_layout = self.parent().parentWidget().layout()
-            parent_layout.removeWidget(self.parent())
-            self.deleteLater()
-        
-        def retry(self):
-            self.close()
-            self.parent().parent().parent().parent().parent().add_download_task(
-                url=self.data['url'],
-                filename=self.data['filename']
-                )
-        
-        def showEvent(self, event) -> None:
-            super().showEvent(event)
-            self.fadeIn()
-        
-        def fadeIn(self):
-            animation = QPropertyAnimation(self, b"windowOpacity", self)
-            animation.setDuration(200)
-            animation.setStartValue(0)
-            animation.setEndValue(1)
-            animation.start()
+        self.setLayout(layout)
+    
+    def remove_history(self):
+        self.close()
+        self.parent().remove_history(self.data['id'])
+
+    def retry(self):
+        self.close()
+        self.parent().add_download_task(
+            url=self.data['url'],
+            filename=self.data['filename']
+            )
+    
+    def showEvent(self, event) -> None:
+        super().showEvent(event)
+        self.fadeIn()
+    
+    def fadeIn(self):
+        animation = QPropertyAnimation(self, b"windowOpacity", self)
+        animation.setDuration(200)
+        animation.setStartValue(0)
+        animation.setEndValue(1)
+        animation.start()
 
 
 class Setting(QDialog):
@@ -314,6 +491,11 @@ class Setting(QDialog):
         super().__init__(parent)
         self.database = Database()
         self.threads, self.download_dir, self.retry, self.user_agent = self.database.return_config()
+        self.engine = self.database.get_option('engine', 'process')
+        self.adaptive = self.database.get_option('adaptive', 0)
+        self.max_active = self.database.get_option('max_active', DEFAULT_MAX_ACTIVE)
+        self.max_total_connections = self.database.get_option('max_connections', DEFAULT_MAX_CONNECTIONS)
+        self.limit = self.database.get_option('limit', 0)
         self.initUI()
     
     def initUI(self):
@@ -331,7 +513,7 @@ class Setting(QDialog):
         self.threads_spinbox = QSpinBox(self)
         self.threads_spinbox.setStyleSheet("font-size: 25px;")
         self.threads_spinbox.setFixedWidth(100)
-        self.threads_spinbox.setRange(1, multiprocessing.cpu_count())
+        self.threads_spinbox.setRange(1, max_connections(self.engine))
         self.threads_spinbox.setValue(self.threads)
         self.threads_layout.addWidget(self.threads_spinbox)
 
@@ -375,6 +557,72 @@ class Setting(QDialog):
 
         self.main_layout.addLayout(self.retry_layout)
 
+        self.engine_layout = QHBoxLayout()
+
+        self.engine_label = QLabel("下载引擎: ", self)
+        self.engine_label.setStyleSheet("font-size: 25px;")
+        self.engine_layout.addWidget(self.engine_label)
+
+        self.engine_combobox = QComboBox(self)
+        self.engine_combobox.setStyleSheet("font-size: 25px;")
+        for key, name in ENGINES.items():
+            self.engine_combobox.addItem(name, key)
+        self.engine_combobox.setCurrentIndex(max(0, self.engine_combobox.findData(self.engine)))
+        self.engine_combobox.currentIndexChanged.connect(self.engine_changed)
+        self.engine_layout.addWidget(self.engine_combobox)
+
+        self.adaptive_checkbox = QCheckBox("自适应连接数", self)
+        self.adaptive_checkbox.setStyleSheet("font-size: 25px;")
+        self.adaptive_checkbox.setToolTip("根据吞吐量自动增减连接数, 下载线程数为上限")
+        self.adaptive_checkbox.setChecked(bool(self.adaptive))
+        self.engine_layout.addWidget(self.adaptive_checkbox)
+
+        self.engine_layout.addStretch(1)
+
+        self.main_layout.addLayout(self.engine_layout)
+
+        self.queue_layout = QHBoxLayout()
+
+        self.max_active_label = QLabel("同时下载任务数: ", self)
+        self.max_active_label.setStyleSheet("font-size: 25px;")
+        self.queue_layout.addWidget(self.max_active_label)
+
+        self.max_active_spinbox = QSpinBox(self)
+        self.max_active_spinbox.setStyleSheet("font-size: 25px;")
+        self.max_active_spinbox.setFixedWidth(100)
+        self.max_active_spinbox.setRange(1, 20)
+        self.max_active_spinbox.setValue(self.max_active)
+        self.queue_layout.addWidget(self.max_active_spinbox)
+
+        self.max_connections_label = QLabel("总连接数: ", self)
+        self.max_connections_label.setStyleSheet("font-size: 25px;")
+        self.queue_layout.addWidget(self.max_connections_label)
+
+        self.max_connections_spinbox = QSpinBox(self)
+        self.max_connections_spinbox.setStyleSheet("font-size: 25px;")
+        self.max_connections_spinbox.setFixedWidth(100)
+        self.max_connections_spinbox.setRange(1, 256)
+        self.max_connections_spinbox.setValue(self.max_total_connections)
+        self.queue_layout.addWidget(self.max_connections_spinbox)
+
+        self.queue_layout.addStretch(1)
+
+        self.main_layout.addLayout(self.queue_layout)
+
+        self.limit_layout = QHBoxLayout()
+
+        self.limit_label = QLabel("全局限速: ", self)
+        self.limit_label.setStyleSheet("font-size: 25px;")
+        self.limit_layout.addWidget(self.limit_label)
+
+        self.limit_spinbox = limit_spinbox(self, self.limit)
+        self.limit_spinbox.setToolTip("所有下载任务合计的速度上限, 保存后对正在下载的任务立即生效")
+        self.limit_layout.addWidget(self.limit_spinbox)
+
+        self.limit_layout.addStretch(1)
+
+        self.main_layout.addLayout(self.limit_layout)
+
         self.user_agent_layout = QHBoxLayout()
 
         self.user_agent_label = QLabel("User-Agent: ", self)
@@ -389,10 +637,9 @@ class Setting(QDialog):
 
         self.main_layout.addLayout(self.user_agent_layout)
 
-        for _ in range(2):
-            temp = QHBoxLayout()
-            temp.addWidget(QLabel(""))
-            self.main_layout.addLayout(temp)
+        temp = QHBoxLayout()
+        temp.addWidget(QLabel(""))
+        self.main_layout.addLayout(temp)
 
         self.button_layout = QHBoxLayout()
 
@@ -445,6 +692,9 @@ class Setting(QDialog):
         if directory:
             self.download_dir_edit.setText(directory)
     
+    def engine_changed(self):
+        self.threads_spinbox.setRange(1, max_connections(self.engine_combobox.currentData()))
+
     def save_setting(self):
         if not os.path.exists(self.download_dir_edit.text()):
             QMessageBox.warning(self, "警告", "请输入正确的下载目录！", QMessageBox.StandardButton.Ok)
@@ -458,6 +708,13 @@ class Setting(QDialog):
             retry=self.retry_spinbox.value(),
             user_agent=self.user_agent_edit.toPlainText()
         )
+        self.database.set_option('engine', self.engine_combobox.currentData())
+        self.database.set_option('adaptive', int(self.adaptive_checkbox.isChecked()))
+        self.database.set_option('max_active', self.max_active_spinbox.value())
+        self.database.set_option('max_connections', self.max_connections_spinbox.value())
+        self.database.set_option('limit', self.limit_spinbox.value())
+        self.apply_queue_limits()
+        global_limiter().set_rate(self.limit_spinbox.value() * 1024)
         QMessageBox.question(self, "提示", "已保存全局设置.", QMessageBox.StandardButton.Ok)
 
     def reset_setting(self):
@@ -469,6 +726,25 @@ class Setting(QDialog):
             self.download_dir_edit.setText(self.download_dir)
             self.retry_spinbox.setValue(self.retry)
             self.user_agent_edit.setText(self.user_agent)
+            self.engine = self.database.get_option('engine', 'process')
+            self.engine_combobox.setCurrentIndex(max(0, self.engine_combobox.findData(self.engine)))
+            self.adaptive = self.database.get_option('adaptive', 0)
+            self.adaptive_checkbox.setChecked(bool(self.adaptive))
+            self.max_active = self.database.get_option('max_active', DEFAULT_MAX_ACTIVE)
+            self.max_total_connections = self.database.get_option('max_connections', DEFAULT_MAX_CONNECTIONS)
+            self.max_active_spinbox.setValue(self.max_active)
+            self.max_connections_spinbox.setValue(self.max_total_connections)
+            self.limit = self.database.get_option('limit', 0)
+            self.limit_spinbox.setValue(self.limit)
+            self.apply_queue_limits()
+            global_limiter().set_rate(self.limit * 1024)
+
+    def apply_queue_limits(self):
+        # 新的限制立即生效: 放宽后排队的任务马上开始, 收紧时已在下载的任务不受影响
+        download_queue = self.parent().download_queue
+        download_queue.max_active = self.max_active_spinbox.value()
+        download_queue.max_connections = self.max_connections_spinbox.value()
+        self.parent().start_queued()
 
 
 class StartDownload(QDialog):
@@ -476,6 +752,9 @@ class StartDownload(QDialog):
         super().__init__(parent)
         self.database = Database()
         self.threads, self.download_dir, self.retry, self.user_agent = self.database.return_config()
+        self.engine = self.database.get_option('engine', 'process')
+        self.adaptive = self.database.get_option('adaptive', 0)
+        self.profile = None
         self.url = url
         self.filename = filename
         if self.url != '' and self.filename == '':
@@ -512,6 +791,18 @@ class StartDownload(QDialog):
 
         self.main_layout.addLayout(self.url_layout)
 
+        self.mirror_layout = QHBoxLayout()
+
+        self.mirror_label = QLabel("镜像: ", self)
+        self.mirror_layout.addWidget(self.mirror_label)
+
+        self.mirror_edit = QLineEdit(self)
+        self.mirror_edit.setStyleSheet("font-size: 25px;")
+        self.mirror_edit.setPlaceholderText("同一文件的其它下载地址, 多个用空格分隔（可选）")
+        self.mirror_layout.addWidget(self.mirror_edit)
+
+        self.main_layout.addLayout(self.mirror_layout)
+
         self.download_dir_layout = QHBoxLayout()
 
         self.download_dir_label = QLabel("下载目录: ", self)
@@ -553,7 +844,7 @@ class StartDownload(QDialog):
         self.threads_spinbox = QSpinBox(self)
         self.threads_spinbox.setStyleSheet("font-size: 25px;")
         self.threads_spinbox.setFixedWidth(100)
-        self.threads_spinbox.setRange(1, multiprocessing.cpu_count())
+        self.threads_spinbox.setRange(1, max_connections(self.engine))
         self.threads_spinbox.setValue(self.threads)
         self.threads_layout.addWidget(self.threads_spinbox)
 
@@ -577,8 +868,79 @@ class StartDownload(QDialog):
 
         self.threads_retry_layout.addLayout(self.retry_layout)
 
+        self.priority_layout = QHBoxLayout()
+
+        self.priority_label = QLabel("优先级: ", self)
+        self.priority_layout.addWidget(self.priority_label)
+
+        self.priority_spinbox = QSpinBox(self)
+        self.priority_spinbox.setStyleSheet("font-size: 25px;")
+        self.priority_spinbox.setFixedWidth(100)
+        self.priority_spinbox.setRange(0, 9)
+        self.priority_spinbox.setValue(5)
+        self.priority_spinbox.setToolTip("数值越大越先开始下载")
+        self.priority_layout.addWidget(self.priority_spinbox)
+
+        self.priority_layout.addStretch(1)
+
+        self.adaptive_checkbox = QCheckBox("自适应", self)
+        self.adaptive_checkbox.setToolTip("根据吞吐量自动增减连接数, 线程数为上限")
+        self.adaptive_checkbox.setChecked(bool(self.adaptive))
+        self.priority_layout.addWidget(self.adaptive_checkbox)
+
+        self.threads_retry_layout.addLayout(self.priority_layout)
+
         self.main_layout.addLayout(self.threads_retry_layout)
 
+        self.profile_layout = QHBoxLayout()
+
+        self.profile_checkbox = QCheckBox("按主机记录", self)
+        self.profile_checkbox.setToolTip("根据以往从同一主机下载的结果选择连接数和分段大小, 取消后使用设置中的线程数")
+        self.profile_checkbox.setChecked(True)
+        self.profile_layout.addWidget(self.profile_checkbox)
+
+        self.profile_label = QLabel("", self)
+        self.profile_label.setStyleSheet("font-size: 18px; font-weight: normal;")
+        self.profile_layout.addWidget(self.profile_label)
+
+        self.profile_layout.addStretch(1)
+
+        self.main_layout.addLayout(self.profile_layout)
+
+        self.profile_checkbox.toggled.connect(self.apply_profile)
+        self.adaptive_checkbox.toggled.connect(self.apply_profile)
+
+        self.storage_layout = QHBoxLayout()
+
+        self.writer_label = QLabel("写入方式: ", self)
+        self.storage_layout.addWidget(self.writer_label)
+
+        self.writer_combobox = QComboBox(self)
+        self.writer_combobox.setStyleSheet("font-size: 25px;")
+        for key, name in WRITER_NAMES.items():
+            self.writer_combobox.addItem(name, key)
+        self.storage_layout.addWidget(self.writer_combobox)
+
+        self.fsync_label = QLabel("fsync: ", self)
+        self.storage_layout.addWidget(self.fsync_label)
+
+        self.fsync_combobox = QComboBox(self)
+        self.fsync_combobox.setStyleSheet("font-size: 25px;")
+        for key, name in FSYNC_NAMES.items():
+            self.fsync_combobox.addItem(name, key)
+        self.storage_layout.addWidget(self.fsync_combobox)
+
+        self.limit_label = QLabel("限速: ", self)
+        self.storage_layout.addWidget(self.limit_label)
+
+        self.limit_spinbox = limit_spinbox(self, 0)
+        self.limit_spinbox.setToolTip("本任务的速度上限, 同时受全局限速限制, 下载过程中可以修改")
+        self.storage_layout.addWidget(self.limit_spinbox)
+
+        self.storage_layout.addStretch(1)
+
+        self.main_layout.addLayout(self.storage_layout)
+
         self.main_layout.addWidget(self.occupancy_label)
 
         self.button_layout = QHBoxLayout()
@@ -628,6 +990,7 @@ class StartDownload(QDialog):
                 }}
             """
         self.setStyleSheet(style)
+        self.apply_profile()
     
     def browse_directory(self):
         directory = QFileDialog.getExistingDirectory(self, "选择下载目录", self.download_dir)
@@ -640,6 +1003,21 @@ class StartDownload(QDialog):
         if filename is not None:
             filename = filename.replace('%20', ' ')
             self.filename_edit.setText(filename)
+        self.apply_profile()
+
+    def apply_profile(self):
+        """
+        按 URL 所在主机的记录填写线程数, 用户仍可以手动修改; 取消“按主机记录”时恢复设置中的线程数。
+
+        自适应模式下线程数是上限, 主机记录只决定初始连接数, 线程数保持设置中的值。
+        """
+        url = self.url_edit.text().strip()
+        self.profile = HostProfile.load(self.database, host_of(url)) if url else None
+        self.profile_label.setText(self.profile.describe() if self.profile is not None else '')
+        connections = None
+        if self.profile is not None and self.profile_checkbox.isChecked() and not self.adaptive_checkbox.isChecked():
+            connections = self.profile.recommend(self.threads_spinbox.maximum())
+        self.threads_spinbox.setValue(connections or self.threads)
     
     def accept_download(self):
         url = self.url_edit.text()
@@ -650,51 +1028,68 @@ class StartDownload(QDialog):
         retry = self.retry_spinbox.value()
         headers = {}
         headers['User-Agent'] = self.user_agent
+        profile = self.profile if self.profile_checkbox.isChecked() else None
+        max_segment = initial = None
+        if profile is not None:
+            max_segment = profile.segment_size()
+            initial = profile.recommend(threads)
         if url == "" or filename == "":
             msg = QMessageBox.warning(self, '警告', '请输入正确的URL和文件名', QMessageBox.StandardButton.Ok)
             return
         if not os.path.exists(download_dir):
             msg = QMessageBox.warning(self, '警告', '下载目录不存在，请创建或选择其他目录', QMessageBox.StandardButton.Ok)
             return
-        if os.path.exists(filepath):
+        resume = False
+        if os.path.exists(filepath) and os.path.exists(filepath + JOURNAL_SUFFIX):
+            msg = QMessageBox.question(self, '提示', '检测到未完成的下载，是否继续下载？（选择否将重新下载）', QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            resume = msg == QMessageBox.StandardButton.Yes
+        elif os.path.exists(filepath):
             msg = QMessageBox.warning(self, '警告', '该文件已存在，是否覆盖？', QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
             if msg == QMessageBox.StandardButton.No:
                 return
             os.remove(filepath)
-        processes, total, file_size = download(
-            url=url,
-            headers=headers,
-            filepath=filepath,
-            threads=threads,
-            retry_count=retry
-            )
         entry = {
             'filename': filename,
             'url': url,
-            'status': '正在下载...',
-            'start_time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'file_size': file_size,
-            'processes': processes,
-            'total': total,
+            'status': '排队中',
             'file_path': filepath,
+            'headers': headers,
+            'threads': threads,
+            'retry': retry,
+            'engine': self.engine,
+            'resume': resume,
+            'priority': self.priority_spinbox.value(),
+            'writer': self.writer_combobox.currentData(),
+            'fsync': self.fsync_combobox.currentData(),
+            'adaptive': self.adaptive_checkbox.isChecked(),
+            'mirrors': self.mirror_edit.text().split(),
+            'limit': self.limit_spinbox.value(),
+            'max_segment': max_segment or DEFAULT_MAX_SEGMENT,
+            'initial': initial or ADAPTIVE_START,
         }
         download_info = DownloadInfo(entry)
         self.close()
-        self.parent().scroll_layout.insertWidget(0, download_info)
+        # 由全局队列决定何时开始以及分配多少连接
+        self.parent().enqueue_download(download_info)
     
 class DownloadInfo(QWidget):
+    # 本轮的 worker 全部退出, 参数为 download 返回的 worker 列表
+    finished = pyqtSignal(object)
+
     def __init__(self, data, parent=None):
         super().__init__(parent)
         self.data = data
         self.database = Database()
-        self.filesize = data['file_size']
-        if self.filesize / (1024 ** 2) < 1:
-            self.unit = 'KB'
-        elif self.filesize / (1024 ** 3) < 10:
-            self.unit = 'MB'
-        else:
-            self.unit = 'GB'
-        self.last_total = 0
+        self.unit = 'MB'
+        self.tracker = None
+        # 实际下载的时间（秒）, 不含排队和暂停
+        self.active_seconds = 0.0
+        self.started_at = None
+        self.last_journal_save = time.time()
+        self.paused = False
+        self.verifier = None
+        # 任务自己的限速器, 暂停后继续下载时沿用, 下载过程中可以修改
+        self.limiter = task_limiter(self.data.get('limit', 0) * 1024)
         self.initUI()
     
     def initUI(self):
@@ -712,19 +1107,43 @@ class DownloadInfo(QWidget):
         self.filename_label.setAlignment(Qt.AlignmentFlag.AlignLeft)
         top_layout.addWidget(self.filename_label)
 
-        # self.percentage = QLabel("0 MB/s    ", self)
-        # self.percentage.setAlignment(Qt.AlignmentFlag.AlignRight)
-        # top_layout.addWidget(self.percentage)
+        self.up_button = QPushButton("↑", self)
+        self.up_button.setObjectName("pause")
+        self.up_button.setToolTip("在队列中前移")
+        self.up_button.clicked.connect(lambda: self.move_in_queue(-1))
+        top_layout.addWidget(self.up_button)
+
+        self.down_button = QPushButton("↓", self)
+        self.down_button.setObjectName("pause")
+        self.down_button.setToolTip("在队列中后移")
+        self.down_button.clicked.connect(lambda: self.move_in_queue(1))
+        top_layout.addWidget(self.down_button)
+
+        self.pause_button = QPushButton("暂停", self)
+        self.pause_button.setObjectName("pause")
+        self.pause_button.clicked.connect(self.toggle_pause)
+        self.pause_button.hide()
+        top_layout.addWidget(self.pause_button)
+
+        self.limit_button = QPushButton("限速", self)
+        self.limit_button.setObjectName("pause")
+        self.limit_button.setToolTip(f"本任务限速: {format_rate(self.limiter.rate.value)}")
+        self.limit_button.clicked.connect(self.change_limit)
+        top_layout.addWidget(self.limit_button)
+
+        # 平滑速度和剩余时间, 悬停显示瞬时速度、速度曲线和各分段速度
+        self.speed_label = QLabel("", self)
+        self.speed_label.setAlignment(Qt.AlignmentFlag.AlignRight)
+        top_layout.addWidget(self.speed_label)
 
         layout.addLayout(top_layout)
 
         self.progress_bar = QProgressBar(self)
         self.progress_bar.setValue(0)
-        self.progress_bar.setMaximum(self.data['file_size'])
         self.progress_bar.setStyleSheet('font-size: 20px')
         layout.addWidget(self.progress_bar)
 
-        self.unit_label = QLabel('', self)
+        self.unit_label = QLabel(f"排队中 (优先级 {self.data['priority']})", self)
         self.unit_label.setAlignment(Qt.AlignmentFlag.AlignHCenter)
         layout.addWidget(self.unit_label)
 
@@ -745,86 +1164,286 @@ class DownloadInfo(QWidget):
                             background-color: transparent;
                             border: none;
                         }}
+                QPushButton#pause {{
+                            background-color: rgb(0,200,255);
+                            color: black;
+                            font-size: 18px;
+                            border: none;
+                            border-radius: 5px;
+                            padding: 2px 10px;
+                        }}
                 """
 
         self.setStyleSheet(style)
 
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update)
-        self.timer.start(20)
+        self.finished.connect(self.finish)
+
+    def start(self, connections):
+        """
+        由队列调度时调用, 使用分配到的连接数开始（或继续）下载。
+        """
+        try:
+            processes, scheduler, info, journal, controller, mirrors = download(
+                url=[self.data['url']] + self.data.get('mirrors', []),
+                headers=self.data['headers'],
+                filepath=self.data['file_path'],
+                threads=connections,
+                retry_count=self.data['retry'],
+                resume=self.data['resume'],
+                engine=self.data['engine'],
+                writer=self.data['writer'],
+                fsync=self.data['fsync'],
+                adaptive=self.data['adaptive'],
+                limiter=self.limiter,
+                max_segment=self.data.get('max_segment', DEFAULT_MAX_SEGMENT),
+                initial=self.data.get('initial', ADAPTIVE_START)
+                )
+        except (InsufficientSpaceError, ValueError, requests.RequestException, OSError) as e:
+            # 预留文件空间失败等其它 OSError 同样放弃这个任务
+            QMessageBox.warning(self, '警告', f"{self.data['filename']}: {e}", QMessageBox.StandardButton.Ok)
+            self.cancel()
+            return
+        if not info.segmented:
+            # 单连接下载只占用一个连接, 多分到的连接还给队列
+            connections = 1
+            self.window().download_queue.resize(self, connections)
+        self.data.update(
+            processes=processes,
+            scheduler=scheduler,
+            file_size=info.file_size,
+            info=info,
+            journal=journal,
+            controller=controller,
+            mirror_set=mirrors,
+            connections=connections,
+            status='正在下载...',
+            )
+        self.data.setdefault('start_time', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        # 第一次开始时从断点续传日志恢复的字节数, 不计入本任务下载的字节数
+        self.data.setdefault('resumed', journal.completed_size)
+        if info.file_size is None:
+            # 大小未知时进度条显示为忙碌状态, 只显示已接收的字节数
+            self.unit = 'MB'
+            self.progress_bar.setMaximum(0)
+        else:
+            if info.file_size / (1024 ** 2) < 1:
+                self.unit = 'KB'
+            elif info.file_size / (1024 ** 3) < 10:
+                self.unit = 'MB'
+            else:
+                self.unit = 'GB'
+            self.progress_bar.setMaximum(info.file_size)
+        if not info.segmented:
+            self.progress_bar.setToolTip(f"单连接下载: {fallback_reason(info)}")
+        for mirror, reason in info.rejected_mirrors:
+            QMessageBox.warning(self, '警告', f"已忽略镜像 {mirror}: {reason}", QMessageBox.StandardButton.Ok)
+        # 跟随已连续完成的前缀增量计算校验值
+        self.verifier = start_verifier(self.data['file_path'], info, scheduler)
+        # 继续下载时进度数组是新建的, 速度从头统计
+        self.tracker = ThroughputTracker(scheduler)
+        self.started_at = time.monotonic()
+        self.up_button.hide()
+        self.down_button.hide()
+        self.pause_button.show()
+        # worker 退出时由后台线程发出 finished 信号, 进度由 Window 统一定时刷新
+        threading.Thread(target=self.watch_workers, args=(processes,), daemon=True).start()
+
+    def watch_workers(self, processes):
+        wait_workers(processes)
+        self.finished.emit(processes)
+
+    def change_limit(self):
+        value, ok = QInputDialog.getInt(self, '限速', '本任务的速度上限 (KB/s, 0 表示不限速):',
+                                        self.data.get('limit', 0), 0, 10 ** 7, 128)
+        if not ok:
+            return
+        self.data['limit'] = value
+        # 限速器在共享内存中, 正在下载的 worker 立即按新速率执行
+        self.limiter.set_rate(value * 1024)
+        self.limit_button.setToolTip(f"本任务限速: {format_rate(self.limiter.rate.value)}")
+
+    def cancel(self):
+        window = self.window()
+        window.download_queue.remove(self)
+        window.scroll_layout.removeWidget(self)
+        self.deleteLater()
+        window.start_queued()
+
+    def move_in_queue(self, offset):
+        window = self.window()
+        window.download_queue.move(self, offset)
+        window.arrange_tasks()
     
+    def toggle_pause(self):
+        if self.paused:
+            self.resume()
+        else:
+            self.pause()
+
+    def pause(self):
+        for process in self.data['processes']:
+            process.terminate()
+        for process in self.data['processes']:
+            process.join()
+        if self.verifier is not None:
+            self.verifier.stop()
+        self.data['journal'].save(self.data['scheduler'].segments())
+        self.paused = True
+        self.active_seconds += time.monotonic() - self.started_at
+        self.pause_button.setText("继续")
+        self.speed_label.setText("")
+        # 暂停的任务归还连接, 让排队的任务开始
+        window = self.window()
+        window.download_queue.release(self)
+        window.start_queued()
+
+    def resume(self):
+        # 重新排队; 暂停期间远程文件可能已经变化, 开始时会重新探测一次以便校验断点续传日志
+        self.paused = False
+        self.data['resume'] = True
+        self.pause_button.setText("暂停")
+        self.pause_button.hide()
+        self.up_button.show()
+        self.down_button.show()
+        self.unit_label.setText(f"排队中 (优先级 {self.data['priority']})")
+        window = self.window()
+        window.download_queue.add(self, self.data['threads'], self.data['priority'])
+        window.start_queued()
+
     def update(self):
-        processes = self.data['processes']
-        total = self.data['total']
+        if self.paused:
+            return
         file_size = self.data['file_size']
-        if self.processes_alive(processes):
-            # self.percentage.setText(f"{round(((total.value / (1024 ** 2)) - (self.last_total / (1024 ** 2))) / 0.01, 2)} MB/s    ")
-            # self.last_total = total.value
-            self.progress_bar.setValue(total.value)
-            if self.unit == 'KB':
-                text = f"{round(total.value / 1024, 2)} {self.unit} / {round(file_size / 1024, 2)} {self.unit}"
-            elif self.unit == 'MB':
-                text = f"{round(total.value / (1024 ** 2), 2)} {self.unit} / {round(file_size / (1024 ** 2), 2)} {self.unit}"
-            else:
-                text = f"{round(total.value / (1024 ** 3), 2)} {self.unit} / {round(file_size / (1024 ** 3), 2)} {self.unit}"
-            self.unit_label.setText(text)
+        if time.time() - self.last_journal_save > 1:
+            # fsync 目标文件可能很慢, 在后台线程中进行
+            self.data['journal'].save_in_background(self.data['scheduler'].segments())
+            self.last_journal_save = time.time()
+        total = total_done(self.data['scheduler'].segments())
+        if self.tracker.update():
+            self.speed_label.setText(
+                f"{format_speed(self.tracker.smoothed)}  剩余 {format_eta(self.tracker.eta(file_size))}    ")
+            spread = format_spread(self.tracker.spread())
+            self.speed_label.setToolTip('\n'.join(
+                [f"瞬时速度: {format_speed(self.tracker.speed)}", self.tracker.sparkline(40)]
+                + ([f"分段速度 (最小/中位数/最大): {spread}"] if spread else [])))
+        self.progress_bar.setValue(total)
+        info = self.data['info']
+        if info.segmented:
+            connections, requests_sent = connection_stats(self.data['scheduler'].segments())
+            mirrors = self.data['mirror_set']
+            self.progress_bar.setToolTip('\n'.join(
+                [f"{requests_sent} 个请求, 新建 {connections} 个连接"] + (mirrors.summary() if len(mirrors.urls) > 1 else [])))
+        if file_size is None:
+            text = f"已接收 {self.size_text(total)}"
         else:
-            end_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            parent_layout = self.parentWidget().layout()
-            parent_layout.removeWidget(self)
-            self.deleteLater()
-            self.timer.stop()
-
-            if self.unit == 'KB':
-                size = f"{(self.data['file_size'] / 1024):.2f} {self.unit}"
-            elif self.unit == 'MB':
-                size = f"{(self.data['file_size'] / (1024 ** 2)):.2f} {self.unit}"
-            else:
-                size = f"{(self.data['file_size'] / (1024 ** 3)):.2f} {self.unit}"
-
-            status = self.status_check()
-            self.database.add_download_record(
-                filename=self.data['filename'],
-                url=self.data['url'],
-                status=status,
-                start_time=self.data['start_time'],
-                end_time=end_time,
-                size = size
-            )
+            text = f"{self.size_text(total)} / {self.size_text(file_size)}"
+        controller = self.data['controller']
+        if not info.segmented:
+            text += "  [单连接]"
+        elif controller is not None:
+            decision = controller.update()
+            if decision:
+                self.unit_label.setToolTip('\n'.join(
+                    f"{time.strftime('%H:%M:%S', time.localtime(t))} {message}" for t, message in controller.decisions))
+            text += f"  [{controller.status()}]"
+            if controller.decisions:
+                text += f"  {controller.decisions[-1][1]}"
+        else:
+            text += f"  [{self.data['connections']} 连接]"
+        stalled = stalled_segments(self.data['scheduler'].segments())
+        if stalled:
+            text += f"  (停滞分段: {', '.join(str(i + 1) for i in stalled)})"
+        self.unit_label.setText(text)
+
+    def finish(self, processes):
+        """
+        worker 全部退出后由 watch_workers 线程通过 finished 信号触发, 记录下载结果并移出任务列表。
+        """
+        if self.paused or processes is not self.data.get('processes'):
+            # 暂停时被结束的 worker, 或者暂停之前那一轮的 worker
+            return
+        end_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.active_seconds += time.monotonic() - self.started_at
+        window = self.window()
+        window.download_queue.remove(self)
+        window.scroll_layout.removeWidget(self)
+        self.deleteLater()
+
+        if self.data['file_size'] is None:
+            # 单连接下载结束后才知道文件大小, 未完成时为已接收的字节数
+            self.data['file_size'] = total_done(self.data['scheduler'].segments())
+        size = self.size_text(self.data['file_size'])
+
+        status = self.status_check()
+        progress = self.data['scheduler'].segments()
+        downloaded = total_done(progress) - self.data['resumed']
+        table_id = self.database.add_download_record(
+            filename=self.data['filename'],
+            url=self.data['url'],
+            status=status,
+            start_time=self.data['start_time'],
+            end_time=end_time,
+            size = size,
+            bytes=downloaded,
+            duration=self.active_seconds,
+            connections=self.data['connections'],
+            retries=sum(slot.retries for slot in progress)
+        )
 
-            table_id = self.database.get_max_id() + 1
-            entry = {
-                'id': table_id,
-                'filename': self.data['filename'],
-                'url': self.data['url'],
-                'status': status,
-                'start_time': self.data['start_time'],
-                'end_time': end_time,
-                'size': size
-            }
-            parent_layout.insertWidget(0, DownloadHistory(entry))
-        
-    def processes_alive(self, processes):
-        for process in processes:
-            if process.is_alive():
-                return True
-        return False
+        controller = self.data['controller']
+        if status == 'ok' and len(self.data['mirror_set'].urls) == 1:
+            # 失败的下载测不出主机的真实速度; 使用多个镜像时各主机的速度混在一起, 都不记入主机记录
+            record_download(
+                self.database, self.data['url'],
+                connections=controller.target if controller is not None else self.data['connections'],
+                progress=progress,
+                bytes=downloaded,
+                duration=self.active_seconds,
+                range_support=self.data['info'].range_support,
+                samples=controller.samples if controller is not None else None
+                )
+
+        window.history_model.prepend(
+            (table_id, self.data['filename'], self.data['url'], status, self.data['start_time'], end_time, size))
+        window.history_changed.emit()
+        window.start_queued()
     
+    def size_text(self, size):
+        if self.unit == 'KB':
+            return f"{size / 1024:.2f} {self.unit}"
+        elif self.unit == 'MB':
+            return f"{size / (1024 ** 2):.2f} {self.unit}"
+        return f"{size / (1024 ** 3):.2f} {self.unit}"
+
     def status_check(self):
         size = os.path.getsize(self.data['file_path'])
-        if size == self.data['file_size']:
+        if size == self.data['file_size'] and all_done(self.data['scheduler'].segments()):
+            self.data['journal'].remove()
+            # 校验值在下载过程中已增量计算, 这里只补算最后一小段
+            if self.verifier is not None and self.verifier.finish() is False:
+                return 'error'
             return 'ok'
         else:
+            if self.verifier is not None:
+                self.verifier.stop()
+            # 保留日志, 重试时只下载缺失的部分
+            self.data['journal'].save(self.data['scheduler'].segments())
             return 'error'
 
 
 class Window(QWidget):
+    # 历史记录被添加、删除或清空后发出
+    history_changed = pyqtSignal()
+
     def __init__(self):
         super(Window, self).__init__()
         self.database = Database()
-        self.pages = self.database.get_pages()
-        self.count = 1
-        self.load_pages_cooldown_flag = False
+        self.download_queue = DownloadQueue(
+            max_active=self.database.get_option('max_active', DEFAULT_MAX_ACTIVE),
+            max_connections=self.database.get_option('max_connections', DEFAULT_MAX_CONNECTIONS)
+            )
+        # 全局限速器在启动任何 worker 之前创建, 所有任务共享
+        global_limiter().set_rate(self.database.get_option('limit', 0) * 1024)
         self.initUI()
     
     def initUI(self):
@@ -838,6 +1457,7 @@ class Window(QWidget):
 
         self.main_layout = QHBoxLayout()
 
+        # 正在下载、排队中和已暂停的任务, 没有任务时隐藏
         self.scroll_area = QScrollArea()
         self.scroll_area.setWidgetResizable(True)
         self.scroll_content = QWidget()
@@ -846,8 +1466,43 @@ class Window(QWidget):
         self.scroll_area.setWidget(self.scroll_content)
 
         self.scroll_layout.addStretch(1)
-
-        self.main_layout.addWidget(self.scroll_area)
+        self.scroll_area.hide()
+
+        self.history_model = HistoryModel(self.database, self)
+        # 单列、无表头的表格视图: 行高固定时由表头按行号直接定位, 加载新的一页不需要重新排列已加载的行
+        self.history_view = QTableView(self)
+        self.history_view.setModel(self.history_model)
+        self.history_view.setItemDelegate(HistoryDelegate(self.history_view))
+        self.history_view.horizontalHeader().hide()
+        self.history_view.horizontalHeader().setStretchLastSection(True)
+        self.history_view.verticalHeader().hide()
+        self.history_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.history_view.verticalHeader().setDefaultSectionSize(HISTORY_ROW_HEIGHT)
+        self.history_view.setShowGrid(False)
+        self.history_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.history_view.verticalScrollBar().setSingleStep(20)
+        self.history_view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.history_view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.history_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.history_view.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.history_view.setMouseTracking(True)
+        self.history_view.clicked.connect(self.open_history)
+
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText("搜索历史记录 (文件名或 URL)")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.setStyleSheet("font-size: 18px; background-color: white;")
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_history)
+        self.search_edit.textChanged.connect(self.search_timer.start)
+
+        self.history_layout = QVBoxLayout()
+        self.history_layout.addWidget(self.scroll_area)
+        self.history_layout.addWidget(self.search_edit)
+        self.history_layout.addWidget(self.history_view)
+        self.main_layout.addLayout(self.history_layout)
 
         self.button_layout = QVBoxLayout()
 
@@ -891,6 +1546,10 @@ class Window(QWidget):
                     QScrollArea {
                         background-color: rgb(135,206,250);
                     }
+                    QTableView {
+                        background-color: rgb(135,206,250);
+                        border: none;
+                    }
                     QHBoxLayout {
                         background-color: rgb(135,206,250);
                         margin-left: 0px;
@@ -920,79 +1579,81 @@ class Window(QWidget):
         self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground)
         self.setAttribute(Qt.WidgetAttribute.WA_DontShowOnScreen, False)
 
-        self.load_pages_timer = QTimer(self)
-        self.load_pages_timer.setInterval(10)
-        self.load_pages_timer.timeout.connect(self.cooldownEnded)
-
         self.setLayout(self.main_layout)
-        self.scroll_area.verticalScrollBar().installEventFilter(self)
-        self.load_pages_cooldown()
-
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(lambda: self.check_pages_value())
-        self.timer.start(10)
-    
-    def check_pages_value(self):
-        current_pages_value = self.database.get_pages()
-        if current_pages_value != self.pages:
-            self.pages = current_pages_value
-            self.count = 1
-            self.clear_scroll_area()
-            self.load_pages_cooldown()
-    
-    def clear_scroll_area(self):
-        for i in range(self.scroll_layout.count(), 0, -1):
-            widget = self.scroll_layout.itemAt(i-1).widget()
-            if widget is not None:
-                self.scroll_layout.removeWidget(widget)
-                widget.deleteLater()
-    
-    def eventFilter(self, source, event):
-        if source == self.scroll_area.verticalScrollBar():
-            self.check_scroll_position()
-        return super().eventFilter(source, event)
-
-    def check_scroll_position(self):
-        scrollbar = self.scroll_area.verticalScrollBar()
-        max_value = scrollbar.maximum()
-        current_value = scrollbar.value()
-        threshold = 20
-
-        if max_value - current_value <= threshold:
-            if self.count <= self.pages:
-                self.load_pages_cooldown()
-    
-    @pyqtSlot()
-    def load_pages_cooldown(self):
-        if not self.load_pages_cooldown_flag:
-            self.load_pages()
-            self.load_pages_cooldown_flag = True
-            self.load_pages_timer.start()
-    
-    @pyqtSlot()
-    def cooldownEnded(self):
-        self.load_pages_cooldown_flag = False
-        self.load_pages_timer.stop()
-
+        self.history_model.fetchMore()
+
+        # 正在下载的任务合并在一次定时刷新中更新, 没有任务时停止
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh_tasks)
+
+        self.history_changed.connect(self.refresh_history)
+
+    def refresh_tasks(self):
+        for download_info in list(self.download_queue.running):
+            download_info.update()
+
+    def refresh_history(self):
+        # 键集分页的游标不受插入和删除影响, 已加载的历史记录不需要重新加载, 只有搜索结果需要重新查询
+        if self.search_edit.text().strip():
+            self.search_history()
+
+    def search_history(self):
+        """
+        按搜索框的内容显示匹配的历史记录, 搜索框为空时恢复分页加载。
+        """
+        self.history_model.search(self.search_edit.text().strip())
+
+    def open_history(self, index):
+        HistoryInfo(index.data(HistoryModel.EntryRole), self).exec()
+
+    def remove_history(self, history_id):
+        self.database.delete_history(history_id)
+        self.history_model.remove(history_id)
+        self.history_changed.emit()
+
+    def task_widgets(self):
+        widgets = []
+        for i in range(self.scroll_layout.count()):
+            widget = self.scroll_layout.itemAt(i).widget()
+            if isinstance(widget, DownloadInfo):
+                widgets.append(widget)
+        return widgets
+
+    def enqueue_download(self, download_info):
+        self.scroll_layout.insertWidget(len(self.task_widgets()), download_info)
+        self.download_queue.add(download_info, download_info.data['threads'], download_info.data['priority'])
+        self.start_queued()
+
+    def start_queued(self):
+        for download_info, connections in self.download_queue.schedule():
+            download_info.start(connections)
+        self.arrange_tasks()
+        if self.download_queue.running:
+            if not self.refresh_timer.isActive():
+                self.refresh_timer.start()
+        else:
+            self.refresh_timer.stop()
+
+    def arrange_tasks(self):
+        """
+        任务列表顺序: 正在下载、排队中（按队列顺序）、已暂停, 之后才是历史记录。
+        """
+        queued = self.download_queue.queued
+        def order(widget):
+            if widget in self.download_queue.running:
+                return (0, 0)
+            if widget in queued:
+                return (1, queued.index(widget))
+            return (2, 0)
+        widgets = sorted(self.task_widgets(), key=order)
+        for index, widget in enumerate(widgets):
+            self.scroll_layout.removeWidget(widget)
+            self.scroll_layout.insertWidget(index, widget)
+        self.scroll_area.setVisible(bool(widgets))
+        self.scroll_area.setFixedHeight(
+            min(TASK_AREA_HEIGHT, self.scroll_content.sizeHint().height() + 2 * self.scroll_area.frameWidth()))
 
-    def load_pages(self):
-        if self.count > self.pages:
-            return
-        data = self.database.get_page_history(self.count)
-        for item in data:
-            entry = {
-                'id': item[0],
-                'filename': item[1],
-                'url': item[2],
-                'status': item[3],
-                'start_time': item[4],
-                'end_time': item[5],
-                'size': item[6]
-            }
-            index = self.scroll_layout.count() - 1
-            self.scroll_layout.insertWidget(index, DownloadHistory(entry))
-        self.count += 1
-    
     def add_download_task(self, url='', filename=''):
         download_task = StartDownload(url, filename, self)
         download_task.exec()
@@ -1008,7 +1669,8 @@ class Window(QWidget):
         result = QMessageBox.question(self, "确认", "是否删除所有历史记录？", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if result == QMessageBox.StandardButton.Yes:
             self.database.clear_history()
-            self.clear_scroll_area()
+            self.history_model.search(self.search_edit.text().strip())
+            self.history_changed.emit()
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
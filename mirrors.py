@@ -0,0 +1,249 @@
+import time
+import multiprocessing
+
+from ctypes import Structure, c_ulonglong, c_double, c_int
+
+from probe import probe
+
+
+# 镜像连续失败这么多次后停用
+MAX_MIRROR_FAILURES = 3
+# 镜像的各连接累计下载 MIN_SAMPLE 秒后才参与速度比较, 单连接速度低于最快镜像的 SLOW_RATIO 时停用
+MIN_SAMPLE = 2.0
+SLOW_RATIO = 0.25
+# 下载过程中向 MirrorSet 汇报进度的间隔（秒）
+REPORT_INTERVAL = 1.0
+
+
+class MirrorSlot(Structure):
+    """
+    共享内存中一个镜像的统计信息, 读写都在 MirrorSet.lock 内进行。
+    """
+    _fields_ = [
+        ('received', c_ulonglong),  # 从该镜像下载的字节数
+        ('seconds', c_double),      # 各连接从该镜像下载所用时间之和
+        ('workers', c_int),         # 正在使用该镜像的 worker 数
+        ('failures', c_int),        # 连续失败的请求数
+        ('disabled', c_int),        # 是否已停用
+    ]
+
+
+def same_file(info, other):
+    """
+    判断两个镜像上的文件是否一致: 大小必须相同; 双方都提供了同一种校验值时必须相同,
+    没有共同的校验值时再比较 Last-Modified。ETag 通常由各服务器自行生成, 不参与比较。
+
+    Returns:
+        str | None: 不一致的原因, 一致时返回None。
+
+    """
+    if info.file_size != other.file_size:
+        return f'文件大小不一致 ({other.file_size} != {info.file_size})'
+    shared = set(info.digests) & set(other.digests)
+    for algorithm in shared:
+        if info.digests[algorithm] != other.digests[algorithm]:
+            return f'{algorithm} 校验值不一致'
+    if not shared and info.last_modified and other.last_modified and info.last_modified != other.last_modified:
+        return f'Last-Modified 不一致 ({other.last_modified} != {info.last_modified})'
+    return None
+
+
+def probe_mirrors(urls, session, headers):
+    """
+    探测同一个文件的所有镜像, 只保留与第一个可用镜像一致、同样支持分段下载的镜像。
+
+    Args:
+        urls (List[str]): 镜像地址, 第一个可用的镜像作为主地址（决定文件名、断点续传日志和校验值）。
+        session (requests.Session): 用于探测的会话。
+        headers (dict): 请求头。
+
+    Returns:
+        RemoteInfo: 主地址的远程文件信息, mirrors 为所有可用镜像的最终地址,
+            rejected_mirrors 为被排除的镜像及原因。
+
+    Raises:
+        RequestException: 所有镜像都探测失败时抛出最后一次探测的异常。
+
+    """
+    info, error, rejected = None, None, []
+    mirrors = []
+    for url in urls:
+        try:
+            other = probe(url, session, headers)
+        except Exception as e:
+            error = e
+            rejected.append((url, str(e)))
+            continue
+        if info is None:
+            info = other
+        else:
+            if not info.segmented:
+                # 主地址只能单连接下载时不使用其它镜像
+                reason = '主地址不支持分段下载'
+            else:
+                reason = same_file(info, other)
+            if reason is None and not other.segmented:
+                reason = '不支持 Range 请求'
+            if reason is not None:
+                rejected.append((url, reason))
+                continue
+        if other.final_url not in mirrors:
+            mirrors.append(other.final_url)
+    if info is None:
+        raise error
+    info.mirrors = mirrors
+    info.rejected_mirrors = rejected
+    return info
+
+
+class MirrorSet:
+    """
+    多个进程/协程共享的镜像列表。
+
+    每个 worker 通过 acquire 绑定到一个镜像（优先选择使用者最少、单连接速度最快的镜像）,
+    通过 Meter 在请求过程中和结束时汇报收到的字节数和耗时。分段由调度器动态分配,
+    速度快的镜像上的 worker 领取和拆分到的分段更多, 因此各镜像下载的数据量与其吞吐量成正比,
+    总速度接近各镜像速度之和。
+
+    连续失败 MAX_MIRROR_FAILURES 次, 或单连接速度远低于最快的镜像时, 镜像被停用,
+    使用它的 worker 立即放弃当前请求, 换到其它镜像重新请求。最后一个可用的镜像不会被停用。
+    """
+    def __init__(self, urls):
+        """
+        Args:
+            urls (List[str]): 已确认一致的镜像地址。
+
+        """
+        self.urls = list(urls)
+        self.stats = multiprocessing.RawArray(MirrorSlot, len(self.urls))
+        self.lock = multiprocessing.Lock()
+
+    def speed(self, index):
+        """
+        Returns:
+            float: 镜像的单连接平均速度（字节/秒）, 还没有数据时为0。
+        """
+        slot = self.stats[index]
+        return slot.received / slot.seconds if slot.seconds > 0 else 0.0
+
+    def enabled(self):
+        return [index for index, slot in enumerate(self.stats) if not slot.disabled]
+
+    def choose(self):
+        """
+        选择使用者最少的镜像, 相同时选择单连接速度最快的。调用方需持有锁。
+        """
+        index = min(self.enabled(), key=lambda i: (self.stats[i].workers, -self.speed(i)))
+        self.stats[index].workers += 1
+        return index
+
+    def acquire(self):
+        """
+        worker 开始时调用。
+
+        Returns:
+            int: 分配给 worker 的镜像下标。
+
+        """
+        with self.lock:
+            return self.choose()
+
+    def release(self, index):
+        """
+        worker 退出时调用。
+        """
+        with self.lock:
+            self.stats[index].workers -= 1
+
+    def record(self, index, received, seconds, ok):
+        """
+        汇报一次请求的结果, 必要时停用镜像。
+
+        Args:
+            index (int): 镜像下标。
+            received (int): 本次请求收到的字节数。
+            seconds (float): 本次请求的耗时（秒）。
+            ok (bool): 请求是否成功。
+
+        Returns:
+            int: worker 下一次请求应使用的镜像下标, 原镜像被停用时换成其它镜像。
+
+        """
+        with self.lock:
+            slot = self.stats[index]
+            slot.received += received
+            slot.seconds += seconds
+            slot.failures = 0 if ok else slot.failures + 1
+            if not slot.disabled and len(self.enabled()) > 1:
+                if slot.failures >= MAX_MIRROR_FAILURES:
+                    slot.disabled = 1
+                elif slot.seconds >= MIN_SAMPLE:
+                    fastest = max(self.speed(i) for i in self.enabled() if self.stats[i].seconds >= MIN_SAMPLE)
+                    if self.speed(index) < fastest * SLOW_RATIO:
+                        slot.disabled = 1
+            if not slot.disabled:
+                return index
+            slot.workers -= 1
+            return self.choose()
+
+    def meter(self, index, slot):
+        return Meter(self, index, slot)
+
+    def summary(self):
+        """
+        Returns:
+            List[str]: 每个镜像的下载量、单连接速度和状态, 用于显示。
+        """
+        lines = []
+        for index, url in enumerate(self.urls):
+            slot = self.stats[index]
+            state = '已停用' if slot.disabled else f'{slot.workers} 连接'
+            lines.append(f"{url}: {slot.received / 1024 ** 2:.2f}MB, "
+                         f"{self.speed(index) / 1024 ** 2:.2f}MB/s/连接, {state}")
+        return lines
+
+
+
+class MirrorDisabled(ConnectionError):
+    """
+    下载分段的过程中当前镜像被停用, 应换到 Meter.next 指定的镜像重新请求, 不计入重试次数。
+    """
+
+
+class Meter:
+    """
+    记录一次请求从镜像收到的字节数（按分段槽位 done 的增量计算）和耗时。
+
+    下载过程中每 REPORT_INTERVAL 秒汇报一次, 使过慢的镜像不必等到分段下载完就能被发现。
+    """
+    def __init__(self, mirrors, index, slot):
+        self.mirrors = mirrors
+        self.index = index
+        self.next = index
+        self.slot = slot
+        self.last_time = time.monotonic()
+        self.last_done = slot.done
+
+    def report(self, ok=True):
+        """
+        汇报上次汇报以来的进度, 请求结束（成功或失败）时调用。
+
+        Returns:
+            int: 下一次请求应使用的镜像下标。
+
+        """
+        now = time.monotonic()
+        self.next = self.mirrors.record(self.index, self.slot.done - self.last_done, now - self.last_time, ok)
+        self.last_time, self.last_done = now, self.slot.done
+        return self.next
+
+    def check(self):
+        """
+        每收到一块数据调用一次, 距上次汇报超过 REPORT_INTERVAL 秒时汇报进度。
+
+        Raises:
+            MirrorDisabled: 当前镜像已被停用。
+
+        """
+        if time.monotonic() - self.last_time >= REPORT_INTERVAL and self.report() != self.index:
+            raise MirrorDisabled(f'镜像 {self.mirrors.urls[self.index]} 已停用')
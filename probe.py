@@ -0,0 +1,127 @@
+import re
+import copy
+
+
+class RemoteInfo:
+    """
+    一次 HEAD 请求得到的远程文件信息, 在整个下载过程中共享, 避免重复探测。
+    """
+    def __init__(self, url, final_url, file_size, accept_ranges, etag, last_modified,
+                 digests, content_type, keep_alive):
+        """
+        Args:
+            url (str): 用户提供的下载地址。
+            final_url (str): 跟随重定向后的最终地址, 分段请求直接使用该地址。
+            file_size (int | None): Content-Length, 服务器未提供时为None。
+            accept_ranges (bool): 服务器是否声明支持 Range 请求。
+            etag (str | None): ETag。
+            last_modified (str | None): Last-Modified。
+            digests (dict): 服务器提供的校验值, 如 {'md5': ..., 'sha-256': ...}, 值为 base64 或十六进制字符串。
+            content_type (str | None): Content-Type。
+            keep_alive (bool): 服务器是否保持连接。
+
+        """
+        self.url = url
+        self.final_url = final_url
+        self.file_size = file_size
+        self.accept_ranges = accept_ranges
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digests = digests
+        self.content_type = content_type
+        self.keep_alive = keep_alive
+        # 由 check_range_support 按实际的 206 响应确认, 之前以 Accept-Ranges 声明为准
+        self.range_support = accept_ranges
+        # 由 probe_mirrors 填写: 与本文件一致的所有镜像的最终地址, 以及被排除的镜像和原因
+        self.mirrors = [final_url]
+        self.rejected_mirrors = []
+
+    @property
+    def content_md5(self):
+        return self.digests.get('md5')
+
+    @property
+    def segmented(self):
+        """
+        是否可以分段并行下载: 服务器确实支持 Range 请求, 并且文件大小已知。
+        """
+        return self.range_support and self.file_size is not None
+
+
+def parse_digests(headers):
+    """
+    从 Content-MD5、Digest（RFC 3230）和 Repr-Digest（RFC 9530）中提取校验值。
+
+    Returns:
+        dict: 小写算法名到校验值的映射。
+
+    """
+    digests = {}
+    for name in ('Digest', 'Repr-Digest'):
+        value = headers.get(name)
+        if not value:
+            continue
+        for item in value.split(','):
+            match = re.match(r'\s*([\w-]+)=:?([^:]*):?\s*$', item)
+            if match:
+                digests.setdefault(match.group(1).lower(), match.group(2))
+    if headers.get('Content-MD5'):
+        digests['md5'] = headers['Content-MD5'].strip()
+    return digests
+
+
+def check_range_support(info, session, headers):
+    """
+    用 Range: bytes=0-0 的 GET 请求确认服务器是否真的支持分段下载, 结果写入 info.range_support。
+
+    Accept-Ranges 只是声明: 有的服务器声明了却忽略 Range, 返回 200 和完整内容; 有的没有声明却支持。
+    只读取响应头, 不读取响应体。HEAD 没有返回 Content-Length 时（如 chunked 或动态生成的响应）,
+    从 Content-Range 中补上文件大小。
+    """
+    headers = copy.deepcopy(headers)
+    headers['Range'] = 'bytes=0-0'
+    headers['Accept-Encoding'] = 'identity'
+    response = session.get(info.final_url, headers=headers, stream=True)
+    try:
+        match = re.match(r'bytes\s+0-0/(\d+|\*)', response.headers.get('Content-Range', ''))
+        info.range_support = response.status_code == 206 and match is not None
+        if info.range_support and info.file_size is None and match.group(1) != '*':
+            info.file_size = int(match.group(1))
+    finally:
+        response.close()
+
+
+def probe(url, session, headers):
+    """
+    发送一次 HEAD 请求（跟随重定向）获取远程文件信息, 再用一次 Range 请求确认服务器是否支持分段下载。
+
+    Args:
+        url (str): 下载地址。
+        session (requests.Session): 用于探测的会话。
+        headers (dict): 请求头。
+
+    Returns:
+        RemoteInfo: 远程文件信息。
+
+    Raises:
+        HTTPError: 如果请求失败，则会抛出HTTPError异常。
+
+    """
+    head = session.head(url, headers=headers, allow_redirects=True)
+    head.raise_for_status()
+    file_size = head.headers.get('Content-Length')
+    version = getattr(head.raw, 'version', 11)
+    connection = head.headers.get('Connection', '').lower()
+    info = RemoteInfo(
+        url=url,
+        final_url=head.url,
+        file_size=int(file_size) if file_size is not None else None,
+        accept_ranges=head.headers.get('Accept-Ranges', '').lower() == 'bytes',
+        etag=head.headers.get('ETag'),
+        last_modified=head.headers.get('Last-Modified'),
+        digests=parse_digests(head.headers),
+        content_type=head.headers.get('Content-Type'),
+        keep_alive=connection != 'close' and (version >= 11 or connection == 'keep-alive'),
+    )
+    check_range_support(info, session, headers)
+    return info
@@ -0,0 +1,119 @@
+import copy
+import time
+import functools
+import requests
+
+from storage import AdaptiveReadSize, RangeWriter, DEFAULT_BUFFER_SIZE
+from progress import record_written, SEGMENT_RUNNING, SEGMENT_DONE, SEGMENT_FAILED
+from connection import get_segment, release_connection
+from mirrors import MirrorDisabled
+
+
+def fetch_segment(session, url, headers, slot, filepath, buffer_size=DEFAULT_BUFFER_SIZE, writer=RangeWriter, meter=None,
+                  limiter=None):
+    """
+    请求分段中还没有写入的部分, 边接收边按偏移写盘。meter 不为None 时每收到一块数据向镜像列表汇报进度,
+    limiter 不为None 时按限速器阻塞等待。
+
+    Raises:
+        requests.HTTPError: 服务器返回错误状态码（被限流时已由 get_segment 等待重发）。
+        ConnectionError: 服务器没有按 Range 返回分段, 或连接在分段结束前被关闭。
+
+    """
+    position = slot.start + slot.written
+    headers = copy.deepcopy(headers)
+    headers['Range'] = f'bytes={position}-{slot.end}'
+    # 直接读取原始响应体, 分段数据不能经过压缩
+    headers['Accept-Encoding'] = 'identity'
+    # 被限流时按 Retry-After 等待后重发, 限流次数供自适应连接数参考
+    response = get_segment(session, url, headers, slot)
+    response.raise_for_status()
+    if response.status_code != 206 and position != 0:
+        response.close()
+        raise ConnectionError(f'HTTP {response.status_code}: 服务器没有按 Range 返回分段')
+    # 数据直接读入预先分配的写缓冲区, 内存中最多积压 buffer_size 字节
+    with response, writer(filepath, position, buffer_size, on_flush=functools.partial(record_written, slot)) as output:
+        # 每次读取的大小随吞吐量调整
+        read_size = AdaptiveReadSize(buffer_size)
+        while True:
+            # 其它 worker 可能拆走本分段的后一半, 以槽位中最新的 end 为准
+            remaining = slot.end - position + 1
+            if remaining <= 0:
+                break
+            received = output.receive(response.raw.readinto, min(read_size.size, remaining))
+            if not received:
+                raise ConnectionError('连接在分段结束前被关闭')
+            read_size.update(received)
+            position += received
+            # 每个分段只写自己的槽位, 无需加锁
+            slot.done += received
+            slot.updated = time.time()
+            if meter is not None:
+                meter.check()
+            if limiter is not None:
+                limiter.wait(received)
+        # 分段被拆分时剩余的响应体不再需要, 剩余不多时读完丢弃, 把连接留给下一个分段
+        release_connection(response)
+
+
+def download_segment(mirrors, mirror, session, slot, filepath, retry_count, headers, buffer_size=DEFAULT_BUFFER_SIZE,
+                     writer=RangeWriter, limiter=None):
+    """
+    从 mirrors.urls[mirror] 下载一个分段, 失败时重试 retry_count 次。下载进度和结果汇报给 MirrorSet,
+    镜像被停用后换到其它镜像重新请求（不计入重试次数）。重试次数用尽后分段标记为 SEGMENT_FAILED。
+
+    Returns:
+        int: 下一个分段应使用的镜像下标。
+
+    """
+    slot.state = SEGMENT_RUNNING
+    attempt = 0
+    while attempt < retry_count:
+        # 从已写入磁盘的位置继续（重试时只补下载丢失的部分）, 之前收到但没有写入的字节不再计入进度
+        slot.done = slot.written
+        if slot.start + slot.written > slot.end:
+            # 出错之前数据已经全部写入
+            slot.state = SEGMENT_DONE
+            return mirror
+        meter = mirrors.meter(mirror, slot)
+        try:
+            fetch_segment(session, mirrors.urls[mirror], headers, slot, filepath, buffer_size, writer, meter, limiter)
+            slot.state = SEGMENT_DONE
+            return meter.report()
+        except MirrorDisabled:
+            mirror = meter.next
+        except Exception:
+            mirror = meter.report(ok=False)
+            attempt += 1
+            if attempt < retry_count:
+                slot.retries += 1
+    slot.state = SEGMENT_FAILED
+    return mirror
+
+
+def download_worker(mirrors, scheduler, filepath, retry_count, headers, buffer_size=DEFAULT_BUFFER_SIZE, writer=RangeWriter,
+                    limiter=None):
+    """
+    多进程引擎的 worker 进程入口: 不断从调度器领取分段并下载, 直到没有可下载的内容。
+
+    调用前需要通过 scheduler.add_worker 计数。图形界面和命令行都以它为进程的 target。
+    """
+    # 不能复用父进程的 session: fork 后多个进程会共用探测时建立的同一个 socket
+    mirror = mirrors.acquire()
+    try:
+        session = requests.Session()
+        while True:
+            index = scheduler.next_segment()
+            if index is None:
+                return
+            slot = scheduler.progress[index]
+            mirror = download_segment(mirrors, mirror, session, slot, filepath, retry_count, headers, buffer_size,
+                                      writer, limiter)
+            if slot.state == SEGMENT_FAILED:
+                # 放回等待队列交给下一个领取分段的 worker, 再次用尽重试次数才标记为失败, 缺失部分记录在日志中
+                scheduler.fail(index)
+    except Exception:
+        scheduler.leave()
+        raise
+    finally:
+        mirrors.release(mirror)
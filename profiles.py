@@ -0,0 +1,238 @@
+import datetime
+
+from data import host_of
+from adaptive import MIN_GAIN
+from scheduler import DEFAULT_MIN_SEGMENT, DEFAULT_MAX_SEGMENT
+
+
+# 新一次下载的结果在平滑值中所占的比例
+PROFILE_WEIGHT = 0.3
+# 下载量少于这个值时测不准速度, 只更新出错率和 Range 支持
+MIN_PROFILE_BYTES = 8 * 1024 * 1024
+# 平均每个请求收到 429/503 或重试的次数超过这个比例时, 认为这个连接数对该主机太多
+MAX_THROTTLE_RATE = 0.02
+MAX_ERROR_RATE = 0.1
+# 每个连接下载一个分段大约用的时间（秒）, 据此由单连接速度推算分段大小
+SEGMENT_SECONDS = 5
+
+
+class ConnectionStats:
+    """
+    某个主机在某个连接数下的平滑统计。
+    """
+    def __init__(self, connections, downloads=0, throughput=None, throttle_rate=0.0, error_rate=0.0):
+        """
+        Args:
+            connections (int): 连接数。
+            downloads (int, optional): 使用该连接数的下载次数。默认为0。
+            throughput (float, optional): 总吞吐量（字节/秒）, 还没有足够大的下载时为None。默认为None。
+            throttle_rate (float, optional): 平均每个请求收到 429/503 的次数。默认为0。
+            error_rate (float, optional): 平均每个请求的分段重试次数。默认为0。
+
+        """
+        self.connections = connections
+        self.downloads = downloads
+        self.throughput = throughput
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+
+    @property
+    def acceptable(self):
+        return self.throttle_rate <= MAX_THROTTLE_RATE and self.error_rate <= MAX_ERROR_RATE
+
+    def update(self, throughput, throttle_rate, error_rate):
+        def smooth(old, new):
+            return new if old is None or not self.downloads else old + PROFILE_WEIGHT * (new - old)
+        if throughput is not None:
+            self.throughput = smooth(self.throughput, throughput)
+        self.throttle_rate = smooth(self.throttle_rate, throttle_rate)
+        self.error_rate = smooth(self.error_rate, error_rate)
+        self.downloads += 1
+
+    def row(self):
+        return (self.connections, self.downloads, self.throughput, self.throttle_rate, self.error_rate)
+
+
+class HostProfile:
+    """
+    从以往的下载中学到的一个主机的性能记录, 用来为下一次下载选择连接数和分段大小。
+
+    每个连接数分别记录平滑后的吞吐量、限流率和出错率。推荐连接数时只考虑没有被限流、出错不多的连接数,
+    在其中选吞吐量最高的; 更多的连接吞吐量提升不到 MIN_GAIN 时选较少的那个。
+    最佳连接数就是试过的最大连接数时, 下一次翻倍试探（不超过调用方给的上限）, 直到更多的连接不再更快
+    或者开始被限流, 之后稳定在最佳值上。所有试过的连接数都被限流时, 比最少的那个再减少约四分之一。
+    """
+    def __init__(self, host, downloads=0, range_support=None, stats=()):
+        """
+        Args:
+            host (str): 主机名。
+            downloads (int, optional): 记录过的下载次数。默认为0。
+            range_support (bool, optional): 最近一次下载时服务器是否支持 Range 请求, 未知时为None。默认为None。
+            stats (Iterable[ConnectionStats], optional): 各连接数的统计。默认为空。
+
+        """
+        self.host = host
+        self.downloads = downloads
+        self.range_support = range_support
+        self.stats = {item.connections: item for item in stats}
+
+    @classmethod
+    def load(cls, database, host):
+        """
+        从数据库读取主机的记录, 没有记录时返回一个空的 HostProfile。
+        """
+        profile, stats = database.get_host_profile(host)
+        if profile is None:
+            return cls(host)
+        range_support = None if profile[2] is None else bool(profile[2])
+        return cls(host, profile[1], range_support, (ConnectionStats(*row) for row in stats))
+
+    def save(self, database):
+        best = self.best()
+        profile = (
+            self.host,
+            self.downloads,
+            None if self.range_support is None else int(self.range_support),
+            best.connections if best is not None else None,
+            best.throughput if best is not None else None,
+            best.throttle_rate if best is not None else None,
+            best.error_rate if best is not None else None,
+            self.segment_size(),
+            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        )
+        database.save_host_profile(profile, [item.row() for item in self.stats.values()])
+
+    def best(self):
+        """
+        Returns:
+            ConnectionStats | None: 吞吐量最好的可用连接数, 还没有测出吞吐量时返回None。
+        """
+        best = None
+        for connections in sorted(self.stats):
+            item = self.stats[connections]
+            if not item.acceptable or item.throughput is None:
+                continue
+            if best is None or item.throughput > best.throughput * (1 + MIN_GAIN):
+                best = item
+        return best
+
+    def recommend(self, maximum):
+        """
+        Args:
+            maximum (int): 连接数上限（引擎和队列允许的最大值）。
+
+        Returns:
+            int | None: 下一次下载建议使用的连接数, 没有记录时返回None。
+
+        """
+        if self.range_support is False:
+            # 不支持 Range 请求的主机只能单连接下载, 不必为它预留更多连接
+            return 1
+        if not self.stats:
+            return None
+        best = self.best()
+        if best is None:
+            if all(item.acceptable for item in self.stats.values()):
+                # 下载都太小, 还没有测出吞吐量, 沿用用过的连接数
+                return min(maximum, max(self.stats))
+            fewest = min(self.stats)
+            return max(1, fewest - max(1, fewest // 4))
+        connections = best.connections
+        throttled = [count for count, item in self.stats.items() if not item.acceptable]
+        ceiling = min([maximum] + [count - 1 for count in throttled])
+        if connections == max(self.stats) and connections < ceiling:
+            # 最佳值就是试过的最大连接数, 更多的连接也许更快
+            connections = min(ceiling, connections * 2)
+        return max(1, min(maximum, connections))
+
+    def segment_size(self):
+        """
+        Returns:
+            int | None: 建议的最大分段长度, 使每个连接下载一个分段大约用 SEGMENT_SECONDS 秒; 没有记录时返回None。
+        """
+        best = self.best()
+        if best is None:
+            return None
+        size = int(best.throughput / best.connections * SEGMENT_SECONDS)
+        return min(DEFAULT_MAX_SEGMENT, max(DEFAULT_MIN_SEGMENT, size))
+
+    def record(self, connections, seconds, bytes, requests, throttled, retries):
+        """
+        记录在某个连接数下下载的结果。
+
+        Args:
+            connections (int): 连接数。
+            seconds (float): 下载时间（秒）。
+            bytes (int): 下载的字节数。
+            requests (int): 发送的请求数。
+            throttled (int): 收到 429/503 的次数。
+            retries (int): 分段重试的次数。
+
+        """
+        requests = max(1, requests)
+        throughput = bytes / seconds if bytes >= MIN_PROFILE_BYTES and seconds > 0 else None
+        item = self.stats.get(connections)
+        if item is None:
+            item = self.stats[connections] = ConnectionStats(connections)
+        item.update(throughput, throttled / requests, retries / requests)
+
+    def update(self, connections, progress, bytes, duration, range_support, samples=None):
+        """
+        记录一次下载的结果。
+
+        自适应模式下连接数在下载过程中变化, 限流通常发生在试探的较大连接数上, 不能全部记在最后的连接数上,
+        因此按 ConnectionController.samples 中各连接数的统计分别记录。
+
+        Args:
+            connections (int): 本次使用的连接数。
+            progress (Iterable[SegmentSlot]): 下载结束时已使用的进度槽位, 从中统计请求、限流和重试次数。
+            bytes (int): 本次下载的字节数。
+            duration (float): 实际下载的时间（秒）。
+            range_support (bool): 服务器是否支持 Range 请求。
+            samples (dict, optional): 自适应模式下 ConnectionController.samples。默认为None。
+
+        """
+        if samples:
+            for count, (seconds, received, requests, throttled, retries) in samples.items():
+                self.record(count, seconds, received, requests, throttled, retries)
+        else:
+            requests = throttled = retries = 0
+            for slot in progress:
+                requests += slot.requests
+                throttled += slot.throttled
+                retries += slot.retries
+            self.record(connections, duration, bytes, requests, throttled, retries)
+        self.downloads += 1
+        self.range_support = range_support
+
+    def describe(self):
+        """
+        Returns:
+            str: 用于显示的简要说明, 没有记录时为空字符串。
+        """
+        if not self.downloads:
+            return ''
+        if self.range_support is False:
+            return f"{self.host}: 不支持 Range 请求, 单连接下载"
+        best = self.best()
+        if best is None:
+            throttled = [count for count, item in self.stats.items() if not item.acceptable]
+            if throttled:
+                return f"{self.host}: {self.downloads} 次下载, {min(throttled)} 连接时被限流或频繁重试"
+            return f"{self.host}: {self.downloads} 次下载, 还没有测出速度"
+        return (f"{self.host}: {self.downloads} 次下载, {best.connections} 连接最快 "
+                f"({best.throughput / 1024 ** 2:.2f}MB/s), 限流 {best.throttle_rate:.1%}, 重试 {best.error_rate:.1%}")
+
+
+def record_download(database, url, connections, progress, bytes, duration, range_support, samples=None):
+    """
+    下载结束后更新 url 所在主机的记录, 参数见 HostProfile.update。
+
+    Returns:
+        HostProfile: 更新后的记录。
+
+    """
+    profile = HostProfile.load(database, host_of(url))
+    profile.update(connections, progress, bytes, duration, range_support, samples)
+    profile.save(database)
+    return profile
@@ -0,0 +1,118 @@
+import time
+import multiprocessing
+
+from ctypes import Structure, c_ulonglong, c_int, c_double
+
+
+SEGMENT_UNUSED = 0
+SEGMENT_WAITING = 1
+SEGMENT_RUNNING = 2
+SEGMENT_DONE = 3
+SEGMENT_FAILED = 4
+
+SEGMENT_STATES = {
+    SEGMENT_UNUSED: 'unused',
+    SEGMENT_WAITING: 'waiting',
+    SEGMENT_RUNNING: 'running',
+    SEGMENT_DONE: 'done',
+    SEGMENT_FAILED: 'failed',
+}
+
+
+class SegmentSlot(Structure):
+    """
+    共享内存中一个分段的进度信息。
+
+    每个槽位只由负责该分段的 worker 写入, 其它进程只读, 因此不需要加锁。
+    """
+    _fields_ = [
+        ('start', c_ulonglong),     # 分段起始位置
+        ('end', c_ulonglong),       # 分段结束位置（包含）
+        ('done', c_ulonglong),      # 已接收的字节数
+        ('written', c_ulonglong),   # 从 start 起连续写入磁盘的字节数, 断点续传以此为准
+        ('state', c_int),           # SEGMENT_* 状态
+        ('retries', c_int),         # 已重试次数
+        ('throttled', c_int),       # 收到 429/503 的次数
+        ('requests', c_int),        # 为本分段发送的请求数
+        ('connections', c_int),     # 其中新建连接（握手）的次数, 其余请求复用了 keep-alive 连接
+        ('requeues', c_int),        # 重试次数用尽后被放回等待队列的次数
+        ('updated', c_double),      # 最近一次更新的时间戳
+    ]
+
+
+def create_progress(parts, completed=(), capacity=None):
+    """
+    创建一个不带锁的共享内存进度数组, 每个分段一个槽位。
+
+    Args:
+        parts (List[Tuple[int, int]]): 需要下载的分段。
+        completed (List[Tuple[int, int]], optional): 之前已完成的区间, 以 SEGMENT_DONE 状态放在数组最前面。
+        capacity (int, optional): 槽位总数, 多出的槽位为 SEGMENT_UNUSED, 供调度器拆分分段时使用。
+
+    Returns:
+        Array[SegmentSlot]: 可传递给子进程的共享数组。
+
+    """
+    completed = list(completed)
+    segments = completed + list(parts)
+    slots = multiprocessing.RawArray(SegmentSlot, max(capacity or 0, len(segments)))
+    now = time.time()
+    for index, (start, end) in enumerate(segments):
+        slot = slots[index]
+        slot.start = start
+        slot.end = end
+        slot.updated = now
+        if index < len(completed):
+            slot.done = slot.written = end - start + 1
+            slot.state = SEGMENT_DONE
+        else:
+            slot.state = SEGMENT_WAITING
+    return slots
+
+
+def record_written(slot, offset):
+    """
+    记录分段已连续写入到 offset（不含）, 供 RangeWriter 的 on_flush 回调使用。
+    """
+    slot.written = max(slot.written, offset - slot.start)
+
+
+def all_done(slots):
+    return all(slot.state in (SEGMENT_DONE, SEGMENT_UNUSED) for slot in slots)
+
+
+def total_done(slots):
+    """
+    汇总所有分段已下载的字节数。
+
+    分段被拆分时, 原 worker 可能在读到新的 end 之前多收一块数据, 因此每个分段最多按其长度计算。
+    """
+    return sum(min(slot.done, slot.end - slot.start + 1) for slot in slots if slot.state != SEGMENT_UNUSED)
+
+
+def connection_stats(slots):
+    """
+    汇总所有分段的请求数和新建连接数, 用于确认 keep-alive 复用是否生效（握手次数应接近连接数）。
+
+    Returns:
+        Tuple[int, int]: 新建连接数和请求数。
+
+    """
+    connections = requests = 0
+    for slot in slots:
+        connections += slot.connections
+        requests += slot.requests
+    return connections, requests
+
+
+def stalled_segments(slots, timeout=10.0):
+    """
+    找出正在下载但超过 timeout 秒没有进度的分段。
+
+    Returns:
+        List[int]: 停滞分段的下标。
+
+    """
+    now = time.time()
+    return [index for index, slot in enumerate(slots)
+            if slot.state == SEGMENT_RUNNING and now - slot.updated > timeout]
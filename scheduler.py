@@ -0,0 +1,182 @@
+import time
+import multiprocessing
+
+from progress import create_progress, SEGMENT_WAITING, SEGMENT_RUNNING, SEGMENT_FAILED
+
+
+# 分段大小的上下限, 也是拆分正在下载的分段时每一半的最小长度
+DEFAULT_MIN_SEGMENT = 1024 * 1024
+DEFAULT_MAX_SEGMENT = 64 * 1024 * 1024
+# 分段的重试次数用尽后放回等待队列的次数, 之后仍然失败才放弃
+MAX_REQUEUES = 1
+
+
+def plan_segments(ranges, threads, min_segment=DEFAULT_MIN_SEGMENT, max_segment=DEFAULT_MAX_SEGMENT):
+    """
+    把需要下载的区间切成若干较小的分段, 放入共享队列。
+
+    每个线程大约分到 4 个分段, 分段长度限制在 [min_segment, max_segment] 之间。
+
+    Args:
+        ranges (List[Tuple[int, int]]): 需要下载的闭区间。
+        threads (int): 线程数。
+        min_segment (int, optional): 分段最小长度（字节）。
+        max_segment (int, optional): 分段最大长度（字节）。
+
+    Returns:
+        List[Tuple[int, int]]: 分段列表。
+
+    """
+    total = sum(end - start + 1 for start, end in ranges)
+    segment_size = min(max_segment, max(min_segment, total // max(1, threads * 4)))
+    parts = []
+    for start, end in ranges:
+        length = end - start + 1
+        count = max(1, (length + segment_size - 1) // segment_size)
+        part_size = length // count
+        for i in range(count):
+            part_start = start + i * part_size
+            part_end = end if i == count - 1 else part_start + part_size - 1
+            parts.append((part_start, part_end))
+    return parts
+
+
+class Scheduler:
+    """
+    多进程共享的动态分段调度器。
+
+    分段信息直接存放在共享内存进度数组中, 空闲的 worker 先从队列中领取等待中的分段;
+    队列为空时, 找到剩余字节最多的正在下载的分段, 把它的后一半拆出来自己下载。
+    只有领取/拆分分段时需要加锁, 下载过程中的进度更新仍然无锁。
+
+    workers 记录当前的 worker 数量, limit 为允许的数量; 自适应连接数调低 limit 后,
+    多出的 worker 在下载完手上的分段后领取不到新分段, 随即退出。
+
+    进度数组按最小分段预留容量, 大文件时远多于实际使用的槽位, 只有前 count 个槽位有效,
+    遍历进度时应使用 segments()。
+    """
+    def __init__(self, ranges, threads, completed=(), min_segment=DEFAULT_MIN_SEGMENT, max_segment=DEFAULT_MAX_SEGMENT):
+        """
+        Args:
+            ranges (List[Tuple[int, int]]): 需要下载的闭区间。
+            threads (int): 线程数。
+            completed (List[Tuple[int, int]], optional): 之前已完成的区间。
+            min_segment (int, optional): 分段最小长度（字节）。
+            max_segment (int, optional): 分段最大长度（字节）。
+
+        """
+        parts = plan_segments(ranges, threads, min_segment, max_segment)
+        missing = sum(end - start + 1 for start, end in ranges)
+        # 每次拆分新增一个槽位, 拆分出的分段不小于 min_segment, 据此预留容量
+        capacity = len(completed) + len(parts) + missing // max(1, min_segment) + threads
+        self.progress = create_progress(parts, completed, capacity)
+        self.count = multiprocessing.RawValue('i', len(completed) + len(parts))
+        self.lock = multiprocessing.Lock()
+        self.min_segment = max(1, min_segment)
+        self.workers = multiprocessing.RawValue('i', 0)
+        self.limit = multiprocessing.RawValue('i', threads)
+
+    def add_worker(self):
+        """
+        启动 worker 之前调用。
+        """
+        with self.lock:
+            self.workers.value += 1
+
+    def leave(self):
+        """
+        worker 因异常退出时调用; 正常退出时 next_segment 返回None 已经减去了计数。
+        """
+        with self.lock:
+            self.workers.value -= 1
+
+    def segments(self):
+        """
+        Returns:
+            List[SegmentSlot]: 已使用的槽位, 元素是共享内存的视图, 下标与进度数组一致。
+        """
+        return self.progress[:self.count.value]
+
+    def has_work(self):
+        """
+        是否还有可以交给新 worker 的内容: 等待中的分段, 或者足够大、可以拆分的正在下载的分段。
+        """
+        for index in range(self.count.value):
+            slot = self.progress[index]
+            if slot.state == SEGMENT_WAITING:
+                return True
+            if slot.state == SEGMENT_RUNNING and slot.end + 1 - (slot.start + slot.done) >= 2 * self.min_segment:
+                return True
+        return False
+
+    def next_segment(self):
+        """
+        领取下一个分段。
+
+        Returns:
+            int | None: 分段在进度数组中的下标。没有可下载的内容, 或 worker 数量超过 limit 时返回None,
+                调用方应随即退出。
+
+        """
+        with self.lock:
+            index = None
+            if self.workers.value <= self.limit.value:
+                for waiting in range(self.count.value):
+                    slot = self.progress[waiting]
+                    if slot.state == SEGMENT_WAITING:
+                        slot.state = SEGMENT_RUNNING
+                        index = waiting
+                        break
+                else:
+                    index = self.steal()
+            if index is None:
+                self.workers.value -= 1
+            return index
+
+    def fail(self, index):
+        """
+        worker 用尽分段的重试次数后调用。
+
+        前 MAX_REQUEUES 次把分段放回等待队列, 由下一个领取分段的 worker 从已写入的位置重新下载
+        （可能是其它连接或镜像, 重试次数重新计算）; 之后仍然失败才标记为 SEGMENT_FAILED。
+
+        Returns:
+            bool: 是否放回了等待队列。
+
+        """
+        with self.lock:
+            slot = self.progress[index]
+            if slot.requeues >= MAX_REQUEUES:
+                slot.state = SEGMENT_FAILED
+                return False
+            slot.requeues += 1
+            slot.state = SEGMENT_WAITING
+            return True
+
+    def steal(self):
+        """
+        拆分剩余字节最多的正在下载的分段, 新分段为原分段的后一半。调用方需持有锁。
+        """
+        if self.count.value >= len(self.progress):
+            return None
+        victim, largest = None, 0
+        for index in range(self.count.value):
+            slot = self.progress[index]
+            if slot.state != SEGMENT_RUNNING:
+                continue
+            remaining = slot.end + 1 - (slot.start + slot.done)
+            if remaining > largest:
+                victim, largest = slot, remaining
+        if victim is None or largest < 2 * self.min_segment:
+            return None
+        middle = victim.end + 1 - largest // 2
+        index = self.count.value
+        slot = self.progress[index]
+        slot.start = middle
+        slot.end = victim.end
+        slot.updated = time.time()
+        slot.state = SEGMENT_RUNNING
+        # 原分段的 worker 每收到一块数据都会重新读取 end, 超出部分不会再写入
+        victim.end = middle - 1
+        self.count.value = index + 1
+        return index
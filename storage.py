@@ -0,0 +1,536 @@
+import os
+import mmap
+import errno
+import time
+import queue
+import shutil
+import functools
+import threading
+
+
+# 每个 worker 在内存中最多积压的字节数, 超过后立即写盘
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# 自适应读取大小的下限, 以及每次读取希望覆盖的时间（秒）
+MIN_READ_SIZE = 16 * 1024
+READ_INTERVAL = 0.05
+# 合并写入的对齐粒度, fsync 策略为 'interval' 时的同步间隔（秒）
+COALESCE_SIZE = 4 * 1024 * 1024
+FSYNC_INTERVAL = 1.0
+# 'none' 交给操作系统（断点续传日志保存前仍会 fsync）, 'close' 每个分段写完后同步, 'interval' 定期同步
+FSYNC_POLICIES = ('none', 'close', 'interval')
+
+
+class InsufficientSpaceError(OSError):
+    """
+    目标文件系统剩余空间不足以保存整个文件。
+    """
+
+
+def allocated_size(filepath):
+    """
+    返回文件实际占用的磁盘空间（字节）, 稀疏文件中的空洞不计入。
+    """
+    if not os.path.exists(filepath):
+        return 0
+    stat = os.stat(filepath)
+    if hasattr(stat, 'st_blocks'):
+        return min(stat.st_size, stat.st_blocks * 512)
+    return stat.st_size
+
+
+def check_free_space(filepath, file_size):
+    """
+    检查目标文件所在文件系统是否还能容纳整个文件。
+
+    Raises:
+        InsufficientSpaceError: 剩余空间不足时抛出。
+
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    needed = file_size - allocated_size(filepath)
+    free = shutil.disk_usage(directory).free
+    if needed > free:
+        raise InsufficientSpaceError(
+            f"磁盘空间不足: 需要 {needed / 1024 ** 2:.2f}MB, 剩余 {free / 1024 ** 2:.2f}MB ({directory})")
+
+
+def allocate_file(filepath, file_size):
+    """
+    检查剩余空间并为目标文件预留完整大小, 文件不存在时创建。
+
+    优先使用 posix_fallocate 一次性分配连续的磁盘空间, 文件系统不支持时退化为 truncate 生成稀疏文件。
+    已存在的内容（断点续传）不会被改动。
+
+    Args:
+        filepath (str): 目标文件路径。
+        file_size (int): 文件大小（字节）。
+
+    Raises:
+        InsufficientSpaceError: 剩余空间不足时抛出, 此时不会开始下载。
+        OSError: 分配失败的其它原因。
+
+    """
+    check_free_space(filepath, file_size)
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        if file_size <= 0:
+            return
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, file_size)
+                return
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    # 检查剩余空间之后被其它程序占用, 或者配额不足
+                    raise InsufficientSpaceError(f"磁盘空间不足: 无法分配 {file_size / 1024 ** 2:.2f}MB ({filepath})") from e
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+        if os.fstat(fd).st_size < file_size:
+            os.ftruncate(fd, file_size)
+    finally:
+        os.close(fd)
+
+
+def pwrite(fd, data, offset):
+    """
+    在指定偏移处写入数据, 不移动其它进程的文件指针。
+
+    Windows 没有 os.pwrite, 此时退化为 lseek + write; 由于每个 worker 持有独立的 fd,
+    两种方式都不需要加锁。
+
+    Args:
+        fd (int): 以写方式打开的文件描述符。
+        data (bytes-like): 需要写入的数据。
+        offset (int): 写入位置（字节）。
+
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+class AdaptiveReadSize:
+    """
+    根据观测到的吞吐量调整每次从连接读取的字节数。
+
+    每次读取都会阻塞到读满为止: 块太大时慢速连接很久才更新一次进度, 块太小则调用次数过多、CPU 占用高。
+    这里让每次读取大约覆盖 interval 秒的数据, 取 2 的幂并限制在 [minimum, maximum] 之间,
+    增大时每次最多翻倍, 减小时立即生效。
+    """
+    def __init__(self, maximum: int=DEFAULT_BUFFER_SIZE, minimum: int=MIN_READ_SIZE, interval: float=READ_INTERVAL):
+        """
+        Args:
+            maximum (int, optional): 单次读取的最大字节数, 通常为写缓冲区大小。默认为 DEFAULT_BUFFER_SIZE。
+            minimum (int, optional): 单次读取的最小字节数。默认为 MIN_READ_SIZE。
+            interval (float, optional): 每次读取希望覆盖的时间（秒）。默认为 READ_INTERVAL。
+
+        """
+        self.maximum = max(1, maximum)
+        self.minimum = min(minimum, self.maximum)
+        self.interval = interval
+        self.size = self.minimum
+        self.last = time.monotonic()
+
+    def update(self, received):
+        now = time.monotonic()
+        target = received / max(now - self.last, 1e-6) * self.interval
+        self.last = now
+        size = self.minimum
+        while size * 2 <= min(target, self.maximum, self.size * 2):
+            size *= 2
+        self.size = size
+
+
+class RangeWriter:
+    """
+    把一个分段的数据边接收边写入目标文件（pwrite 后端）。
+
+    写缓冲区在创建时一次性分配并反复使用, 内存中最多缓存 buffer_size 字节,
+    因此无论文件多大, 每个 worker 的内存占用都是固定的。每个 writer 持有独立的 fd,
+    按偏移写入, 不需要加锁。
+    """
+    def __init__(self, filepath: str, offset: int, buffer_size: int=DEFAULT_BUFFER_SIZE, on_flush=None, fsync: str='none'):
+        """
+        Args:
+            filepath (str): 目标文件路径, 文件必须已经存在。
+            offset (int): 本分段在文件中的起始位置（字节）。
+            buffer_size (int, optional): 内存中最多积压的字节数。默认为 DEFAULT_BUFFER_SIZE。
+            on_flush (Callable[[int], None], optional): 数据交给文件系统后以新的写入位置调用。默认为None。
+            fsync (str, optional): fsync 策略, 见 FSYNC_POLICIES。默认为'none'。
+
+        """
+        self.offset = offset
+        self.buffer_size = max(1, buffer_size)
+        self.filled = 0
+        self.on_flush = on_flush
+        self.fsync = fsync
+        self.last_sync = time.monotonic()
+        self.fd = None
+        self.open(filepath)
+
+    def open(self, filepath):
+        self.fd = os.open(filepath, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        self.buffer = bytearray(self.buffer_size)
+        self.view = memoryview(self.buffer)
+
+    def write(self, data):
+        data = memoryview(data)
+        while data:
+            size = min(len(data), self.buffer_size - self.filled)
+            self.view[self.filled:self.filled + size] = data[:size]
+            self.filled += size
+            data = data[size:]
+            if self.filled == self.buffer_size:
+                self.flush()
+
+    def receive(self, readinto, size):
+        """
+        把数据读入写缓冲区的空闲部分, 不再另外拼接或复制到缓冲区。
+
+        是否完全零拷贝取决于 readinto: socket.recv_into 直接写入缓冲区, 而 urllib3 2.x 的
+        HTTPResponse.readinto 内部先 read 出一个 bytes 再复制进来, 仍有一次复制和一个临时对象。
+
+        Args:
+            readinto (Callable[[memoryview], int]): 类似 socket.recv_into 的读取函数, 如 response.raw.readinto。
+            size (int): 本次最多读取的字节数。
+
+        Returns:
+            int: 读取的字节数, 0 表示连接上已没有数据。
+
+        """
+        size = min(size, self.buffer_size - self.filled)
+        received = readinto(self.view[self.filled:self.filled + size])
+        self.filled += received
+        if self.filled == self.buffer_size:
+            self.flush()
+        return received
+
+    def flush(self):
+        if not self.filled:
+            return
+        pwrite(self.fd, self.view[:self.filled], self.offset)
+        self.advance()
+
+    def advance(self):
+        self.offset += self.filled
+        self.filled = 0
+        if self.fsync == 'interval' and time.monotonic() - self.last_sync >= FSYNC_INTERVAL:
+            self.sync()
+        if self.on_flush is not None:
+            self.on_flush(self.offset)
+
+    def sync(self):
+        os.fsync(self.fd)
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            self.flush()
+            if self.fsync == 'close':
+                self.sync()
+        finally:
+            self.release()
+
+    def release(self):
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MmapWriter(RangeWriter):
+    """
+    把目标文件映射到内存, 数据直接从连接读入映射区域（即页缓存）, 省去写缓冲区和 pwrite。
+
+    文件必须已经预分配到完整大小。buffer_size 在这里只决定多久报告一次写入进度。
+    """
+    def open(self, filepath):
+        # 共享映射需要读写方式打开
+        self.fd = os.open(filepath, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        self.map = mmap.mmap(self.fd, 0)
+        self.view = memoryview(self.map)
+
+    def write(self, data):
+        position = self.offset + self.filled
+        self.view[position:position + len(data)] = data
+        self.filled += len(data)
+        if self.filled >= self.buffer_size:
+            self.flush()
+
+    def receive(self, readinto, size):
+        position = self.offset + self.filled
+        received = readinto(self.view[position:position + size])
+        self.filled += received
+        if self.filled >= self.buffer_size:
+            self.flush()
+        return received
+
+    def flush(self):
+        if self.filled:
+            self.advance()
+
+    def sync(self):
+        self.map.flush()
+        self.last_sync = time.monotonic()
+
+    def release(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # 仍有切片引用映射区域（如异常回溯中的局部变量）, 交给垃圾回收关闭
+            pass
+        os.close(self.fd)
+        self.fd = None
+
+
+class WriterThread(threading.Thread):
+    """
+    专用的写线程, 同一进程内同一文件的所有 CoalescingWriter 共用一个。
+
+    相邻的小块写入先在内存中合并, 凑满按 chunk_size 对齐的整块后再写盘, 写入次数少且每次都是大块顺序写,
+    适合 NFS 等每次写调用开销很高的存储。队列空闲时把剩余数据全部写出, 不会无限期积压。
+
+    写盘失败时只影响数据被丢弃的那些 writer: 它们之后提交的数据也被丢弃（否则写入进度会越过缺失的部分）,
+    其它 writer 以及同一分段重试时新建的 writer 不受影响。
+    """
+    def __init__(self, filepath, fsync='none', chunk_size=COALESCE_SIZE, idle=0.05):
+        """
+        Args:
+            filepath (str): 目标文件路径。
+            fsync (str, optional): fsync 策略, 'interval' 时由本线程定期同步。默认为'none'。
+            chunk_size (int, optional): 合并写入的对齐粒度（字节）。默认为 COALESCE_SIZE。
+            idle (float, optional): 队列空闲多久后写出未对齐的剩余数据（秒）。默认为0.05。
+
+        """
+        super().__init__(name='range-writer', daemon=True)
+        self.fd = os.open(filepath, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        self.fsync = fsync
+        self.chunk_size = chunk_size
+        self.idle = idle
+        self.queue = queue.Queue()
+        self.users = 0
+        # 数据被丢弃的 writer 及原因, 由 writer 关闭时通过 forget 清除
+        self.failed = {}
+        self.start_offset = 0
+        self.pending = bytearray()
+        # 数据仍在 pending 中的 writer
+        self.owners = set()
+        self.callbacks = []
+        self.last_sync = time.monotonic()
+
+    def submit(self, owner, offset, data, callback=None):
+        """
+        提交 owner（一个 writer）的一块数据, 写盘后以写入结束位置调用 callback。
+
+        Raises:
+            OSError: 写线程已经退出时抛出。
+
+        """
+        if not self.is_alive():
+            raise OSError('写线程已退出')
+        self.queue.put((owner, offset, data, callback))
+
+    def drain(self):
+        """
+        等待已提交的数据全部处理完（写盘或者因 writer 出错而丢弃）。
+
+        Raises:
+            OSError: 写线程已经退出时抛出。
+
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        while not done.wait(1):
+            if not self.is_alive():
+                raise OSError('写线程已退出')
+
+    def error_of(self, owner):
+        """
+        Returns:
+            OSError | None: owner 的数据被丢弃的原因, 没有出错时返回None。
+        """
+        return self.failed.get(owner)
+
+    def forget(self, owner):
+        self.failed.pop(owner, None)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+        os.close(self.fd)
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle)
+            except queue.Empty:
+                self.write_pending(everything=True)
+                continue
+            if item is None or isinstance(item, threading.Event):
+                self.write_pending(everything=True)
+                if item is None:
+                    return
+                item.set()
+                continue
+            owner, offset, data, callback = item
+            if owner in self.failed:
+                continue
+            if self.pending and offset != self.start_offset + len(self.pending):
+                self.write_pending(everything=True)
+                if owner in self.failed:
+                    continue
+            if not self.pending:
+                self.start_offset = offset
+            self.pending += data
+            self.owners.add(owner)
+            if callback is not None:
+                self.callbacks.append((offset + len(data), callback))
+            self.write_pending(everything=False)
+
+    def write_pending(self, everything):
+        end = self.start_offset + len(self.pending)
+        if not everything:
+            end -= end % self.chunk_size
+        if end <= self.start_offset:
+            return
+        size = end - self.start_offset
+        try:
+            with memoryview(self.pending) as view:
+                pwrite(self.fd, view[:size], self.start_offset)
+            if self.fsync == 'interval' and time.monotonic() - self.last_sync >= FSYNC_INTERVAL:
+                os.fsync(self.fd)
+                self.last_sync = time.monotonic()
+        except OSError as e:
+            # 写盘失败的数据直接丢弃, 数据在其中的 writer 下一次提交或关闭时得到异常, 分段从已写入的位置重新下载
+            for owner in self.owners:
+                self.failed[owner] = e
+            self.owners.clear()
+            # 异常回溯中仍引用着 pending 的切片, 不能原地清空
+            self.pending = bytearray()
+            self.callbacks.clear()
+            return
+        del self.pending[:size]
+        if not self.pending:
+            self.owners.clear()
+        self.start_offset = end
+        while self.callbacks and self.callbacks[0][0] <= end:
+            written, callback = self.callbacks.pop(0)
+            callback(written)
+
+
+_writer_threads = {}
+_writer_threads_lock = threading.Lock()
+
+
+def acquire_writer_thread(filepath, fsync='none'):
+    """
+    返回当前进程中 filepath 对应的写线程, 不存在时创建。
+
+    fork 出的子进程会继承父进程的字典, 但线程不会被继承, 所以要检查线程是否存活。
+    """
+    key = os.path.abspath(filepath)
+    with _writer_threads_lock:
+        thread = _writer_threads.get(key)
+        if thread is None or not thread.is_alive():
+            thread = WriterThread(filepath, fsync)
+            thread.start()
+            _writer_threads[key] = thread
+        thread.users += 1
+        return thread
+
+
+def release_writer_thread(thread):
+    with _writer_threads_lock:
+        thread.users -= 1
+        if thread.users > 0:
+            return
+        for key, value in list(_writer_threads.items()):
+            if value is thread:
+                del _writer_threads[key]
+    thread.stop()
+
+
+class CoalescingWriter(RangeWriter):
+    """
+    把缓冲区中的数据交给进程内共享的写线程, 由它合并成大块对齐写入。
+    """
+    def open(self, filepath):
+        self.thread = acquire_writer_thread(filepath, self.fsync)
+        self.fd = self.thread.fd
+        self.buffer = bytearray(self.buffer_size)
+        self.view = memoryview(self.buffer)
+
+    def check(self):
+        error = self.thread.error_of(self)
+        if error is not None:
+            raise error
+
+    def flush(self):
+        if not self.filled:
+            return
+        self.check()
+        # 缓冲区会被复用, 交给写线程的必须是一份拷贝; 写盘后由写线程报告进度
+        self.thread.submit(self, self.offset, bytes(self.view[:self.filled]), self.on_flush)
+        self.offset += self.filled
+        self.filled = 0
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            if self.thread.error_of(self) is None:
+                self.flush()
+            # 出错时也要等写线程处理完（丢弃）之前提交的数据, 之后才能清除出错记录
+            self.thread.drain()
+            self.check()
+            if self.fsync == 'close':
+                self.sync()
+        finally:
+            self.release()
+
+    def release(self):
+        self.thread.forget(self)
+        release_writer_thread(self.thread)
+        self.fd = None
+
+
+WRITERS = {
+    'pwrite': RangeWriter,
+    'mmap': MmapWriter,
+    'coalesce': CoalescingWriter,
+}
+
+
+def writer_factory(backend='pwrite', fsync='none'):
+    """
+    按名称选择写入后端。
+
+    Args:
+        backend (str, optional): 'pwrite'、'mmap' 或 'coalesce'。默认为'pwrite'。
+        fsync (str, optional): fsync 策略, 见 FSYNC_POLICIES。默认为'none'。
+
+    Returns:
+        Callable: 参数与 RangeWriter 相同的构造函数。
+
+    Raises:
+        ValueError: 后端或 fsync 策略不存在时抛出。
+
+    """
+    if backend not in WRITERS:
+        raise ValueError(f'未知的写入后端: {backend}')
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError(f'未知的 fsync 策略: {fsync}')
+    return functools.partial(WRITERS[backend], fsync=fsync)
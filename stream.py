@@ -0,0 +1,94 @@
+import os
+import copy
+import time
+import functools
+import requests
+
+from storage import AdaptiveReadSize, RangeWriter, DEFAULT_BUFFER_SIZE
+from progress import record_written, SEGMENT_DONE, SEGMENT_FAILED
+from scheduler import Scheduler
+from connection import get_segment
+
+
+# 文件大小未知时分段的结束位置, 下载完成后改为实际的最后一个字节
+UNKNOWN_END = 2 ** 62
+
+
+def fallback_reason(info):
+    """
+    Returns:
+        str: 不能分段下载的原因, 用于显示。
+    """
+    if not info.range_support:
+        return '服务器不支持 Range 请求'
+    return '服务器未返回文件大小'
+
+
+def stream_scheduler(file_size):
+    """
+    创建单连接下载用的调度器: 只有一个覆盖整个文件的分段, 不会被拆分。
+
+    文件大小未知（或为0）时分段结束于 UNKNOWN_END, 进度按已接收的字节数显示。
+    """
+    end = file_size - 1 if file_size else UNKNOWN_END
+    return Scheduler([(0, end)], 1, min_segment=end + 1, max_segment=end + 1)
+
+
+def stream_worker(url, headers, scheduler, filepath, retry_count, buffer_size=DEFAULT_BUFFER_SIZE, writer=RangeWriter,
+                  limiter=None, resumable=False):
+    """
+    单连接从头到尾顺序下载整个文件, 用于不支持 Range 请求或没有返回文件大小的服务器。
+
+    不需要预先知道文件大小: 数据从文件开头依次写入, 响应正常结束（urllib3 会检查 Content-Length
+    和 chunked 的结束块）即为下载完成, 随后按实际写入的字节数截断文件并修正分段的结束位置。
+    出错重试时, 服务器支持 Range（resumable）则从已写入的位置继续, 否则只能从头下载。
+
+    调用前需要通过 scheduler.add_worker 计数。
+    """
+    index = scheduler.next_segment()
+    if index is None:
+        return
+    slot = scheduler.progress[index]
+    session = requests.Session()
+    attempt = 0
+    try:
+        while attempt < retry_count:
+            if not resumable:
+                slot.written = 0
+            # 之前收到但没有写入的字节不再计入进度
+            slot.done = slot.written
+            try:
+                request_headers = copy.deepcopy(headers)
+                # 直接读取原始响应体, 不能经过压缩
+                request_headers['Accept-Encoding'] = 'identity'
+                if slot.written:
+                    request_headers['Range'] = f'bytes={slot.written}-'
+                response = get_segment(session, url, request_headers, slot)
+                response.raise_for_status()
+                if slot.written and response.status_code != 206:
+                    response.close()
+                    raise ConnectionError(f'HTTP {response.status_code}: 服务器没有按 Range 返回剩余部分')
+                with response, writer(filepath, slot.written, buffer_size, on_flush=functools.partial(record_written, slot)) as output:
+                    read_size = AdaptiveReadSize(buffer_size)
+                    while True:
+                        received = output.receive(response.raw.readinto, read_size.size)
+                        if not received:
+                            break
+                        read_size.update(received)
+                        slot.done += received
+                        slot.updated = time.time()
+                        if limiter is not None:
+                            limiter.wait(received)
+                # 之前失败的尝试可能写过更长的内容, 以本次实际写入的长度为准
+                os.truncate(filepath, slot.written)
+                if slot.written:
+                    slot.end = slot.written - 1
+                slot.state = SEGMENT_DONE
+                return
+            except Exception:
+                attempt += 1
+                if attempt < retry_count:
+                    slot.retries += 1
+        slot.state = SEGMENT_FAILED
+    finally:
+        scheduler.leave()
@@ -0,0 +1,107 @@
+DEFAULT_MAX_ACTIVE = 3
+DEFAULT_MAX_CONNECTIONS = 16
+
+
+class DownloadQueue:
+    """
+    全局下载队列。
+
+    同时运行的任务数不超过 max_active, 所有运行中任务的连接数之和不超过 max_connections。
+    排队中的任务按优先级（数值越大越先开始）排序, 同优先级按加入顺序, 也可以手动调整顺序。
+    队列只负责决定“谁在什么时候用多少连接开始”, 任务本身可以是任意对象。
+    """
+    def __init__(self, max_active: int=DEFAULT_MAX_ACTIVE, max_connections: int=DEFAULT_MAX_CONNECTIONS):
+        """
+        Args:
+            max_active (int, optional): 同时运行的最大任务数。
+            max_connections (int, optional): 所有任务共享的连接总数上限。
+
+        """
+        self.max_active = max_active
+        self.max_connections = max_connections
+        self.queued = []
+        self.running = {}
+        self.requested = {}
+        self.priority = {}
+
+    def add(self, task, connections: int, priority: int=0):
+        """
+        把任务加入队列, 插在所有优先级不低于它的任务之后。
+
+        Args:
+            task (object): 任务对象。
+            connections (int): 任务希望使用的连接数。
+            priority (int, optional): 优先级, 数值越大越先开始。默认为0。
+
+        """
+        self.requested[task] = connections
+        self.priority[task] = priority
+        index = len(self.queued)
+        for i, other in enumerate(self.queued):
+            if self.priority[other] < priority:
+                index = i
+                break
+        self.queued.insert(index, task)
+
+    def move(self, task, offset: int):
+        """
+        在排队的任务中移动 task, offset 为负数表示往前移。
+
+        移动后任务继承相邻任务的优先级, 使之后加入的任务仍按优先级插入到正确位置。
+        """
+        if task not in self.queued:
+            return
+        index = self.queued.index(task)
+        target = min(max(index + offset, 0), len(self.queued) - 1)
+        if target == index:
+            return
+        self.queued.pop(index)
+        self.queued.insert(target, task)
+        neighbour = self.queued[target + 1] if offset < 0 else self.queued[target - 1]
+        self.priority[task] = self.priority[neighbour]
+
+    def remove(self, task):
+        if task in self.queued:
+            self.queued.remove(task)
+        self.running.pop(task, None)
+        self.requested.pop(task, None)
+        self.priority.pop(task, None)
+
+    def release(self, task):
+        """
+        任务结束或暂停, 归还它占用的运行名额和连接。
+        """
+        self.running.pop(task, None)
+
+    def resize(self, task, connections: int):
+        """
+        调整运行中任务占用的连接数, 如任务实际只能单连接下载时归还多余的连接。
+        """
+        if task in self.running:
+            self.running[task] = connections
+
+    @property
+    def used_connections(self):
+        return sum(self.running.values())
+
+    def schedule(self):
+        """
+        按当前的名额和连接预算, 决定哪些排队的任务现在开始。
+
+        剩余连接预算平均分给这一轮能启动的任务, 每个任务至少 1 个连接、最多为它请求的连接数。
+
+        Returns:
+            List[Tuple[object, int]]: 需要启动的任务和分配给它的连接数。
+
+        """
+        started = []
+        while self.queued and len(self.running) < self.max_active:
+            budget = self.max_connections - self.used_connections
+            if budget <= 0:
+                break
+            startable = min(len(self.queued), self.max_active - len(self.running))
+            task = self.queued.pop(0)
+            connections = max(1, min(self.requested[task], budget // startable))
+            self.running[task] = connections
+            started.append((task, connections))
+        return started
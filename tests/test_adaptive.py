@@ -0,0 +1,107 @@
+import pytest
+
+import adaptive
+from adaptive import ConnectionController
+from scheduler import Scheduler
+
+MB = 1024 * 1024
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(adaptive, 'time', clock)
+    return clock
+
+
+def make_controller(maximum=16, initial=2, recovery=30.0):
+    # 足够多的等待分段, 测量期间一直有活可干
+    scheduler = Scheduler([(0, 256 * MB - 1)], threads=1, min_segment=MB, max_segment=MB)
+    spawned = []
+    controller = ConnectionController(scheduler, lambda: spawned.append(1), maximum, initial,
+                                      interval=2.0, recovery=recovery)
+    return controller, scheduler, spawned
+
+
+def step(controller, scheduler, clock, received, throttled=0):
+    # 推进一个测量窗口: 按顺序填满分段共收到 received 字节（每个分段最多按其长度计入）, 可选地记录限流次数
+    clock.now += 2.0
+    for slot in scheduler.segments():
+        size = min(received, slot.end - slot.start + 1 - slot.done)
+        slot.done += size
+        received -= size
+    scheduler.progress[0].throttled += throttled
+    return controller.update()
+
+
+def test_throttled_ceiling_recovers_after_quiet_period(clock):
+    controller, scheduler, _ = make_controller(initial=8, recovery=10.0)
+    step(controller, scheduler, clock, 10 * MB, throttled=3)
+    assert (controller.target, controller.ceiling) == (6, 6)
+    # 限流停止后不超过上限
+    for _ in range(4):
+        step(controller, scheduler, clock, 10 * MB)
+        assert controller.target == 6
+    # 10 秒没有限流: 上限放宽一个连接, 随即试探
+    step(controller, scheduler, clock, 10 * MB)
+    assert (controller.target, controller.ceiling) == (7, 7)
+
+
+def test_ceiling_does_not_recover_while_throttled(clock):
+    controller, scheduler, _ = make_controller(initial=8, recovery=4.0)
+    for _ in range(4):
+        step(controller, scheduler, clock, 10 * MB, throttled=1)
+    assert controller.ceiling == controller.target < 8
+
+
+def test_slow_start_doubles_while_throughput_grows(clock):
+    controller, scheduler, spawned = make_controller(initial=2)
+    assert len(spawned) == 2
+    step(controller, scheduler, clock, 10 * MB)
+    assert controller.target == 4
+    step(controller, scheduler, clock, 20 * MB)
+    assert controller.target == 8
+    assert scheduler.limit.value == 8
+    assert len(spawned) == 8
+
+
+def test_throttling_drops_a_quarter_of_connections(clock):
+    controller, scheduler, _ = make_controller(initial=8)
+    message = step(controller, scheduler, clock, 10 * MB, throttled=2)
+    assert controller.target == 6
+    assert scheduler.limit.value == 6
+    assert '限流 2 次' in message
+    # 之后只加一个连接, 不再翻倍, 且不超过降低后的上限
+    assert not controller.slow_start
+    step(controller, scheduler, clock, 10 * MB)
+    assert controller.target == 6
+
+
+def test_retries_also_lower_the_target(clock):
+    controller, scheduler, _ = make_controller(initial=4)
+    scheduler.progress[0].retries += 1
+    clock.now += 2.0
+    controller.update()
+    assert (controller.target, controller.ceiling) == (3, 3)
+
+
+def test_no_gain_rolls_back_and_caps(clock):
+    controller, scheduler, _ = make_controller(initial=2)
+    step(controller, scheduler, clock, 10 * MB)
+    assert controller.target == 4
+    # 翻倍后吞吐量没有提升: 退回 2 个连接, 上限也降到 2
+    step(controller, scheduler, clock, 10 * MB)
+    assert (controller.target, controller.ceiling) == (2, 2)
+    step(controller, scheduler, clock, 20 * MB)
+    assert controller.target == 2
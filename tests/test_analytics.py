@@ -0,0 +1,63 @@
+import pytest
+
+from analytics import format_bytes, format_duration, display_width, print_table
+from data import Database
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    database = Database()
+    for url, status, end_time, size, duration, connections, retries in [
+        ('http://a.com/1', 'ok', '2024-01-01 10:00:00', 100 * MB, 10.0, 8, 0),
+        ('http://a.com/2', 'ok', '2024-01-02 10:00:00', 50 * MB, 10.0, 4, 2),
+        ('http://a.com/3', 'failed', '2024-01-02 11:00:00', None, 5.0, 4, 6),
+        ('http://b.com:8080/1', 'ok', '2024-01-02 12:00:00', 10 * MB, 20.0, 2, 1),
+    ]:
+        database.add_download_record(url.rsplit('/', 1)[-1], url, status, end_time, end_time, '', size, duration,
+                                     connections, retries)
+    return database
+
+
+def test_host_stats(database):
+    rows = database.host_stats()
+    # 按下载量从多到少排列, 地址中的端口作为主机的一部分
+    assert [row[0] for row in rows] == ['a.com', 'b.com:8080']
+    host, count, ok, size, duration, throughput, connections, retries = rows[0]
+    assert (count, ok, size, duration, retries) == (3, 2, 150 * MB, 25.0, 8)
+    # 没有字节数的记录不计入平均速度的时间
+    assert throughput == pytest.approx(150 * MB / 20.0)
+    assert connections == pytest.approx(16 / 3)
+    assert rows[1][5] == pytest.approx(MB / 2)
+
+
+def test_daily_stats(database):
+    rows = database.daily_stats()
+    assert [(row[0], row[1], row[3]) for row in rows] == [('2024-01-02', 3, 60 * MB), ('2024-01-01', 1, 100 * MB)]
+
+
+def test_stats_since(database):
+    assert [row[0] for row in database.daily_stats(since='2024-01-02 11:00:00')] == ['2024-01-02']
+    host_rows = database.host_stats(since='2024-01-02 11:00:00')
+    assert [(row[0], row[1], row[3]) for row in host_rows] == [('b.com:8080', 1, 10 * MB), ('a.com', 1, 0)]
+    # 只有失败的下载时没有平均速度
+    assert host_rows[1][5] is None
+    assert database.host_stats(since='2030-01-01 00:00:00') == []
+
+
+def test_formatting():
+    assert format_bytes(512) == '512B'
+    assert format_bytes(150 * MB) == '150.00MB'
+    assert format_duration(3725.5) == '1:02:05'
+    assert display_width('主机 a') == 6
+
+
+def test_print_table_aligns_columns(database, capsys):
+    print_table('主机', database.host_stats())
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('主机')
+    assert lines[1].startswith('a.com ')
+    assert len({display_width(line) for line in lines[:3]}) == 1
@@ -0,0 +1,211 @@
+import os
+import re
+import time
+import asyncio
+import threading
+import multiprocessing
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from async_engine import HTTPConnection, AsyncDownload, fetch_segment, check_writer
+from bandwidth import RateLimiter
+from mirrors import MirrorSet
+from progress import SEGMENT_DONE, SEGMENT_RUNNING, SEGMENT_FAILED
+from scheduler import Scheduler
+from storage import RangeWriter, allocate_file
+
+MB = 1024 * 1024
+DATA = os.urandom(4 * MB)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    按 Range 返回 DATA; server.cap 限制每个 206 响应的长度, server.length 为 False 时不发送 Content-Length,
+    server.stall 为 True 时发送一部分数据后停住, server.redirect 为 True 时返回没有 Location 的 302。
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.redirect:
+            self.send_response(302)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = 0, len(DATA) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), start + server.cap - 1)
+            self.send_response(206)
+            if server.length:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        if server.length:
+            self.send_header('Content-Length', str(end - start + 1))
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        if server.stall:
+            self.wfile.write(DATA[start:start + 64 * 1024])
+            self.wfile.flush()
+            server.released.wait(10)
+            return
+        self.wfile.write(DATA[start:end + 1])
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.cap, httpd.length, httpd.stall, httpd.redirect = len(DATA), True, False, False
+    httpd.released = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.released.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url_of(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/file.bin'
+
+
+def fetch(server, filepath, writer=RangeWriter, limiter=None):
+    scheduler = Scheduler([(0, len(DATA) - 1)], 1, min_segment=len(DATA), max_segment=len(DATA))
+    slot = scheduler.progress[0]
+    allocate_file(filepath, len(DATA))
+
+    async def run():
+        connection = HTTPConnection(url_of(server))
+        try:
+            return await fetch_segment(connection, url_of(server), {}, slot, filepath, MB, writer, limiter=limiter)
+        finally:
+            connection.close()
+    return slot, run
+
+
+def test_short_206_is_not_a_complete_segment(server, tmp_path):
+    server.cap = MB
+    slot, run = fetch(server, str(tmp_path / 'file.bin'))
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    # 收到的部分已经写入, 重试时从这里继续
+    assert slot.written == MB
+    assert slot.end == len(DATA) - 1
+
+
+def test_206_without_length_is_rejected(server, tmp_path):
+    server.length = False
+    slot, run = fetch(server, str(tmp_path / 'file.bin'))
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert slot.written == 0
+
+
+def test_short_206_is_retried_until_complete(server, tmp_path):
+    server.cap = MB
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, len(DATA))
+    scheduler = Scheduler([(0, len(DATA) - 1)], 1, min_segment=len(DATA), max_segment=len(DATA))
+    handle = AsyncDownload(MirrorSet([url_of(server)]), {}, scheduler, filepath, retry_count=3)
+    scheduler.add_worker()
+    handle.add_worker()
+    handle.join(30)
+    assert not handle.is_alive()
+    assert scheduler.progress[0].state == SEGMENT_DONE
+    with open(filepath, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_join_waits_for_cancelled_workers(server, tmp_path):
+    server.stall = True
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, len(DATA))
+    scheduler = Scheduler([(0, len(DATA) - 1)], 1, min_segment=len(DATA), max_segment=len(DATA))
+    handle = AsyncDownload(MirrorSet([url_of(server)]), {}, scheduler, filepath, retry_count=3)
+    scheduler.add_worker()
+    handle.add_worker()
+    slot = scheduler.progress[0]
+    deadline = time.monotonic() + 10
+    while slot.done == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert slot.state == SEGMENT_RUNNING
+    handle.terminate()
+    handle.join(10)
+    assert not handle.is_alive()
+    # 取消后 download_worker 已经退出并减去了计数, 写缓冲区中的数据已经落盘
+    assert scheduler.workers.value == 0
+    assert slot.written == slot.done
+
+
+def test_redirect_without_location_fails_the_segment(server, tmp_path):
+    server.redirect = True
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, len(DATA))
+    scheduler = Scheduler([(0, len(DATA) - 1)], 1, min_segment=len(DATA), max_segment=len(DATA))
+    handle = AsyncDownload(MirrorSet([url_of(server)]), {}, scheduler, filepath, retry_count=2)
+    scheduler.add_worker()
+    handle.add_worker()
+    handle.join(30)
+    # 按普通的错误重试并放回等待队列, 用尽后标记为失败, 不会一直停在下载中
+    assert not handle.is_alive()
+    assert scheduler.progress[0].state == SEGMENT_FAILED
+    assert scheduler.workers.value == 0
+
+
+def run_with_ticker(run):
+    """
+    与 run 并发运行一个每 10ms 计数一次的协程, 返回计数: 事件循环被阻塞时计数明显偏少。
+    """
+    async def main():
+        ticks = 0
+        task = asyncio.ensure_future(run())
+        while not task.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await task
+        return ticks
+    return asyncio.run(main())
+
+
+class SlowCloseWriter(RangeWriter):
+    def close(self):
+        # 模拟 coalesce 等待写线程或 fsync
+        time.sleep(0.5)
+        super().close()
+
+
+def test_closing_writer_does_not_block_the_loop(server, tmp_path):
+    slot, run = fetch(server, str(tmp_path / 'file.bin'), writer=SlowCloseWriter)
+    assert run_with_ticker(run) >= 25
+    assert slot.written == len(DATA)
+
+
+def hold_lock(lock):
+    lock.acquire()
+
+
+def test_waiting_for_limiter_lock_does_not_block_the_loop(server, tmp_path):
+    limiter = RateLimiter(10 ** 12)
+    # 锁被已经退出的进程带走, 预约要等 LOCK_TIMEOUT 才能接管
+    process = multiprocessing.Process(target=hold_lock, args=(limiter.lock,))
+    process.start()
+    process.join()
+    slot, run = fetch(server, str(tmp_path / 'file.bin'), limiter=limiter)
+    assert run_with_ticker(run) >= 25
+    assert slot.written == len(DATA)
+
+
+def test_interval_fsync_needs_coalesce_writer():
+    check_writer('coalesce', 'interval')
+    check_writer('pwrite', 'close')
+    with pytest.raises(ValueError):
+        check_writer('pwrite', 'interval')
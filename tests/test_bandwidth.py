@@ -0,0 +1,78 @@
+import time
+import multiprocessing
+
+import pytest
+
+from bandwidth import RateLimiter, parse_rate, format_rate, BURST_SECONDS, LOCK_TIMEOUT
+
+
+def test_parse_rate_units():
+    assert parse_rate('0') == 0
+    assert parse_rate('512') == 512
+    assert parse_rate('512K') == 512 * 1024
+    assert parse_rate(' 1.5m ') == int(1.5 * 1024 ** 2)
+    assert parse_rate('2MB/s') == 2 * 1024 ** 2
+    assert parse_rate('1G') == 1024 ** 3
+
+
+@pytest.mark.parametrize('text', ['', 'fast', '1T', '-1M', '1.M'])
+def test_parse_rate_rejects_bad_input(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+
+def test_format_rate():
+    assert format_rate(0) == '不限速'
+    assert format_rate(2 * 1024 ** 2) == '2MB/s'
+
+
+def test_unlimited_never_waits():
+    limiter = RateLimiter()
+    assert limiter.reserve(10 ** 9) == 0.0
+
+
+def test_reserve_spaces_traffic_by_rate():
+    limiter = RateLimiter(1000)
+    # 空闲后的第一块立即通过, 之后每块按速率排队, 只扣除 BURST_SECONDS 的突发
+    assert limiter.reserve(10) == 0.0
+    delays = [limiter.reserve(100) for _ in range(3)]
+    for expected, delay in zip((0.11, 0.21, 0.31), delays):
+        assert delay == pytest.approx(expected - BURST_SECONDS, abs=0.01)
+
+
+def test_parent_limits_child():
+    parent = RateLimiter(1000)
+    child = RateLimiter(0, parent=parent)
+    child.reserve(1000)
+    # 子限速器不限速时等待时间由 parent 决定
+    assert child.reserve(1000) == pytest.approx(2 - BURST_SECONDS, abs=0.01)
+    # 两者都限速时取较大值
+    child.set_rate(100)
+    assert child.reserve(1000) == pytest.approx(10 - BURST_SECONDS, abs=0.01)
+
+
+def test_set_rate_drops_old_backlog():
+    limiter = RateLimiter(100)
+    limiter.reserve(10000)
+    limiter.set_rate(10000)
+    assert limiter.reserve(100) == 0.0
+
+
+def hold_lock_and_exit(lock):
+    lock.acquire()
+
+
+def test_lock_left_by_terminated_worker_is_recovered():
+    limiter = RateLimiter(1000)
+    # 模拟 worker 在锁内被结束: 子进程拿到锁后退出, 锁不会被释放
+    process = multiprocessing.Process(target=hold_lock_and_exit, args=(limiter.lock,))
+    process.start()
+    process.join()
+    start = time.monotonic()
+    limiter.reserve(10)
+    limiter.set_rate(2000)
+    assert time.monotonic() - start < 2 * LOCK_TIMEOUT + 0.5
+    # 接管后锁恢复可用, 之后不再等待超时
+    start = time.monotonic()
+    limiter.reserve(10)
+    assert time.monotonic() - start < LOCK_TIMEOUT / 2
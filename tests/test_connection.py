@@ -0,0 +1,104 @@
+import os
+import re
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from connection import get_segment, release_connection, DRAIN_LIMIT
+from scheduler import Scheduler
+
+MB = 1024 * 1024
+DATA = os.urandom(4 * MB)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    按 Range 返回 DATA; 前 server.throttle 个请求返回 429 (Retry-After: 0)。
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.throttle > 0:
+            server.throttle -= 1
+            body = b'slow down'
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers['Range'])
+        start, end = int(match.group(1)), int(match.group(2))
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(DATA[start:end + 1])
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.throttle = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def slots():
+    return Scheduler([(0, len(DATA) - 1)], 1, min_segment=MB, max_segment=MB).segments()
+
+
+def request(server, session, slot, end=None):
+    url = f'http://127.0.0.1:{server.server_address[1]}/file.bin'
+    headers = {'Range': f'bytes={slot.start}-{slot.end if end is None else end}', 'Accept-Encoding': 'identity'}
+    return get_segment(session, url, headers, slot)
+
+
+def test_segments_reuse_one_connection(server, slots):
+    session = requests.Session()
+    for slot in slots:
+        response = request(server, session, slot)
+        assert response.content == DATA[slot.start:slot.end + 1]
+    # 只有第一个请求需要握手
+    assert [(slot.requests, slot.connections) for slot in slots] == [(1, 1), (1, 0), (1, 0), (1, 0)]
+
+
+def test_release_drains_short_remainder(server, slots):
+    session = requests.Session()
+    response = request(server, session, slots[0])
+    response.raw.read(MB - DRAIN_LIMIT)
+    release_connection(response)
+    request(server, session, slots[1]).content
+    assert slots[1].connections == 0
+
+
+def test_release_closes_long_remainder(server, slots):
+    session = requests.Session()
+    response = request(server, session, slots[0])
+    response.raw.read(1024)
+    release_connection(response)
+    # 剩余太多时断开, 下一个请求重新握手
+    request(server, session, slots[1]).content
+    assert slots[1].connections == 1
+
+
+def test_throttled_requests_are_resent_on_the_same_connection(server, slots):
+    server.throttle = 2
+    session = requests.Session()
+    response = request(server, session, slots[0])
+    assert response.status_code == 206
+    assert response.content == DATA[:MB]
+    assert (slots[0].requests, slots[0].throttled, slots[0].connections) == (3, 2, 1)
+    # 限流不消耗重试次数
+    assert slots[0].retries == 0
@@ -0,0 +1,152 @@
+import sqlite3
+import multiprocessing
+
+import pytest
+
+from data import Database, NUMERIC_COLUMNS, HISTORY_SCHEMA_VERSION, close_connections
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return Database()
+
+
+def add_records(database, names):
+    database.add_download_records(
+        (name, f'http://example.com/files/{name}', 'ok', '2024-01-01 00:00:00', '2024-01-01 00:01:00', '1.00 MB')
+        for name in names)
+
+
+def filenames(rows):
+    return [row[1] for row in rows]
+
+
+def test_search_matches_word_prefixes(database):
+    add_records(database, ['report-2023.pdf', 'annual report.doc', 'photo.jpg'])
+    assert filenames(database.search_history('rep')) == ['annual report.doc', 'report-2023.pdf']
+    # 所有词都要匹配, 结果从新到旧排列
+    assert filenames(database.search_history('report 2023')) == ['report-2023.pdf']
+    assert database.search_history('   ') == []
+
+
+@pytest.mark.parametrize('text', ['"', 'say "hi', 'report OR', 'NOT photo', 'a AND', '(report', 'photo*', 'url:photo', '^x'])
+def test_search_does_not_parse_fts_operators(database, text):
+    add_records(database, ['report.pdf', 'photo.jpg'])
+    # 用户输入中的引号和 FTS5 运算符都当作普通文本, 不会引发语法错误
+    database.search_history(text)
+
+
+def test_search_treats_operator_words_as_text(database):
+    add_records(database, ['NOT-a-virus.exe', 'photo.jpg'])
+    assert filenames(database.search_history('NOT')) == ['NOT-a-virus.exe']
+
+
+def test_like_search_escapes_wildcards(database):
+    add_records(database, ['1000.txt', 'progress_100%.txt', 'a_b.txt', 'axb.txt', 'dir\\name.txt', 'dirname.txt'])
+    # 没有 FTS5 时退回 LIKE, % _ \ 按字面匹配
+    database.fts = False
+    assert filenames(database.search_history('100%')) == ['progress_100%.txt']
+    assert filenames(database.search_history('a_b')) == ['a_b.txt']
+    assert filenames(database.search_history('dir\\')) == ['dir\\name.txt']
+    assert filenames(database.search_history('txt 1000')) == ['1000.txt']
+
+
+def test_migrate_old_history_table(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    root = tmp_path / 'config' / 'Downloader'
+    root.mkdir(parents=True)
+    # 旧版本的表: 没有数值列, user_version 为 0
+    conn = sqlite3.connect(root / 'downloader.db')
+    with conn:
+        conn.execute("""CREATE TABLE download_history (
+                        id INTEGER PRIMARY KEY UNIQUE,
+                        filename TEXT NOT NULL,
+                        url TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        start_time DATETIME NOT NULL,
+                        end_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        size TEXT NOT NULL
+                    )""")
+        conn.executemany(
+            "INSERT INTO download_history (filename, url, status, start_time, end_time, size) VALUES (?, ?, ?, ?, ?, ?)",
+            [('a.bin', 'https://Example.com/a.bin', 'ok', '2024-01-01 00:00:00', '2024-01-01 00:00:10', '20.00 MB'),
+             ('b.bin', 'http://mirror.org/b.bin', 'error', '2024-01-02 00:00:00', '2024-01-02 00:00:00', '未知')])
+    conn.close()
+
+    database = Database()
+    columns = [row[1] for row in database.conn.execute("PRAGMA table_info(download_history)")]
+    assert columns[-len(NUMERIC_COLUMNS):] == [name for name, _ in NUMERIC_COLUMNS]
+    assert database.conn.execute("PRAGMA user_version").fetchone()[0] == HISTORY_SCHEMA_VERSION
+    rows = database.conn.execute(
+        "SELECT host, bytes, duration, throughput, connections, retries FROM download_history ORDER BY id").fetchall()
+    host, size, duration, throughput, connections, retries = rows[0]
+    assert (host, size, connections, retries) == ('example.com', 20 * 1024 ** 2, None, None)
+    assert duration == pytest.approx(10, abs=0.01)
+    assert throughput == pytest.approx(2 * 1024 ** 2, rel=0.01)
+    # 无法识别的大小和零耗时没有字节数和速度
+    assert rows[1] == ('mirror.org', None, 0, None, None, None)
+    # 旧记录也能搜索, 再次打开时不重复迁移
+    assert filenames(database.search_history('mirror')) == ['b.bin']
+    assert Database().conn.execute("SELECT COUNT(*) FROM download_history").fetchone()[0] == 2
+    assert sorted(row[0] for row in database.host_stats()) == ['example.com', 'mirror.org']
+
+
+def test_history_pages_by_id(database):
+    add_records(database, [f'{i}.bin' for i in range(7)])
+    first = database.get_history_before(limit=3)
+    assert filenames(first) == ['6.bin', '5.bin', '4.bin']
+    second = database.get_history_before(first[-1][0], limit=3)
+    assert filenames(second) == ['3.bin', '2.bin', '1.bin']
+    # 最后一页不满一页, 再往后为空
+    last = database.get_history_before(second[-1][0], limit=3)
+    assert filenames(last) == ['0.bin']
+    assert database.get_history_before(last[-1][0], limit=3) == []
+
+
+def test_history_paging_skips_deleted_rows(database):
+    add_records(database, [f'{i}.bin' for i in range(6)])
+    first = database.get_history_before(limit=2)
+    # 翻页之间删除了下一页中的记录, 也删除了作为游标的记录本身, 不会重复或漏掉其余的记录
+    rows = database.get_history_before(limit=6)
+    database.delete_histories([rows[1][0], rows[2][0]])
+    assert filenames(database.get_history_before(first[-1][0], limit=2)) == ['2.bin', '1.bin']
+    database.add_download_record('new.bin', 'http://example.com/new.bin', 'ok', '2024-01-02 00:00:00',
+                                 '2024-01-02 00:01:00', '1.00 MB')
+    # 新记录只出现在第一页
+    assert filenames(database.get_history_before(first[-1][0], limit=10)) == ['2.bin', '1.bin', '0.bin']
+    assert filenames(database.get_history_before(limit=1)) == ['new.bin']
+
+
+def test_databases_share_one_wal_connection(database):
+    other = Database()
+    assert other.conn is database.conn
+    assert database.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    add_records(database, ['a.bin'])
+    assert filenames(other.get_history_before()) == ['a.bin']
+
+
+def add_in_child(database):
+    add_records(database, ['child.bin'])
+
+
+def test_forked_process_opens_its_own_connection(database):
+    add_records(database, ['parent.bin'])
+    # 子进程不能使用 fork 时复制过去的连接, 按进程号另建连接后写入
+    process = multiprocessing.get_context('fork').Process(target=add_in_child, args=(database, ))
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+    assert filenames(database.get_history_before()) == ['child.bin', 'parent.bin']
+
+
+def test_close_connections_reopens_on_next_use(database):
+    conn = database.conn
+    close_connections()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    add_records(database, ['a.bin'])
+    assert database.conn is not conn
+    assert filenames(database.get_history_before()) == ['a.bin']
@@ -0,0 +1,59 @@
+import json
+
+from journal import Journal, merge_ranges, missing_ranges
+from progress import create_progress
+
+
+def test_merge_ranges_joins_overlapping_and_adjacent():
+    assert merge_ranges([(10, 19), (0, 4), (5, 9), (30, 39), (35, 50)]) == [(0, 19), (30, 50)]
+
+
+def test_merge_ranges_drops_empty_ranges():
+    assert merge_ranges([(5, 4), (0, 0)]) == [(0, 0)]
+
+
+def test_missing_ranges():
+    assert missing_ranges([(10, 19), (0, 4)], 30) == [(5, 9), (20, 29)]
+    assert missing_ranges([], 10) == [(0, 9)]
+    assert missing_ranges([(0, 9)], 10) == []
+
+
+def make_journal(tmp_path):
+    filepath = tmp_path / 'file.bin'
+    filepath.write_bytes(b'\0' * 100)
+    return Journal(str(filepath), 'http://example.com/file.bin', 100, etag='"abc"')
+
+
+def test_save_and_load(tmp_path):
+    journal = make_journal(tmp_path)
+    progress = create_progress([(0, 49), (50, 99)])
+    progress[0].written = 50
+    progress[1].written = 10
+    journal.save(progress)
+
+    loaded = make_journal(tmp_path)
+    assert loaded.load() == [(0, 59)]
+    assert loaded.missing() == [(60, 99)]
+
+
+def test_load_discards_journal_of_changed_file(tmp_path):
+    journal = make_journal(tmp_path)
+    journal.completed = [(0, 9)]
+    journal.save()
+
+    changed = Journal(journal.filepath, journal.url, 100, etag='"def"')
+    assert changed.load() == []
+    assert not (tmp_path / 'file.bin.journal').exists()
+
+
+def test_save_in_background(tmp_path):
+    journal = make_journal(tmp_path)
+    progress = create_progress([(0, 99)])
+    progress[0].written = 30
+    assert journal.save_in_background(progress)
+    # 拿到锁时后台保存已经结束
+    with journal.lock:
+        with open(journal.path, encoding='utf-8') as f:
+            assert json.load(f)['completed'] == [[0, 29]]
+    journal.remove()
+    assert not (tmp_path / 'file.bin.journal').exists()
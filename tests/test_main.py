@@ -0,0 +1,101 @@
+import time
+import threading
+import multiprocessing
+import multiprocessing.connection
+
+import pytest
+
+from data import Database
+from main import wait_workers, HistoryModel, HISTORY_PAGE_SIZE
+
+
+def start_sleeper(seconds):
+    process = multiprocessing.Process(target=time.sleep, args=(seconds, ))
+    process.start()
+    return process
+
+
+def exited(processes):
+    # sentinel 就绪时进程已经退出, is_alive 可能还没来得及回收
+    sentinels = [process.sentinel for process in processes]
+    return len(multiprocessing.connection.wait(sentinels, timeout=0)) == len(sentinels)
+
+
+def test_wait_workers_includes_workers_added_while_waiting():
+    processes = [start_sleeper(0.3)]
+    finished = threading.Event()
+    thread = threading.Thread(target=lambda: (wait_workers(processes), finished.set()), daemon=True)
+    thread.start()
+    # 自适应连接数在等待期间追加 worker
+    time.sleep(0.1)
+    processes.append(start_sleeper(1.0))
+    time.sleep(0.5)
+    assert not finished.is_set()
+    assert finished.wait(5)
+    assert exited(processes)
+    for process in processes:
+        process.join()
+
+
+def test_wait_workers_returns_when_all_exited():
+    processes = [start_sleeper(0), start_sleeper(0.2)]
+    started = time.monotonic()
+    wait_workers(processes)
+    assert time.monotonic() - started < 5
+    assert exited(processes)
+    for process in processes:
+        process.join()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    database = Database()
+    database.add_download_records(
+        (f'{i}.bin', f'http://example.com/{i}.bin', 'ok', '2024-01-01 00:00:00', '2024-01-01 00:01:00', '1.00 MB')
+        for i in range(HISTORY_PAGE_SIZE * 2 + 5))
+    return database
+
+
+def filenames(model):
+    return [model.data(model.index(row)) for row in range(model.rowCount())]
+
+
+def test_history_model_fetches_pages_lazily(database):
+    model = HistoryModel(database)
+    assert model.rowCount() == 0
+    model.fetchMore()
+    assert model.rowCount() == HISTORY_PAGE_SIZE
+    assert filenames(model)[:2] == [f'{HISTORY_PAGE_SIZE * 2 + 4}.bin', f'{HISTORY_PAGE_SIZE * 2 + 3}.bin']
+    while model.canFetchMore():
+        model.fetchMore()
+    # 按 id 从新到旧加载完所有记录, 没有重复
+    assert filenames(model) == [f'{i}.bin' for i in reversed(range(HISTORY_PAGE_SIZE * 2 + 5))]
+    entry = model.data(model.index(0), HistoryModel.EntryRole)
+    assert (entry['filename'], entry['size']) == (f'{HISTORY_PAGE_SIZE * 2 + 4}.bin', '1.00 MB')
+
+
+def test_history_model_prepend_and_remove(database):
+    model = HistoryModel(database)
+    model.fetchMore()
+    history_id = database.add_download_record('new.bin', 'http://example.com/new.bin', 'ok', '2024-01-02 00:00:00',
+                                              '2024-01-02 00:01:00', '1.00 MB')
+    model.prepend(database.get_history_before(limit=1)[0][:HistoryModel.HISTORY_FIELDS])
+    assert filenames(model)[0] == 'new.bin'
+    model.remove(history_id)
+    assert 'new.bin' not in filenames(model)
+    # 之后的翻页仍以已加载的最后一条为游标
+    model.fetchMore()
+    assert model.rowCount() == HISTORY_PAGE_SIZE * 2
+
+
+def test_history_model_search_does_not_page(database):
+    model = HistoryModel(database)
+    model.search('13')
+    assert filenames(model) == ['13.bin']
+    assert not model.canFetchMore()
+    # 清空搜索后从第一页重新加载
+    model.search('')
+    assert model.rowCount() == HISTORY_PAGE_SIZE
+    assert model.canFetchMore()
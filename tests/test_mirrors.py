@@ -0,0 +1,110 @@
+import pytest
+
+import mirrors
+from mirrors import MirrorSet, MirrorDisabled, MAX_MIRROR_FAILURES, MIN_SAMPLE, REPORT_INTERVAL
+from scheduler import Scheduler
+
+MB = 1024 * 1024
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(mirrors, 'time', clock)
+    return clock
+
+
+def make_slot():
+    scheduler = Scheduler([(0, 64 * MB - 1)], 1, min_segment=64 * MB, max_segment=64 * MB)
+    return scheduler.progress[0]
+
+
+def test_acquire_spreads_workers_over_mirrors():
+    mirror_set = MirrorSet(['http://a/f', 'http://b/f'])
+    assert sorted(mirror_set.acquire() for _ in range(4)) == [0, 0, 1, 1]
+    mirror_set.release(0)
+    # 使用者最少的镜像优先
+    assert mirror_set.acquire() == 0
+
+
+def test_failing_mirror_is_disabled_and_workers_move():
+    mirror_set = MirrorSet(['http://a/f', 'http://b/f'])
+    index = mirror_set.acquire()
+    assert index == 0
+    for _ in range(MAX_MIRROR_FAILURES - 1):
+        assert mirror_set.record(0, 0, 1.0, ok=False) == 0
+    # 第三次连续失败后停用, worker 换到另一个镜像
+    assert mirror_set.record(0, 0, 1.0, ok=False) == 1
+    assert mirror_set.stats[0].disabled
+    assert (mirror_set.stats[0].workers, mirror_set.stats[1].workers) == (0, 1)
+    assert mirror_set.enabled() == [1]
+
+
+def test_success_resets_failures():
+    mirror_set = MirrorSet(['http://a/f', 'http://b/f'])
+    mirror_set.acquire()
+    for _ in range(MAX_MIRROR_FAILURES - 1):
+        mirror_set.record(0, 0, 1.0, ok=False)
+    mirror_set.record(0, MB, 1.0, ok=True)
+    assert mirror_set.record(0, 0, 1.0, ok=False) == 0
+    assert not mirror_set.stats[0].disabled
+
+
+def test_last_mirror_is_never_disabled():
+    mirror_set = MirrorSet(['http://a/f'])
+    mirror_set.acquire()
+    for _ in range(MAX_MIRROR_FAILURES * 2):
+        assert mirror_set.record(0, 0, 1.0, ok=False) == 0
+    assert not mirror_set.stats[0].disabled
+
+
+def test_slow_mirror_is_disabled():
+    mirror_set = MirrorSet(['http://a/f', 'http://b/f'])
+    mirror_set.acquire()
+    mirror_set.acquire()
+    mirror_set.record(1, 40 * MB, 2.0, ok=True)
+    # 单连接速度不到最快镜像的四分之一
+    assert mirror_set.record(0, 4 * MB, 2.0, ok=True) == 1
+    assert mirror_set.stats[0].disabled
+
+
+def test_meter_raises_when_mirror_is_disabled_mid_request(clock):
+    mirror_set = MirrorSet(['http://a/f', 'http://b/f'])
+    mirror_set.acquire()
+    mirror_set.acquire()
+    mirror_set.record(1, 40 * MB, 2.0, ok=True)
+    slot = make_slot()
+    meter = mirror_set.meter(0, slot)
+    slot.done += MB
+    # 不足汇报间隔时不汇报
+    clock.now += REPORT_INTERVAL / 2
+    meter.check()
+    assert mirror_set.stats[0].received == 0
+    clock.now += MIN_SAMPLE
+    with pytest.raises(MirrorDisabled):
+        meter.check()
+    assert meter.next == 1
+    assert mirror_set.stats[0].received == MB
+
+
+def test_meter_reports_progress_since_last_report(clock):
+    mirror_set = MirrorSet(['http://a/f'])
+    mirror_set.acquire()
+    slot = make_slot()
+    meter = mirror_set.meter(0, slot)
+    slot.done += 3 * MB
+    clock.now += REPORT_INTERVAL
+    meter.check()
+    slot.done += MB
+    clock.now += 0.5
+    assert meter.report() == 0
+    assert mirror_set.stats[0].received == 4 * MB
+    assert mirror_set.stats[0].seconds == pytest.approx(REPORT_INTERVAL + 0.5)
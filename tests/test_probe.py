@@ -0,0 +1,25 @@
+from probe import parse_digests
+
+
+def test_parse_digest_header():
+    digests = parse_digests({'Digest': 'SHA-256=X48E9qOokqqrvdts8nOJRJN3OWDUoyWxBf7kbu9DBPE=, MD5=HUXZLQLMuI/KZ5KDcJPcOA=='})
+    assert digests == {'sha-256': 'X48E9qOokqqrvdts8nOJRJN3OWDUoyWxBf7kbu9DBPE=', 'md5': 'HUXZLQLMuI/KZ5KDcJPcOA=='}
+
+
+def test_parse_repr_digest_strips_byte_sequence_colons():
+    digests = parse_digests({'Repr-Digest': 'sha-512=:abc=:, sha-256=:def=:'})
+    assert digests == {'sha-512': 'abc=', 'sha-256': 'def='}
+
+
+def test_digest_takes_precedence_over_repr_digest():
+    digests = parse_digests({'Digest': 'sha-256=first', 'Repr-Digest': 'sha-256=:second:'})
+    assert digests['sha-256'] == 'first'
+
+
+def test_content_md5_overrides_md5_digest():
+    digests = parse_digests({'Digest': 'md5=fromdigest', 'Content-MD5': ' frommd5 '})
+    assert digests == {'md5': 'frommd5'}
+
+
+def test_no_digest_headers():
+    assert parse_digests({'Content-Length': '10'}) == {}
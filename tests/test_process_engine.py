@@ -0,0 +1,112 @@
+import os
+import re
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from mirrors import MirrorSet
+from process_engine import download_worker, fetch_segment
+from progress import SEGMENT_DONE, SEGMENT_FAILED
+from scheduler import Scheduler
+from storage import allocate_file
+
+MB = 1024 * 1024
+DATA = os.urandom(4 * MB)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    按 Range 返回 DATA, 其它路径返回 404; server.cap 限制每个 206 响应的长度,
+    server.ignore_range 为 True 时总是返回完整的 200。
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if self.path != '/file.bin':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = 0, len(DATA) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and not server.ignore_range:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), start + server.cap - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(DATA[start:end + 1])
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.cap, httpd.ignore_range = len(DATA), False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url_of(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/file.bin'
+
+
+def run_worker(server, filepath, retry_count=3):
+    # 在测试进程中直接运行 worker, 与子进程中的行为相同
+    scheduler = Scheduler([(0, len(DATA) - 1)], 1, min_segment=MB, max_segment=MB)
+    allocate_file(filepath, len(DATA))
+    scheduler.add_worker()
+    download_worker(MirrorSet([url_of(server)]), scheduler, filepath, retry_count, {})
+    return scheduler
+
+
+def test_worker_downloads_all_segments(server, tmp_path):
+    filepath = str(tmp_path / 'file.bin')
+    scheduler = run_worker(server, filepath)
+    assert all(slot.state == SEGMENT_DONE for slot in scheduler.segments())
+    assert scheduler.workers.value == 0
+    with open(filepath, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_short_206_is_resumed_from_written_bytes(server, tmp_path):
+    server.cap = MB // 4
+    filepath = str(tmp_path / 'file.bin')
+    scheduler = run_worker(server, filepath, retry_count=5)
+    # 每次只收到四分之一, 重试时从已写入的位置继续
+    assert all(slot.state == SEGMENT_DONE for slot in scheduler.segments())
+    assert all(slot.retries == 3 for slot in scheduler.segments())
+    with open(filepath, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_200_for_a_later_segment_is_rejected(server, tmp_path):
+    server.ignore_range = True
+    scheduler = run_worker(server, str(tmp_path / 'file.bin'), retry_count=1)
+    slots = scheduler.segments()
+    # 第一个分段从 0 开始, 完整的 200 也可以按顺序写入; 其余分段不能使用
+    assert slots[0].state == SEGMENT_DONE
+    assert all(slot.state == SEGMENT_FAILED for slot in slots[1:])
+    assert all(slot.written == 0 for slot in slots[1:])
+
+
+def test_fetch_segment_raises_on_http_error(server, tmp_path):
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, len(DATA))
+    scheduler = Scheduler([(0, len(DATA) - 1)], 1, min_segment=len(DATA), max_segment=len(DATA))
+    slot = scheduler.progress[0]
+    with pytest.raises(requests.HTTPError):
+        fetch_segment(requests.Session(), url_of(server) + '.missing', {}, slot, filepath)
+    assert slot.written == 0
\ No newline at end of file
@@ -0,0 +1,78 @@
+import pytest
+
+from data import Database, host_of, HISTORY_SCHEMA_VERSION
+from profiles import HostProfile, ConnectionStats, MAX_THROTTLE_RATE
+
+MB = 1024 * 1024
+
+
+def profile_of(*stats, range_support=True):
+    return HostProfile('example.com', downloads=len(stats), range_support=range_support, stats=stats)
+
+
+def test_recommend_without_record():
+    assert HostProfile('example.com').recommend(16) is None
+    # 不支持 Range 的主机只用一个连接
+    assert profile_of(ConnectionStats(8, 1, 10 * MB), range_support=False).recommend(16) == 1
+
+
+def test_recommend_keeps_connections_until_throughput_is_known():
+    assert profile_of(ConnectionStats(6, 1)).recommend(16) == 6
+    assert profile_of(ConnectionStats(6, 1)).recommend(4) == 4
+
+
+def test_recommend_probes_more_connections_when_best_is_largest():
+    assert profile_of(ConnectionStats(4, 1, 10 * MB)).recommend(16) == 8
+    assert profile_of(ConnectionStats(4, 1, 10 * MB)).recommend(6) == 6
+
+
+def test_recommend_prefers_fewer_connections_without_enough_gain():
+    profile = profile_of(ConnectionStats(4, 1, 10 * MB), ConnectionStats(8, 1, 10.5 * MB))
+    assert profile.recommend(16) == 4
+    profile = profile_of(ConnectionStats(4, 1, 10 * MB), ConnectionStats(8, 1, 20 * MB))
+    assert profile.recommend(16) == 16
+
+
+def test_recommend_stays_below_throttled_connections():
+    throttled = ConnectionStats(8, 1, 30 * MB, throttle_rate=MAX_THROTTLE_RATE * 2)
+    assert profile_of(ConnectionStats(4, 1, 10 * MB), throttled).recommend(16) == 4
+    assert profile_of(ConnectionStats(4, 1, 10 * MB), ConnectionStats(6, 1, throttle_rate=1.0)).recommend(16) == 4
+    # 所有试过的连接数都被限流时减少约四分之一
+    assert profile_of(throttled).recommend(16) == 6
+    assert profile_of(ConnectionStats(1, 1, throttle_rate=1.0)).recommend(16) == 1
+
+
+def test_host_of_includes_explicit_port():
+    assert host_of('https://Example.com/file') == 'example.com'
+    assert host_of('http://example.com:8080/file') == 'example.com:8080'
+    # 输入到一半的端口忽略
+    assert host_of('http://example.com:80a/file') == 'example.com'
+    assert host_of('') == ''
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return Database()
+
+
+def test_history_and_profiles_use_the_same_host(database):
+    url = 'http://127.0.0.1:8768/big.bin'
+    database.add_download_record('big.bin', url, 'ok', '2024-01-01 00:00:00', '2024-01-01 00:00:10', '20.00 MB',
+                                 bytes=20 * MB, duration=10)
+    HostProfile(host_of(url), 1, True, [ConnectionStats(4, 1, 2 * MB)]).save(database)
+    assert [row[0] for row in database.host_stats()] == ['127.0.0.1:8768']
+    assert [row[0] for row in database.get_host_profiles()] == ['127.0.0.1:8768']
+
+
+def test_migration_adds_port_to_version_1_hosts(database):
+    url = 'http://127.0.0.1:8768/big.bin'
+    database.add_download_record('big.bin', url, 'ok', '2024-01-01 00:00:00', '2024-01-01 00:00:10', '20.00 MB')
+    # 版本 1 的主机列只有主机名
+    with database.conn as conn:
+        conn.execute("UPDATE download_history SET host = '127.0.0.1'")
+        conn.execute("PRAGMA user_version = 1")
+    database.migrate_history_table()
+    assert database.conn.execute("SELECT host FROM download_history").fetchone()[0] == '127.0.0.1:8768'
+    assert database.conn.execute("PRAGMA user_version").fetchone()[0] == HISTORY_SCHEMA_VERSION
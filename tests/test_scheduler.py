@@ -0,0 +1,83 @@
+from progress import total_done, SEGMENT_WAITING, SEGMENT_RUNNING, SEGMENT_FAILED, SEGMENT_UNUSED
+from scheduler import Scheduler, plan_segments, MAX_REQUEUES
+
+MB = 1024 * 1024
+
+
+def test_plan_segments_covers_ranges_without_gaps():
+    ranges = [(0, 100 * MB - 1), (200 * MB, 210 * MB - 1)]
+    parts = plan_segments(ranges, threads=4, min_segment=MB, max_segment=8 * MB)
+    covered = sum(end - start + 1 for start, end in parts)
+    assert covered == 110 * MB
+    assert all(start <= end for start, end in parts)
+    assert all(end - start + 1 <= 8 * MB for start, end in parts)
+    # 分段按区间依次排列, 首尾与原区间对齐
+    assert parts[0][0] == 0 and parts[-1][1] == 210 * MB - 1
+
+
+def test_plan_segments_respects_min_segment():
+    parts = plan_segments([(0, 4 * MB - 1)], threads=16, min_segment=MB, max_segment=64 * MB)
+    assert parts == [(0, MB - 1), (MB, 2 * MB - 1), (2 * MB, 3 * MB - 1), (3 * MB, 4 * MB - 1)]
+
+
+def test_next_segment_then_steal_largest_running_segment():
+    scheduler = Scheduler([(0, 8 * MB - 1)], threads=1, min_segment=MB, max_segment=4 * MB)
+    scheduler.limit.value = 8
+    assert scheduler.count.value == 4
+    for expected in range(4):
+        scheduler.add_worker()
+        assert scheduler.next_segment() == expected
+    # 等待队列为空后拆分剩余最多的分段: 第一个分段已下载 1MB, 其余剩余相同时取下标最小的
+    scheduler.progress[0].done = MB
+    scheduler.add_worker()
+    stolen = scheduler.next_segment()
+    assert stolen == 4
+    victim, slot = scheduler.progress[1], scheduler.progress[stolen]
+    assert (slot.start, slot.end) == (3 * MB, 4 * MB - 1)
+    assert victim.end == 3 * MB - 1
+    assert slot.state == SEGMENT_RUNNING
+
+
+def test_steal_keeps_halves_above_min_segment():
+    scheduler = Scheduler([(0, 3 * MB - 1)], threads=1, min_segment=2 * MB, max_segment=4 * MB)
+    scheduler.add_worker()
+    assert scheduler.next_segment() == 0
+    scheduler.add_worker()
+    # 剩余 3MB 不够拆成两个 2MB 的分段, 新 worker 领取不到分段并减去计数
+    assert scheduler.next_segment() is None
+    assert scheduler.workers.value == 1
+
+
+def test_segments_only_returns_used_slots():
+    scheduler = Scheduler([(0, 64 * MB - 1)], threads=2, min_segment=MB, max_segment=16 * MB)
+    assert len(scheduler.progress) > scheduler.count.value
+    segments = scheduler.segments()
+    assert len(segments) == scheduler.count.value
+    assert all(slot.state == SEGMENT_WAITING for slot in segments)
+    assert scheduler.progress[scheduler.count.value].state == SEGMENT_UNUSED
+    segments[0].done = MB
+    assert total_done(scheduler.segments()) == MB
+
+
+def test_failed_segment_is_requeued_before_giving_up():
+    scheduler = Scheduler([(0, MB - 1)], threads=1, min_segment=MB, max_segment=MB)
+    scheduler.add_worker()
+    index = scheduler.next_segment()
+    for _ in range(MAX_REQUEUES):
+        assert scheduler.fail(index)
+        assert scheduler.progress[index].state == SEGMENT_WAITING
+        assert scheduler.has_work()
+        assert scheduler.next_segment() == index
+    assert not scheduler.fail(index)
+    assert scheduler.progress[index].state == SEGMENT_FAILED
+    assert scheduler.next_segment() is None
+
+
+def test_worker_above_limit_gets_no_segment():
+    scheduler = Scheduler([(0, 16 * MB - 1)], threads=4, min_segment=MB, max_segment=MB)
+    for _ in range(3):
+        scheduler.add_worker()
+    scheduler.limit.value = 2
+    assert scheduler.next_segment() is None
+    assert scheduler.workers.value == 2
+    assert scheduler.next_segment() is not None
@@ -0,0 +1,96 @@
+import os
+import errno
+
+import pytest
+
+import storage
+from storage import allocate_file, CoalescingWriter, InsufficientSpaceError, WriterThread
+
+
+def failing_fallocate(code):
+    def posix_fallocate(fd, offset, length):
+        raise OSError(code, os.strerror(code))
+    return posix_fallocate
+
+
+def test_allocate_file_reserves_full_size(tmp_path):
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, 1024 * 1024)
+    assert os.path.getsize(filepath) == 1024 * 1024
+
+
+def test_allocate_file_keeps_existing_content(tmp_path):
+    filepath = tmp_path / 'file.bin'
+    filepath.write_bytes(b'abc')
+    allocate_file(str(filepath), 10)
+    assert filepath.read_bytes() == b'abc' + b'\0' * 7
+
+
+@pytest.mark.skipif(not hasattr(os, 'posix_fallocate'), reason='posix_fallocate 不可用')
+@pytest.mark.parametrize('code', [errno.EOPNOTSUPP, errno.EINVAL])
+def test_allocate_file_falls_back_when_unsupported(tmp_path, monkeypatch, code):
+    monkeypatch.setattr(os, 'posix_fallocate', failing_fallocate(code))
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, 4096)
+    assert os.path.getsize(filepath) == 4096
+
+
+@pytest.mark.skipif(not hasattr(os, 'posix_fallocate'), reason='posix_fallocate 不可用')
+def test_allocate_file_reports_no_space(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'posix_fallocate', failing_fallocate(errno.ENOSPC))
+    with pytest.raises(InsufficientSpaceError):
+        allocate_file(str(tmp_path / 'file.bin'), 4096)
+
+
+@pytest.mark.skipif(not hasattr(os, 'posix_fallocate'), reason='posix_fallocate 不可用')
+def test_allocate_file_propagates_other_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'posix_fallocate', failing_fallocate(errno.EIO))
+    with pytest.raises(OSError) as info:
+        allocate_file(str(tmp_path / 'file.bin'), 4096)
+    assert info.value.errno == errno.EIO
+
+
+def test_coalescing_writer_error_is_not_sticky(tmp_path, monkeypatch):
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, 8192)
+    real_pwrite = storage.pwrite
+    failures = [OSError(errno.EIO, 'I/O error')]
+
+    def flaky_pwrite(fd, data, offset):
+        if failures:
+            raise failures.pop()
+        real_pwrite(fd, data, offset)
+    monkeypatch.setattr(storage, 'pwrite', flaky_pwrite)
+
+    flushed = []
+    with pytest.raises(OSError):
+        with CoalescingWriter(filepath, 0, 1024, on_flush=flushed.append) as writer:
+            writer.write(b'a' * 4096)
+    # 丢弃的数据不报告进度
+    assert flushed == []
+
+    # 同一文件重试时新建的 writer 不受之前错误的影响
+    with CoalescingWriter(filepath, 0, 1024, on_flush=flushed.append) as writer:
+        writer.write(b'b' * 4096)
+    assert flushed[-1] == 4096
+    with open(filepath, 'rb') as f:
+        assert f.read(4096) == b'b' * 4096
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_writer_thread_drain_fails_when_thread_died(tmp_path):
+    filepath = str(tmp_path / 'file.bin')
+    allocate_file(filepath, 4096)
+    thread = WriterThread(filepath)
+    thread.start()
+
+    def broken_callback(offset):
+        raise RuntimeError('callback failed')
+    thread.submit(object(), 0, b'x' * 4096, broken_callback)
+    thread.join(5)
+    assert not thread.is_alive()
+    with pytest.raises(OSError):
+        thread.drain()
+    with pytest.raises(OSError):
+        thread.submit(object(), 0, b'x')
+    os.close(thread.fd)
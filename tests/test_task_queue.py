@@ -0,0 +1,68 @@
+from task_queue import DownloadQueue
+
+
+def test_schedule_respects_active_limit_and_budget():
+    queue = DownloadQueue(max_active=2, max_connections=8)
+    for task in 'abc':
+        queue.add(task, 8)
+    # 预算平均分给这一轮能启动的两个任务
+    assert queue.schedule() == [('a', 4), ('b', 4)]
+    assert queue.queued == ['c']
+    assert queue.schedule() == []
+    queue.release('a')
+    assert queue.schedule() == [('c', 4)]
+
+
+def test_schedule_gives_at_most_requested_connections():
+    queue = DownloadQueue(max_active=3, max_connections=16)
+    queue.add('a', 2)
+    queue.add('b', 10)
+    assert queue.schedule() == [('a', 2), ('b', 10)]
+    assert queue.used_connections == 12
+
+
+def test_schedule_waits_when_budget_is_used_up():
+    queue = DownloadQueue(max_active=3, max_connections=4)
+    queue.add('a', 4)
+    assert queue.schedule() == [('a', 4)]
+    queue.add('b', 4)
+    assert queue.schedule() == []
+    queue.resize('a', 1)
+    assert queue.schedule() == [('b', 3)]
+
+
+def test_add_orders_by_priority_then_arrival():
+    queue = DownloadQueue()
+    queue.add('low', 1, priority=0)
+    queue.add('high', 1, priority=5)
+    queue.add('high2', 1, priority=5)
+    queue.add('mid', 1, priority=3)
+    assert queue.queued == ['high', 'high2', 'mid', 'low']
+
+
+def test_move_inherits_neighbour_priority():
+    queue = DownloadQueue()
+    queue.add('a', 1, priority=5)
+    queue.add('b', 1, priority=0)
+    queue.move('b', -1)
+    assert queue.queued == ['b', 'a']
+    assert queue.priority['b'] == 5
+    # 之后加入的同优先级任务排在它们后面
+    queue.add('c', 1, priority=5)
+    assert queue.queued == ['b', 'a', 'c']
+    # 超出范围时停在队首或队尾
+    queue.move('c', 10)
+    assert queue.queued == ['b', 'a', 'c']
+    queue.move('c', -10)
+    assert queue.queued == ['c', 'b', 'a']
+
+
+def test_remove_forgets_task():
+    queue = DownloadQueue(max_active=1)
+    queue.add('a', 1)
+    queue.add('b', 1)
+    queue.schedule()
+    queue.remove('a')
+    queue.remove('b')
+    assert queue.queued == [] and queue.running == {}
+    assert queue.schedule() == []
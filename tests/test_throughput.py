@@ -0,0 +1,114 @@
+import pytest
+
+import throughput
+from progress import SEGMENT_RUNNING, SEGMENT_DONE
+from scheduler import Scheduler
+from throughput import ThroughputTracker, format_speed, format_eta, format_spread
+
+MB = 1024 * 1024
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throughput, 'time', clock)
+    return clock
+
+
+def make_tracker(segments=4):
+    scheduler = Scheduler([(0, segments * 16 * MB - 1)], segments, min_segment=16 * MB, max_segment=16 * MB)
+    slots = scheduler.segments()
+    for slot in slots:
+        slot.state = SEGMENT_RUNNING
+    return ThroughputTracker(scheduler, interval=1.0, history=5, smoothing=2.0), slots
+
+
+def test_speed_is_bytes_per_interval(clock):
+    tracker, slots = make_tracker()
+    clock.now += 0.5
+    # 不足一个采样间隔
+    assert not tracker.update()
+    clock.now += 1.5
+    slots[0].done += 4 * MB
+    assert tracker.update()
+    assert tracker.speed == 2 * MB
+    # 第一个样本直接作为平滑速度
+    assert tracker.smoothed == 2 * MB
+    assert tracker.total == 4 * MB
+
+
+def test_smoothed_speed_follows_changes_gradually(clock):
+    tracker, slots = make_tracker()
+    clock.now += 1.0
+    slots[0].done += 2 * MB
+    tracker.update()
+    clock.now += 1.0
+    slots[0].done += 6 * MB
+    tracker.update()
+    assert tracker.speed == 6 * MB
+    assert 2 * MB < tracker.smoothed < 6 * MB
+
+
+def test_lost_bytes_do_not_give_negative_speed(clock):
+    tracker, slots = make_tracker()
+    clock.now += 1.0
+    slots[0].done += 2 * MB
+    tracker.update()
+    # 重试时扣除没有写入的字节
+    clock.now += 1.0
+    slots[0].done -= MB
+    tracker.update()
+    assert tracker.speed == 0
+
+
+def test_eta_uses_smoothed_speed(clock):
+    tracker, slots = make_tracker()
+    assert tracker.eta(64 * MB) is None
+    clock.now += 1.0
+    slots[0].done += 4 * MB
+    tracker.update()
+    assert tracker.eta(64 * MB) == pytest.approx(15.0)
+    assert tracker.eta(None) is None
+
+
+def test_history_and_sparkline_are_bounded(clock):
+    tracker, slots = make_tracker()
+    for step in range(8):
+        clock.now += 1.0
+        slots[step % 4].done += (step + 1) * MB
+        tracker.update()
+    assert list(tracker.rates) == [4 * MB, 5 * MB, 6 * MB, 7 * MB, 8 * MB]
+    assert tracker.sparkline() == '▅▆▇██'
+    assert tracker.sparkline(width=2) == '██'
+
+
+def test_segment_speeds_and_spread(clock):
+    tracker, slots = make_tracker()
+    tracker.update(clock.now + 1.0)
+    for index, speed in enumerate((1, 2, 3, 8)):
+        slots[index].done += speed * MB
+    tracker.update(clock.now + 2.0)
+    assert tracker.segment_speeds() == {0: MB, 1: 2 * MB, 2: 3 * MB, 3: 8 * MB}
+    assert tracker.spread() == (MB, 3 * MB, 8 * MB)
+    # 结束的分段不再计入
+    slots[3].state = SEGMENT_DONE
+    tracker.update(clock.now + 3.0)
+    assert 3 not in tracker.segment_speeds()
+
+
+def test_formatting():
+    assert format_speed(512) == '512B/s'
+    assert format_speed(1.5 * MB) == '1.50MB/s'
+    assert format_eta(None) == '--:--'
+    assert format_eta(75) == '01:15'
+    assert format_eta(3725) == '1:02:05'
+    assert format_spread(None) == ''
+    assert format_spread((1024, MB, MB)) == '1.00KB/s/1.00MB/s/1.00MB/s'
@@ -0,0 +1,36 @@
+import base64
+import hashlib
+
+from progress import create_progress
+from verify import choose_digest, contiguous_prefix, digest_matches
+
+DATA = b'multi-process downloader'
+
+
+def test_digest_matches_hex_and_base64():
+    digest = hashlib.sha256(DATA)
+    assert digest_matches(hashlib.sha256(DATA), digest.hexdigest())
+    assert digest_matches(hashlib.sha256(DATA), digest.hexdigest().upper())
+    assert digest_matches(hashlib.sha256(DATA), base64.b64encode(digest.digest()).decode())
+    # Digest 头中的值可能带引号和空白
+    assert digest_matches(hashlib.sha256(DATA), f' "{digest.hexdigest()}" ')
+
+
+def test_digest_mismatch():
+    assert not digest_matches(hashlib.md5(DATA), hashlib.md5(b'other').hexdigest())
+    assert not digest_matches(hashlib.md5(DATA), base64.b64encode(hashlib.md5(b'other').digest()).decode())
+
+
+def test_choose_strongest_digest():
+    assert choose_digest({'md5': 'a', 'sha-256': 'b'}) == ('sha256', 'b')
+    assert choose_digest({'crc32c': 'a'}) is None
+
+
+def test_contiguous_prefix_follows_written_bytes():
+    progress = create_progress([(0, 9), (10, 19), (20, 29)])
+    assert contiguous_prefix(progress) == 0
+    progress[1].written = 10
+    assert contiguous_prefix(progress) == 0
+    progress[0].written = 10
+    progress[2].written = 4
+    assert contiguous_prefix(progress) == 24
@@ -0,0 +1,155 @@
+import math
+import time
+
+from collections import deque
+
+from progress import total_done, SEGMENT_RUNNING
+
+
+# 采样间隔（秒）, 以及任务和每个分段保留的样本数
+SAMPLE_INTERVAL = 0.5
+HISTORY = 60
+SEGMENT_HISTORY = 10
+# 平滑速度的时间常数（秒）, 越大越稳定, 对速度变化的反应越慢
+SMOOTHING = 3.0
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+
+class ThroughputTracker:
+    """
+    跟踪一个下载任务的吞吐量。
+
+    定期从调度器的共享内存进度数组采样, 任务和每个正在下载的分段各保留一个定长的环形缓冲区,
+    据此计算瞬时速度、指数平滑后的速度、剩余时间、最近一段时间的速度曲线,
+    以及各分段之间的速度差异（调整连接数时用来判断慢的是服务器整体还是个别连接）。
+
+    只读取进度数组, 可以在任何进程中使用, 调用方按刷新频率调用 update 即可, 不足一个采样间隔时直接返回。
+    """
+    def __init__(self, scheduler, interval=SAMPLE_INTERVAL, history=HISTORY, smoothing=SMOOTHING):
+        """
+        Args:
+            scheduler (Scheduler): 任务的分段调度器, 每次只遍历其中已使用的槽位。
+            interval (float, optional): 采样间隔（秒）。默认为 SAMPLE_INTERVAL。
+            history (int, optional): 保留的样本数, 速度曲线覆盖 interval * history 秒。默认为 HISTORY。
+            smoothing (float, optional): 平滑速度的时间常数（秒）。默认为 SMOOTHING。
+
+        """
+        self.scheduler = scheduler
+        self.interval = interval
+        self.smoothing = smoothing
+        now = time.monotonic()
+        self.samples = deque([(now, total_done(scheduler.segments()))], maxlen=history)
+        # 每个采样间隔的速度, 用于速度曲线
+        self.rates = deque(maxlen=history)
+        self.segments = {}
+        self.speed = 0.0
+        self.smoothed = 0.0
+
+    def update(self, now=None):
+        """
+        距上次采样超过 interval 时采样一次。
+
+        Returns:
+            bool: 本次是否采样。
+
+        """
+        now = time.monotonic() if now is None else now
+        last_time, last_total = self.samples[-1]
+        elapsed = now - last_time
+        if elapsed < self.interval:
+            return False
+        progress = self.scheduler.segments()
+        total = total_done(progress)
+        # 分段重试时已接收但没有写入的字节会被扣除, 速度不计为负数
+        self.speed = max(0, total - last_total) / elapsed
+        if not self.rates:
+            self.smoothed = self.speed
+        else:
+            self.smoothed += (1 - math.exp(-elapsed / self.smoothing)) * (self.speed - self.smoothed)
+        self.samples.append((now, total))
+        self.rates.append(self.speed)
+        for index, slot in enumerate(progress):
+            if slot.state != SEGMENT_RUNNING:
+                self.segments.pop(index, None)
+                continue
+            samples = self.segments.get(index)
+            if samples is None:
+                samples = self.segments[index] = deque(maxlen=SEGMENT_HISTORY)
+            samples.append((now, slot.done))
+        return True
+
+    @property
+    def total(self):
+        return self.samples[-1][1]
+
+    def eta(self, file_size):
+        """
+        按平滑速度估算剩余时间。
+
+        Returns:
+            float | None: 剩余秒数, 文件大小未知或速度为0时返回None。
+
+        """
+        if file_size is None or self.smoothed <= 0:
+            return None
+        return max(0, file_size - self.total) / self.smoothed
+
+    def sparkline(self, width=20):
+        """
+        Returns:
+            str: 最近 width 个采样间隔的速度曲线, 以最快的一次为满格。
+        """
+        rates = list(self.rates)[-width:]
+        peak = max(rates, default=0)
+        if peak <= 0:
+            return SPARK_CHARS[0] * len(rates)
+        return ''.join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, int(rate / peak * len(SPARK_CHARS)))] for rate in rates)
+
+    def segment_speeds(self):
+        """
+        Returns:
+            Dict[int, float]: 正在下载的分段在最近 SEGMENT_HISTORY 个样本内的速度（字节/秒）, 样本不足两个的分段不计。
+        """
+        speeds = {}
+        for index, samples in self.segments.items():
+            if len(samples) < 2:
+                continue
+            (start_time, start_done), (end_time, end_done) = samples[0], samples[-1]
+            speeds[index] = max(0, end_done - start_done) / (end_time - start_time)
+        return speeds
+
+    def spread(self):
+        """
+        Returns:
+            Tuple[float, float, float] | None: 正在下载的分段速度的最小值、中位数和最大值, 没有数据时返回None。
+        """
+        speeds = sorted(self.segment_speeds().values())
+        if not speeds:
+            return None
+        return speeds[0], speeds[len(speeds) // 2], speeds[-1]
+
+
+def format_speed(speed):
+    for power, unit in ((3, 'GB'), (2, 'MB'), (1, 'KB')):
+        if speed >= 1024 ** power:
+            return f'{speed / 1024 ** power:.2f}{unit}/s'
+    return f'{speed:.0f}B/s'
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+    return f'{seconds // 60:02d}:{seconds % 60:02d}'
+
+
+def format_spread(spread):
+    """
+    Returns:
+        str: 分段速度的 最小/中位数/最大, 没有数据时为空字符串。
+    """
+    if spread is None:
+        return ''
+    return '/'.join(format_speed(speed) for speed in spread)
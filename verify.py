@@ -0,0 +1,137 @@
+import base64
+import hashlib
+import threading
+
+from journal import merge_ranges
+
+
+# 服务器提供多个校验值时按此顺序选择
+ALGORITHMS = {
+    'sha-512': 'sha512',
+    'sha-256': 'sha256',
+    'sha': 'sha1',
+    'md5': 'md5',
+}
+
+READ_SIZE = 1024 * 1024
+
+
+def choose_digest(digests):
+    """
+    从服务器提供的校验值中选择一个可用的算法。
+
+    Returns:
+        Tuple[str, str] | None: hashlib 算法名和期望值, 没有可用校验值时返回None。
+
+    """
+    for name, algorithm in ALGORITHMS.items():
+        if digests.get(name):
+            return algorithm, digests[name]
+    return None
+
+
+def digest_matches(hash_object, expected):
+    """
+    期望值可能是 base64（Content-MD5、Digest）也可能是十六进制, 两种形式都接受。
+    """
+    expected = expected.strip().strip('"')
+    if hash_object.hexdigest() == expected.lower():
+        return True
+    return base64.b64encode(hash_object.digest()).decode('ascii') == expected
+
+
+def contiguous_prefix(progress):
+    """
+    计算从文件开头起连续写入磁盘的字节数。
+    """
+    ranges = []
+    for slot in progress:
+        if slot.written > 0:
+            ranges.append((slot.start, min(slot.start + slot.written, slot.end + 1) - 1))
+    merged = merge_ranges(ranges)
+    if not merged or merged[0][0] != 0:
+        return 0
+    return merged[0][1] + 1
+
+
+class IncrementalVerifier(threading.Thread):
+    """
+    下载过程中在后台线程里计算校验值。
+
+    分段完成的顺序不固定, 这里维护一个只前进的哈希游标, 跟随“从文件开头起连续写入的前缀”,
+    每次只读取新落盘的数据（此时仍在页缓存中）。最后一个字节落盘后校验值立即可用,
+    不需要下载结束后再把整个文件读一遍。
+    """
+    def __init__(self, filepath, file_size, algorithm, expected, scheduler, interval=0.2):
+        """
+        Args:
+            filepath (str): 目标文件路径。
+            file_size (int): 文件大小（字节）。
+            algorithm (str): hashlib 算法名。
+            expected (str): 服务器提供的期望值。
+            scheduler (Scheduler): 任务的分段调度器, 每次只遍历其中已使用的槽位。
+            interval (float, optional): 没有新数据时的轮询间隔（秒）。
+
+        """
+        super().__init__(daemon=True)
+        self.filepath = filepath
+        self.file_size = file_size
+        self.algorithm = algorithm
+        self.expected = expected
+        self.scheduler = scheduler
+        self.interval = interval
+        self.hash = hashlib.new(algorithm)
+        self.position = 0
+        self.stopped = threading.Event()
+
+    def advance(self):
+        prefix = contiguous_prefix(self.scheduler.segments())
+        if prefix <= self.position:
+            return
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.position)
+            while self.position < prefix:
+                data = f.read(min(READ_SIZE, prefix - self.position))
+                if not data:
+                    break
+                self.hash.update(data)
+                self.position += len(data)
+
+    def run(self):
+        while self.position < self.file_size and not self.stopped.is_set():
+            self.advance()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+    def finish(self):
+        """
+        停止后台线程并补算剩余的已完成数据。
+
+        Returns:
+            bool | None: 校验通过返回True, 不匹配返回False, 文件未完整下载时返回None。
+
+        """
+        self.stop()
+        self.join()
+        self.advance()
+        if self.position < self.file_size:
+            return None
+        return digest_matches(self.hash, self.expected)
+
+
+def start_verifier(filepath, info, scheduler):
+    """
+    按服务器提供的校验值启动后台校验线程。
+
+    Returns:
+        IncrementalVerifier | None: 服务器未提供可用校验值时返回None。
+
+    """
+    chosen = choose_digest(info.digests)
+    if chosen is None or info.file_size is None:
+        return None
+    verifier = IncrementalVerifier(filepath, info.file_size, chosen[0], chosen[1], scheduler)
+    verifier.start()
+    return verifier